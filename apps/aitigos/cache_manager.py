@@ -10,6 +10,9 @@ class AitigosCacheManager:
     COMPANY_CONFIG_TIMEOUT = 900    # 15 minutos
     API_RESPONSE_TIMEOUT = 300      # 5 minutos
     PRODUCTS_SESSION_TIMEOUT = 3600 # 1 hora
+    EXTRACTION_STATUS_TIMEOUT = 3600 # 1 hora
+    PUSH_PROGRESS_TIMEOUT = 3600    # 1 hora
+    PUSHED_PRODUCT_TIMEOUT = 86400  # 24 horas
     
     # ===== CACHE KEYS =====
     @staticmethod
@@ -24,6 +27,26 @@ class AitigosCacheManager:
     def get_products_session_cache_key(user_id, session_id):
         return f"aitigos:products_session:user:{user_id}:session:{session_id}"
     
+    @staticmethod
+    def get_products_session_lock_key(user_id, session_id):
+        return f"aitigos:products_session_lock:user:{user_id}:session:{session_id}"
+    
+    @staticmethod
+    def get_extraction_status_cache_key(job_id):
+        return f"aitigos:extraction_job:{job_id}"
+    
+    @staticmethod
+    def get_extraction_cache_counter_key(counter):
+        return f"aitigos:extraction_cache:{counter}"
+    
+    @staticmethod
+    def get_push_progress_cache_key(push_id, platform):
+        return f"aitigos:push_progress:{push_id}:{platform}"
+    
+    @staticmethod
+    def get_pushed_product_cache_key(company_id, key_type, value):
+        return f"aitigos:pushed_product:company:{company_id}:{key_type}:{value}"
+    
     # ===== DROPDOWN DATA CACHE =====
     @staticmethod
     def get_cached_categories(company_id):
@@ -97,6 +120,81 @@ class AitigosCacheManager:
         cache_key = AitigosCacheManager.get_products_session_cache_key(user_id, session_id)
         cache.set(cache_key, products_data, AitigosCacheManager.PRODUCTS_SESSION_TIMEOUT)
     
+    @staticmethod
+    def acquire_products_session_lock(user_id, session_id, timeout=10):
+        cache_key = AitigosCacheManager.get_products_session_lock_key(user_id, session_id)
+        return cache.add(cache_key, 1, timeout)
+    
+    @staticmethod
+    def release_products_session_lock(user_id, session_id):
+        cache_key = AitigosCacheManager.get_products_session_lock_key(user_id, session_id)
+        cache.delete(cache_key)
+    
+    # ===== EXTRACTION JOBS =====
+    @staticmethod
+    def get_cached_extraction_status(job_id):
+        cache_key = AitigosCacheManager.get_extraction_status_cache_key(job_id)
+        return cache.get(cache_key)
+    
+    @staticmethod
+    def cache_extraction_status(job_id, status_data):
+        cache_key = AitigosCacheManager.get_extraction_status_cache_key(job_id)
+        cache.set(cache_key, status_data, AitigosCacheManager.EXTRACTION_STATUS_TIMEOUT)
+    
+    @staticmethod
+    def increment_extraction_cache_counter(counter):
+        cache_key = AitigosCacheManager.get_extraction_cache_counter_key(counter)
+        cache.add(cache_key, 0, None)
+        try:
+            return cache.incr(cache_key)
+        except ValueError:
+            cache.set(cache_key, 1, None)
+            return 1
+    
+    @staticmethod
+    def get_extraction_cache_counters():
+        counters = ['hits', 'misses']
+        cache_keys = [AitigosCacheManager.get_extraction_cache_counter_key(c) for c in counters]
+        values = cache.get_many(cache_keys)
+        return {
+            counter: values.get(cache_key, 0)
+            for counter, cache_key in zip(counters, cache_keys)
+        }
+    
+    # ===== ENVIO DE PRODUTOS =====
+    @staticmethod
+    def cache_push_progress(push_id, platform, progress_data):
+        cache_key = AitigosCacheManager.get_push_progress_cache_key(push_id, platform)
+        cache.set(cache_key, progress_data, AitigosCacheManager.PUSH_PROGRESS_TIMEOUT)
+    
+    @staticmethod
+    def get_cached_push_progress(push_id, platforms):
+        cache_keys = {
+            AitigosCacheManager.get_push_progress_cache_key(push_id, platform): platform
+            for platform in platforms
+        }
+        values = cache.get_many(list(cache_keys))
+        return {cache_keys[cache_key]: value for cache_key, value in values.items()}
+    
+    @staticmethod
+    def get_pushed_products(company_id, keys):
+        """keys: lista de (tipo, valor); devolve {(tipo, valor): product_id} dos já enviados"""
+        cache_keys = {
+            AitigosCacheManager.get_pushed_product_cache_key(company_id, key_type, value): (key_type, value)
+            for key_type, value in keys
+        }
+        if not cache_keys:
+            return {}
+        values = cache.get_many(list(cache_keys))
+        return {cache_keys[cache_key]: product_id for cache_key, product_id in values.items()}
+    
+    @staticmethod
+    def mark_products_pushed(company_id, keys, product_id):
+        cache.set_many({
+            AitigosCacheManager.get_pushed_product_cache_key(company_id, key_type, value): product_id
+            for key_type, value in keys
+        }, AitigosCacheManager.PUSHED_PRODUCT_TIMEOUT)
+    
     # ===== INVALIDAÇÃO =====
     @staticmethod
     def invalidate_dropdown_cache(company_id, data_type=None):
@@ -0,0 +1,125 @@
+# apps/aitigos/fake_extractor.py
+"""
+Serviço de extração falso para desenvolvimento e testes locais.
+
+Implementa o fluxo usado pelo ExtractionJobService: POST /process devolve um
+job_id, GET /job/<id> responde 'processing' durante `running_polls` consultas
+e depois 'completed', e GET /job/<id>/json devolve `state.result` no formato
+do serviço real (model_results -> gemini -> result).
+Para o usar, arrancar com `manage.py run_fake_extractor` e definir
+AITIGOS_EXTRACTION_API_URL=http://127.0.0.1:<porta>.
+"""
+import json
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+
+JOB_PATTERN = re.compile(r'^/job/(\w+)(/json)?$')
+
+
+def sample_result():
+    """Encomenda com um produto, duas cores e três tamanhos com quantidade"""
+    return {
+        'order_info': {
+            'supplier': 'Fornecedor Teste',
+            'document_type': 'Encomenda',
+            'order_number': 'ENC-1',
+            'date': '2026-01-15',
+            'customer': 'Loja',
+            'brand': 'Marca',
+            'season': 'SS26',
+        },
+        'products': [{
+            'name': 'Camisola',
+            'material_code': '1234567',
+            'category': 'WOMAN KNIT',
+            'gender': 'female',
+            'composition': '100% algodão',
+            'colors': [
+                {'color_code': '010', 'color_name': 'Preto', 'unit_price': 10.0,
+                 'sizes': [{'size': 'S', 'quantity': 2}, {'size': 'M', 'quantity': 1}]},
+                {'color_code': '020', 'color_name': 'Branco', 'unit_price': 10.0,
+                 'sizes': [{'size': 'M', 'quantity': 3}, {'size': 'L', 'quantity': 0}]},
+            ],
+        }],
+    }
+
+
+class FakeExtractorState:
+    def __init__(self, result=None, running_polls=1):
+        self.result = result if result is not None else sample_result()
+        self.running_polls = running_polls
+        self.jobs = {}
+        self.documents = []
+        self._ids = count(1)
+        self._lock = threading.Lock()
+
+    def create_job(self, document: bytes) -> str:
+        with self._lock:
+            job_id = f"job{next(self._ids)}"
+            self.jobs[job_id] = {'polls': 0}
+            self.documents.append(document)
+            return job_id
+
+    def poll_job(self, job_id):
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            job['polls'] += 1
+            if job['polls'] > self.running_polls:
+                return {'status': 'completed', 'progress': 100}
+            return {'status': 'processing', 'progress': int(100 * job['polls'] / (self.running_polls + 1))}
+
+
+class FakeExtractorHandler(BaseHTTPRequestHandler):
+    state: FakeExtractorState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path != '/process':
+            self._send_json({'detail': 'Not Found'}, status=404)
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        document = self.rfile.read(length)
+        if b'%PDF' not in document:
+            self._send_json({'detail': 'Ficheiro inválido'}, status=400)
+            return
+        self._send_json({'job_id': self.state.create_job(document)})
+
+    def do_GET(self):
+        match = JOB_PATTERN.match(self.path)
+        if not match:
+            self._send_json({'detail': 'Not Found'}, status=404)
+            return
+
+        job_id, wants_result = match.group(1), bool(match.group(2))
+        status = self.state.poll_job(job_id) if not wants_result else self.state.jobs.get(job_id)
+        if status is None:
+            self._send_json({'detail': 'Job não encontrado'}, status=404)
+            return
+
+        if wants_result:
+            self._send_json({'job_id': job_id, 'model_results': {'gemini': {'result': self.state.result}}})
+        else:
+            self._send_json(dict(status, job_id=job_id))
+
+
+def make_fake_extractor_server(host='127.0.0.1', port=0, **state_options):
+    """Cria o servidor (porta 0 = porta livre); o estado fica em server.state"""
+    state = FakeExtractorState(**state_options)
+    handler = type('BoundFakeExtractorHandler', (FakeExtractorHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.state = state
+    return server
@@ -0,0 +1,216 @@
+# apps/aitigos/grid.py
+import math
+from typing import Any, Callable, Dict, List, Optional
+
+
+INVALID_DATE_VALUES = ('', 'none', 'null', 'nan')
+
+
+def _is_valid_date(value) -> bool:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return False
+    return str(value).strip().lower() not in INVALID_DATE_VALUES
+
+
+def _to_float(value) -> Optional[float]:
+    if value is None or value == '':
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class VariantRecord:
+    __slots__ = (
+        'reference', 'color_code', 'color_name', 'size', 'description',
+        'quantity', 'unit_price', 'sales_price', 'barcode'
+    )
+
+    def __init__(self, detail: Dict):
+        self.reference = detail.get('reference', '')
+        self.color_code = detail.get('color_code', '')
+        self.color_name = detail.get('color_name', '')
+        self.size = detail.get('size', '')
+        self.description = detail.get('description', '')
+        self.quantity = detail.get('quantity', 0)
+        self.unit_price = detail.get('unit_price', 0)
+        self.sales_price = detail.get('sales_price', 0)
+        self.barcode = detail.get('barcode', '')
+
+    def to_dict(self) -> Dict:
+        return {
+            'reference': self.reference,
+            'color_code': self.color_code,
+            'color_name': self.color_name,
+            'size': self.size,
+            'description': self.description,
+            'quantity': self.quantity,
+            'unit_price': self.unit_price,
+            'sales_price': self.sales_price,
+            'barcode': self.barcode,
+        }
+
+
+class ProductRecord:
+    __slots__ = (
+        'material_code', 'name', 'composition', 'category', 'gender', 'brand',
+        'supplier', 'date', 'warehouse', 'integrated', 'variants'
+    )
+
+    def __init__(self, product: Dict, normalize_gender: Callable[[Any], str]):
+        self.material_code = product.get('material_code', '')
+        self.name = product.get('name', '')
+        self.composition = product.get('composition', '')
+        self.category = product.get('category', '')
+        self.gender = normalize_gender(product.get('gender', 'Homem'))
+        self.brand = product.get('brand', '')
+        self.supplier = product.get('supplier', '')
+        self.date = product.get('date', '')
+        self.warehouse = product.get('warehouse', '1')
+        self.integrated = product.get('integrated', '0')
+        self.variants = [VariantRecord(detail) for detail in product.get('details', [])]
+
+
+class OrderGrid:
+    """
+    Modelo leve da grelha de produtos do aitigos (sem pandas), usado pelas
+    edições da AitigosView e da ProductEditView; o índice de cada produto na
+    lista é o seu product_id.
+    """
+
+    def __init__(self, products: List[ProductRecord], normalize_gender: Callable[[Any], str]):
+        self.products = products
+        self.normalize_gender = normalize_gender
+
+    @classmethod
+    def from_json(cls, products_data: List[Dict], normalize_gender: Callable[[Any], str]) -> 'OrderGrid':
+        return cls([ProductRecord(product, normalize_gender) for product in products_data], normalize_gender)
+
+    @property
+    def variant_count(self) -> int:
+        return sum(len(product.variants) for product in self.products)
+
+    def shared_date(self) -> Optional[str]:
+        for product in self.products:
+            if _is_valid_date(product.date):
+                return str(product.date).strip()
+        return None
+
+    def to_json(self, shared_date: Optional[str] = None) -> List[Dict]:
+        date_to_use = shared_date or self.shared_date() or ''
+        return [{
+            'material_code': product.material_code,
+            'name': product.name,
+            'composition': product.composition,
+            'category': product.category,
+            'gender': self.normalize_gender(product.gender),
+            'brand': product.brand,
+            'supplier': product.supplier,
+            'date': date_to_use,
+            'warehouse': product.warehouse,
+            'integrated': product.integrated,
+            'details': [variant.to_dict() for variant in product.variants],
+        } for product in self.products]
+
+    # ===== OPERAÇÕES =====
+    def apply_markup(self, markup: float, supplier: Optional[str] = None) -> int:
+        """sales_price = unit_price × markup, para todos os produtos ou só os de um fornecedor"""
+        updated = 0
+        for product in self.products:
+            matches = supplier is None or product.supplier == supplier
+            if not matches:
+                continue
+            for variant in product.variants:
+                variant.sales_price = (_to_float(variant.unit_price) or 0.0) * markup
+                updated += 1
+        return updated
+
+    def change_supplier(self, supplier_name: str) -> None:
+        for product in self.products:
+            product.supplier = supplier_name
+
+    def update_barcode_prefix(self, barcode_prefix: str) -> int:
+        if not barcode_prefix or len(barcode_prefix) != 2 or not barcode_prefix.isdigit():
+            raise ValueError('O prefixo do código de barras deve conter exatamente 2 dígitos')
+
+        updated = 0
+        for product in self.products:
+            for variant in product.variants:
+                barcode = variant.barcode
+                if barcode is None or (isinstance(barcode, float) and math.isnan(barcode)):
+                    continue
+                barcode_str = str(barcode).strip()
+                if not barcode_str:
+                    continue
+                variant.barcode = barcode_prefix + barcode_str.zfill(13)[2:]
+                updated += 1
+
+        shared_date = self.shared_date()
+        if shared_date:
+            for product in self.products:
+                product.date = shared_date
+        return updated
+
+    def delete_product(self, product_index: int) -> None:
+        if product_index < 0 or product_index >= len(self.products):
+            raise ValueError('Índice de produto fora dos limites')
+        del self.products[product_index]
+
+    def delete_variant(self, product_index: int, variant_index: int) -> None:
+        if product_index < 0 or variant_index < 0:
+            raise ValueError('Índices inválidos')
+        if product_index >= len(self.products) or variant_index >= len(self.products[product_index].variants):
+            raise ValueError('Índice de variante fora dos limites')
+        del self.products[product_index].variants[variant_index]
+
+    def delete_variant_with_reindexing(self, product_index: int, variant_index: int) -> None:
+        """
+        Remove a variante e renumera as restantes do produto: a referência passa a
+        <material>.<n> e o sequencial do código de barras (posições 4-7) a 100 + n.
+        """
+        if product_index < 0 or variant_index < 0:
+            raise ValueError('Índices inválidos')
+        if product_index >= len(self.products) or variant_index >= len(self.products[product_index].variants):
+            raise ValueError('Índice de variante fora dos limites')
+
+        variants = self.products[product_index].variants
+        first_reference = variants[0].reference
+        material_code = first_reference.split('.')[0] if '.' in first_reference else first_reference
+        del variants[variant_index]
+
+        for idx, variant in enumerate(variants):
+            new_sequence = idx + 1
+            variant.reference = f"{material_code}.{new_sequence}"
+
+            barcode_str = str(variant.barcode) if variant.barcode else ''
+            if len(barcode_str) >= 13:
+                # season (2) + fornecedor (2) + sequencial (3) + cor (3) + tamanho (3)
+                variant.barcode = f"{barcode_str[:4]}{str(100 + new_sequence).zfill(3)}{barcode_str[7:13]}"
+
+    def edit_product(self, product_index: int, product_data: Dict) -> None:
+        if product_index < 0 or product_index >= len(self.products):
+            raise ValueError('Índice de produto fora dos limites')
+
+        product = self.products[product_index]
+        current_date = product.date
+        if not product_data.get('date', '') and current_date:
+            product_data['date'] = current_date
+
+        product.material_code = product_data.get('material_code', '')
+        product.name = product_data.get('name', '')
+        product.composition = product_data.get('composition', '')
+        product.category = product_data.get('category', '')
+        product.gender = self.normalize_gender(product_data.get('gender', 'Homem'))
+        product.brand = product_data.get('brand', '')
+        product.supplier = product_data.get('supplier', '')
+        product.date = product_data.get('date', current_date)
+        product.integrated = product_data.get('integrated', '0')
+        product.warehouse = product_data.get('warehouse', '1')
+
+        variants = []
+        for detail in product_data.get('details', []):
+            variant = VariantRecord(detail)
+            variant.description = f"{product.name}[{variant.color_code}/{variant.size}]"
+            variants.append(variant)
+        product.variants = variants
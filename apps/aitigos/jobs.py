@@ -0,0 +1,17 @@
+# apps/aitigos/jobs.py
+from apps.jobs.registry import register
+
+from .services import ExtractionJobService, PushService
+
+
+@register('aitigos.extraction', max_attempts=2, lease_seconds=300)
+def run_extraction(job, context):
+    # O próprio ExtractionJob regista falhas e resultado; o job apenas o executa
+    ExtractionJobService.run_job(job.payload['extraction_job_id'])
+    return {'extraction_job_id': job.payload['extraction_job_id']}
+
+
+# Um envio não é repetido automaticamente: o Shopify não tem chave de idempotência
+@register('aitigos.push', max_attempts=1, lease_seconds=600)
+def run_push(job, context):
+    return PushService.run_background(job.payload, job.user_id)
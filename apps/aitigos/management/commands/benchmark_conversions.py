@@ -0,0 +1,238 @@
+# apps/aitigos/management/commands/benchmark_conversions.py
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+
+from apps.aitigos.grid import OrderGrid
+from apps.aitigos.services import ExtractionPayloadService
+from apps.aitigos.views import AitigosView
+
+
+def legacy_dataframes_to_json(view, products_df, variants_df):
+    """Conversão anterior: filtra o DataFrame de variantes uma vez por produto (O(produtos × variantes))"""
+    if products_df.empty:
+        return []
+
+    shared_date = None
+    for _, row in products_df.iterrows():
+        date_val = row.get('date', '')
+        if date_val and str(date_val).strip() and str(date_val).strip().lower() not in ['', 'none', 'null', 'nan']:
+            shared_date = str(date_val).strip()
+            break
+
+    result = []
+    for product in products_df.to_dict('records'):
+        product_variants = variants_df[variants_df['product_id'] == product['product_id']].to_dict('records')
+        result.append({
+            'material_code': product.get('material_code', ''),
+            'name': product.get('name', ''),
+            'composition': product.get('composition', ''),
+            'category': product.get('category', ''),
+            'gender': view.normalize_gender(product.get('gender', 'Homem')),
+            'brand': product.get('brand', ''),
+            'supplier': product.get('supplier', ''),
+            'date': shared_date or '',
+            'warehouse': product.get('warehouse', '1'),
+            'integrated': product.get('integrated', '0'),
+            'details': [{
+                'reference': variant.get('reference', ''),
+                'color_code': variant.get('color_code', ''),
+                'color_name': variant.get('color_name', ''),
+                'size': variant.get('size', ''),
+                'description': variant.get('description', ''),
+                'quantity': variant.get('quantity', 0),
+                'unit_price': variant.get('unit_price', 0),
+                'sales_price': variant.get('sales_price', 0),
+                'barcode': variant.get('barcode', ''),
+            } for variant in product_variants]
+        })
+    return result
+
+
+def legacy_json_to_dataframes(view, products_data):
+    """Grelha JSON → DataFrames de produtos e variantes, como a AitigosView fazia antes do OrderGrid"""
+    import pandas as pd
+
+    shared_date = next((product.get('date') for product in products_data if product.get('date')), None)
+    products_list = []
+    variants_list = []
+
+    for product_idx, product in enumerate(products_data):
+        products_list.append({
+            'product_id': product_idx,
+            'material_code': product.get('material_code', ''),
+            'name': product.get('name', ''),
+            'composition': product.get('composition', ''),
+            'category': product.get('category', ''),
+            'gender': view.normalize_gender(product.get('gender', 'Homem')),
+            'brand': product.get('brand', ''),
+            'supplier': product.get('supplier', ''),
+            'date': product.get('date', shared_date or ''),
+            'integrated': product.get('integrated', '0')
+        })
+        for var_idx, detail in enumerate(product.get('details', [])):
+            variants_list.append({
+                'product_id': product_idx,
+                'variant_id': var_idx,
+                'reference': detail.get('reference', ''),
+                'color_code': detail.get('color_code', ''),
+                'color_name': detail.get('color_name', ''),
+                'size': detail.get('size', ''),
+                'description': detail.get('description', ''),
+                'quantity': detail.get('quantity', 0),
+                'unit_price': detail.get('unit_price', 0),
+                'sales_price': detail.get('sales_price', 0),
+                'barcode': detail.get('barcode', ''),
+                'supplier': product.get('supplier', '')
+            })
+
+    products_df = pd.DataFrame(products_list)
+    variants_df = pd.DataFrame(variants_list)
+    if shared_date and not products_df.empty:
+        mask = (products_df['date'].isna()) | (products_df['date'] == '')
+        products_df.loc[mask, 'date'] = shared_date
+    return products_df, variants_df
+
+
+def pandas_round_trip(view, products, operation):
+    """Caminho com DataFrames: JSON → DataFrames → operação → JSON"""
+    import pandas as pd
+
+    products_df, variants_df = legacy_json_to_dataframes(view, products)
+    if operation == 'markup':
+        variants_df['sales_price'] = variants_df['unit_price'] * 2.5
+    elif operation == 'barcode_prefix':
+        variants_df['barcode'] = variants_df['barcode'].apply(
+            lambda barcode: barcode if pd.isna(barcode) or str(barcode).strip() == ''
+            else '56' + str(barcode).strip().zfill(13)[2:])
+        shared_date = ExtractionPayloadService.find_shared_date(products_df)
+        if shared_date:
+            products_df['date'] = shared_date
+    elif operation == 'delete_variant':
+        product_variants = variants_df[variants_df['product_id'] == 0]
+        variants_df = variants_df.drop(product_variants.index[0])
+    elif operation == 'delete_product':
+        products_df = products_df[products_df['product_id'] != 0].reset_index(drop=True)
+        variants_df = variants_df[variants_df['product_id'] != 0].copy()
+        variants_df['product_id'] = variants_df['product_id'] - 1
+        products_df['product_id'] = range(len(products_df))
+    return ExtractionPayloadService.dataframes_to_json(products_df, variants_df)
+
+
+def grid_round_trip(view, products, operation):
+    """Caminho sem pandas: JSON → OrderGrid → operação → JSON"""
+    grid = OrderGrid.from_json(products, view.normalize_gender)
+    if operation == 'markup':
+        grid.apply_markup(2.5)
+    elif operation == 'barcode_prefix':
+        grid.update_barcode_prefix('56')
+    elif operation == 'delete_variant':
+        grid.delete_variant(0, 0)
+    elif operation == 'delete_product':
+        grid.delete_product(0)
+    return grid.to_json()
+
+
+def build_sample_order(variant_count, variants_per_product=10):
+    """Encomenda sintética com o formato devolvido pela grelha do aitigos"""
+    sizes = ['XS', 'S', 'M', 'L', 'XL']
+    product_count = max(1, variant_count // variants_per_product)
+    products = []
+
+    for product_idx in range(product_count):
+        material_code = f"{100000 + product_idx}"
+        details = []
+        for variant_idx in range(variants_per_product):
+            color_code = str(variant_idx // len(sizes) + 1).zfill(3)
+            size = sizes[variant_idx % len(sizes)]
+            details.append({
+                'reference': f"{material_code}.{variant_idx + 1}",
+                'color_code': color_code,
+                'color_name': f"Cor {color_code}",
+                'size': size,
+                'description': f"Produto {product_idx}[{color_code}/{size}]",
+                'quantity': 1 + variant_idx % 3,
+                'unit_price': 10.0 + product_idx % 7,
+                'sales_price': 25.0 + product_idx % 7,
+                'barcode': f"56{material_code}{color_code}{str(variant_idx + 1).zfill(3)}"[:13],
+            })
+        products.append({
+            'material_code': material_code,
+            'name': f"Produto {product_idx}",
+            'composition': '100% Algodão',
+            'category': 'T-SHIRTS',
+            'gender': 'Homem',
+            'brand': 'Marca',
+            'supplier': 'Fornecedor',
+            'date': '2025-01-15',
+            'integrated': '0',
+            'details': details,
+        })
+    return products
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark das conversões JSON ⇄ tabela da grelha do aitigos"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', nargs='+', type=int, default=[100, 1000, 10000],
+                            help='Número de variantes por encomenda')
+        parser.add_argument('--repeat', type=int, default=5, help='Repetições por medição (melhor tempo)')
+
+    def _best_of(self, func, repeat):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best
+
+    def handle(self, *args, **options):
+        # Os logs por conversão distorcem as medições
+        logging.disable(logging.CRITICAL)
+        view = AitigosView()
+
+        try:
+            self.stdout.write(f"{'variantes':>10} {'anterior (ms)':>15} {'atual (ms)':>12} {'ganho':>8}")
+            for variant_count in options['sizes']:
+                products_df, variants_df = legacy_json_to_dataframes(view, build_sample_order(variant_count))
+
+                legacy = legacy_dataframes_to_json(view, products_df, variants_df)
+                current = ExtractionPayloadService.dataframes_to_json(products_df, variants_df)
+                if legacy != current:
+                    self.stderr.write(self.style.ERROR(f"Resultados divergentes para {variant_count} variantes"))
+                    return
+
+                legacy_time = self._best_of(
+                    lambda: legacy_dataframes_to_json(view, products_df, variants_df), options['repeat'])
+                current_time = self._best_of(
+                    lambda: ExtractionPayloadService.dataframes_to_json(products_df, variants_df), options['repeat'])
+
+                self.stdout.write(
+                    f"{variant_count:>10} {legacy_time * 1000:>15.2f} {current_time * 1000:>12.2f} "
+                    f"{legacy_time / current_time:>7.1f}x"
+                )
+
+            self.stdout.write("")
+            self.stdout.write(f"{'variantes':>10} {'operação':>15} {'pandas (ms)':>12} {'OrderGrid (ms)':>15} {'ganho':>8}")
+            for variant_count in options['sizes']:
+                products = build_sample_order(variant_count)
+                for operation in ('markup', 'barcode_prefix', 'delete_variant', 'delete_product'):
+                    if pandas_round_trip(view, products, operation) != grid_round_trip(view, products, operation):
+                        self.stderr.write(self.style.ERROR(
+                            f"Resultados divergentes em '{operation}' para {variant_count} variantes"))
+                        return
+
+                    pandas_time = self._best_of(
+                        lambda: pandas_round_trip(view, products, operation), options['repeat'])
+                    grid_time = self._best_of(
+                        lambda: grid_round_trip(view, products, operation), options['repeat'])
+
+                    self.stdout.write(
+                        f"{variant_count:>10} {operation:>15} {pandas_time * 1000:>12.2f} "
+                        f"{grid_time * 1000:>15.2f} {pandas_time / grid_time:>7.1f}x"
+                    )
+        finally:
+            logging.disable(logging.NOTSET)
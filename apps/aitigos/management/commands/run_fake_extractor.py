@@ -0,0 +1,27 @@
+# apps/aitigos/management/commands/run_fake_extractor.py
+from django.core.management.base import BaseCommand
+
+from apps.aitigos.fake_extractor import make_fake_extractor_server
+
+
+class Command(BaseCommand):
+    help = "Arranca um serviço de extração falso para testar o upload de documentos localmente"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8011)
+        parser.add_argument('--running-polls', type=int, default=2,
+                            help="Consultas de estado respondidas com 'processing' antes de concluir")
+
+    def handle(self, *args, **options):
+        server = make_fake_extractor_server(options['host'], options['port'],
+                                            running_polls=options['running_polls'])
+        host, port = server.server_address[:2]
+        self.stdout.write(f"Extrator falso em http://{host}:{port} (AITIGOS_EXTRACTION_API_URL=http://{host}:{port})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"{len(server.state.documents)} documentos recebidos")
@@ -0,0 +1,22 @@
+# Generated by Django 5.0.6 on 2026-10-18 04:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('aitigos', '0002_extraction_cache'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='extractionjob',
+            name='file_path',
+        ),
+        migrations.AddField(
+            model_name='extractionjob',
+            name='file_content',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+    ]
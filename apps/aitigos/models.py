@@ -1,3 +1,69 @@
+# apps/aitigos/models.py
+import uuid
+
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.auth.models import User
+from django.utils import timezone
+from apps.moloni.models import Moloni
+
+
+class ExtractionJob(models.Model):
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_COMPLETED = 'completed'
+    STATUS_FAILED = 'failed'
+
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pendente'),
+        (STATUS_PROCESSING, 'Em processamento'),
+        (STATUS_COMPLETED, 'Concluído'),
+        (STATUS_FAILED, 'Falhou'),
+    ]
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='extraction_jobs')
+    company = models.ForeignKey(Moloni, on_delete=models.SET_NULL, null=True, blank=True)
+    file_name = models.CharField(max_length=255)
+    # PDF guardado na base de dados até o worker o processar: o worker corre
+    # noutro contentor, sem acesso ao armazenamento local do contentor web
+    file_content = models.BinaryField(null=True, blank=True, editable=False)
+    file_digest = models.CharField(max_length=64, blank=True, default='', db_index=True)
+    remote_job_id = models.CharField(max_length=100, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    progress = models.IntegerField(default=0)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.file_name} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.STATUS_COMPLETED, self.STATUS_FAILED)
+
+    class Meta:
+        verbose_name = "Extraction Job"
+        verbose_name_plural = "Extraction Jobs"
+        ordering = ['-created_at']
+
+
+class ExtractionCacheEntry(models.Model):
+    digest = models.CharField(max_length=64)
+    extractor_version = models.CharField(max_length=50)
+    result = models.JSONField(encoder=DjangoJSONEncoder)
+    size_bytes = models.IntegerField(default=0)
+    hits = models.IntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_accessed_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    def __str__(self):
+        return f"{self.digest[:12]} (v{self.extractor_version})"
 
-# Create your models here.
+    class Meta:
+        verbose_name = "Extraction Cache Entry"
+        verbose_name_plural = "Extraction Cache Entries"
+        unique_together = ('digest', 'extractor_version')
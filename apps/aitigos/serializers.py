@@ -65,6 +65,11 @@ class ExtractionResultSerializer(serializers.Serializer):
 
             return super().to_internal_value(data)
         except Exception as e:
+            # Com context={'strict': True} (resultados a guardar na cache) não há recurso aos dados brutos
+            if self.context.get('strict'):
+                if isinstance(e, serializers.ValidationError):
+                    raise
+                raise serializers.ValidationError(str(e))
             logger.warning(f"Erro na validação: {str(e)}")
             result = {}
             
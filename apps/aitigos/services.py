@@ -1,26 +1,46 @@
 # apps/aitigos/services.py
 import logging
 import requests
+import hashlib
 import json
+import os
 import re
 import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from io import BytesIO
 from typing import Dict, Any, List, Tuple, Optional
 from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.core.exceptions import ValidationError
+from django.db import close_old_connections
+from django.db.models import F, Q, Sum
+from django.utils import timezone
 
 from apps.product_moloni.models import Product, ProductVariant
 from apps.sechic.models import Category, Supplier, Unit, Tax
 from apps.moloni.models import Moloni
+from apps.moloni.rate_limit import MoloniRateLimiter
+from apps.shopify.client import ShopifyClient
+from apps.shopify.graphql import ShopifyGraphQLClient, ShopifyGraphQLError
+from apps.shopify.models import Shopify
 from apps.sechic.services import MoloniService
 from apps.product_moloni.services import ProductMoloniService
+from apps.jobs.services import JobService
+from apps.jobs.streams import ProgressStream
 from .cache_manager import AitigosCacheManager
+from .serializers import ExtractionResultSerializer, ProductSerializer
 
 from apps.product_moloni.models import Product as MoloniProduct
 from apps.product_shopify.models import ShopifyProduct, ShopifyVariant
+from .models import ExtractionJob, ExtractionCacheEntry
 logger = logging.getLogger(__name__)
 
 class MoloniSyncService:
     @staticmethod
-    def sync_products_to_moloni(products_data: List[Dict], company: Moloni) -> Tuple[bool, Dict, List]:
+    def sync_products_to_moloni(products_data: List[Dict], company: Moloni,
+                                push_id: Optional[str] = None, user_id: Optional[int] = None) -> Tuple[bool, Dict, List]:
         try:
             config_result = MoloniSyncService._load_company_config(company)
             if not config_result['success']:
@@ -45,32 +65,92 @@ class MoloniSyncService:
             
             for product in products_data:
                 metrics["total_variants"] += len(product.get('details', []))
+
+            # Renovar o token antes de distribuir o trabalho pelas threads
+            token_valid, _, token_error = MoloniService.ensure_valid_token(company)
+            if not token_valid:
+                return False, {}, [{"error": token_error}]
             
-            for product_idx, product in enumerate(products_data):
-                product_result = MoloniSyncService._process_single_product(
-                    product, product_idx, company, categories, suppliers, 
-                    units, taxes, defaults, metrics
-                )
-                
-                results.extend(product_result)
-                
-                time.sleep(0.5)
+            tasks = []
+            markups = {}
+            for product in products_data:
+                tasks.extend(MoloniSyncService._plan_product_variants(
+                    product, company, categories, suppliers,
+                    units, taxes, defaults, metrics, markups
+                ))
+
+            tasks = MoloniSyncService._skip_already_pushed(tasks, company, metrics, results)
+            inserted_products = []
+            processed = metrics["total_variants"] - len(tasks)
+            PushProgressService.report(push_id, 'moloni', user_id, 'running',
+                                       metrics["total_variants"], processed, metrics)
+
+            if tasks:
+                rate_limiter = MoloniRateLimiter.for_company(company.id)
+                max_workers = max(1, min(getattr(settings, 'MOLONI_PUSH_WORKERS', 4), len(tasks)))
+                task_results = [None] * len(tasks)
+
+                with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='moloni-push') as executor:
+                    futures = {
+                        executor.submit(MoloniSyncService._run_variant_task, task, company, rate_limiter): task_idx
+                        for task_idx, task in enumerate(tasks)
+                    }
+
+                    for future in as_completed(futures):
+                        task_idx = futures[future]
+                        task = tasks[task_idx]
+                        try:
+                            variant_result = future.result()
+                        except Exception as e:
+                            logger.exception(f"Erro ao processar variante {task['variant'].get('reference')}: {str(e)}")
+                            variant_result = {
+                                "reference": task['variant'].get('reference'),
+                                "action": "exception",
+                                "error": str(e),
+                                "success": False
+                            }
+
+                        if variant_result['success']:
+                            metrics["created"] += 1
+                            AitigosCacheManager.mark_products_pushed(company.id, task['keys'], variant_result['id'])
+                            inserted_products.append({
+                                'product_id': variant_result['id'],
+                                'reference': variant_result['reference'],
+                                'ean': variant_result['ean'],
+                                'name': variant_result['name'],
+                                'price': variant_result['price'],
+                                'unit_id': task['unit'].unit_id,
+                                'category': task['category'],
+                                'supplier': task['supplier'],
+                            })
+                        else:
+                            metrics["failed"] += 1
+
+                        task_results[task_idx] = variant_result
+                        processed += 1
+                        PushProgressService.report(push_id, 'moloni', user_id, 'running',
+                                                   metrics["total_variants"], processed, metrics)
+
+                results.extend(task_results)
             
             try:
-                success_products, message_products, count_products = ProductMoloniService.fetch_and_store_products(company)
-                if success_products:
-                    logger.info(f"Lista de produtos atualizada após sincronização: {message_products}")
-                else:
-                    logger.warning(f"Erro ao atualizar lista de produtos: {message_products}")
+                ProductMoloniService.record_inserted_products(company, inserted_products)
             except Exception as e:
                 logger.error(f"Erro ao atualizar lista de produtos após sincronização: {str(e)}")
             
-            overall_success = metrics["created"] > 0 or metrics["updated"] > 0
+            overall_success = (
+                metrics["created"] > 0 or metrics["updated"] > 0
+                or (metrics["skipped"] > 0 and metrics["failed"] == 0)
+            )
+
+            PushProgressService.report(push_id, 'moloni', user_id, 'completed',
+                                       metrics["total_variants"], processed, metrics)
             
             return overall_success, metrics, results
             
         except Exception as e:
             logger.exception(f"Erro geral na sincronização com Moloni: {str(e)}")
+            PushProgressService.report(push_id, 'moloni', user_id, 'failed', 0, 0, {"error": str(e)})
             return False, {"error": str(e)}, []
     
     @staticmethod
@@ -134,54 +214,116 @@ class MoloniSyncService:
             }
     
     @staticmethod
-    def _process_single_product(product: Dict, product_idx: int, company: Moloni, 
-                               categories: Dict, suppliers: Dict, units: Dict, 
-                               taxes: Dict, defaults: Dict, metrics: Dict) -> List[Dict]:
-
+    def _plan_product_variants(product: Dict, company: Moloni, categories: Dict, suppliers: Dict,
+                               units: Dict, taxes: Dict, defaults: Dict, metrics: Dict,
+                               markups: Dict) -> List[Dict]:
+        """Resolve categoria/fornecedor/unidade/imposto uma vez por produto e devolve uma tarefa por variante"""
         product_name = product.get('name', '')
         variants = product.get('details', [])
-        results = []
         
         if not variants:
             logger.warning(f"Produto sem variantes, ignorando: {product_name}")
             metrics["skipped"] += 1
-            return results
+            return []
         
         category = MoloniSyncService._resolve_category(product.get('category', ''), categories, defaults['category'])
         supplier = MoloniSyncService._resolve_supplier(product.get('supplier', ''), suppliers, defaults['supplier'])
         unit = MoloniSyncService._resolve_unit('UNIDADE', units, defaults['unit'])
         tax = MoloniSyncService._resolve_tax('IVA 23%', taxes, defaults['tax'])
+
+        if supplier.pk not in markups:
+            markups[supplier.pk] = supplier.current_markup
         
-        for variant_idx, variant in enumerate(variants):
-            try:
-                variant_result = MoloniSyncService._process_single_variant(
-                    product, variant, variant_idx, len(variants), company, 
-                    category, supplier, unit, tax
-                )
-                
-                if variant_result['success']:
-                    metrics["created"] += 1
-                else:
-                    metrics["failed"] += 1
-                
-                results.append(variant_result)
-                
-            except Exception as e:
-                metrics["failed"] += 1
-                logger.exception(f"Erro ao processar variante {variant.get('reference')}: {str(e)}")
-                results.append({
-                    "reference": variant.get('reference'),
-                    "action": "exception",
-                    "error": str(e),
-                    "success": False
-                })
-        
-        return results
+        return [{
+            'product': product,
+            'variant': variant,
+            'variant_idx': variant_idx,
+            'total_variants': len(variants),
+            'category': category,
+            'supplier': supplier,
+            'unit': unit,
+            'tax': tax,
+            'markup': markups[supplier.pk],
+            'keys': MoloniSyncService._get_variant_keys(variant),
+        } for variant_idx, variant in enumerate(variants)]
+
+    @staticmethod
+    def _get_variant_keys(variant: Dict) -> List[Tuple[str, str]]:
+        """Chaves de idempotência da variante: referência e EAN"""
+        keys = []
+        reference = str(variant.get('reference') or '').strip()
+        if reference:
+            keys.append(('reference', reference))
+        ean = str(variant.get('barcode') or '').strip()
+        if ean:
+            keys.append(('ean', ean))
+        return keys
+
+    @staticmethod
+    def _skip_already_pushed(tasks: List[Dict], company: Moloni, metrics: Dict, results: List) -> List[Dict]:
+        """
+        Remove as variantes que já existem no Moloni (espelho local ou envios
+        recentes) e os duplicados dentro do próprio lote, para que reenviar uma
+        encomenda após uma falha parcial não crie produtos repetidos.
+        """
+        all_keys = {key for task in tasks for key in task['keys']}
+        if not all_keys:
+            return tasks
+
+        existing = AitigosCacheManager.get_pushed_products(company.id, all_keys)
+
+        references = [value for key_type, value in all_keys if key_type == 'reference']
+        eans = [value for key_type, value in all_keys if key_type == 'ean']
+        mirrored = MoloniProduct.objects.filter(company=company).filter(
+            Q(reference__in=references) | Q(ean__in=eans)
+        ).values_list('product_id', 'reference', 'ean')
+
+        for product_id, reference, ean in mirrored:
+            if reference:
+                existing.setdefault(('reference', reference), product_id)
+            if ean:
+                existing.setdefault(('ean', ean), product_id)
+
+        pending = []
+        seen = set()
+        for task in tasks:
+            keys = task['keys']
+            product_id = next((existing[key] for key in keys if key in existing), None)
+
+            if product_id is None and not any(key in seen for key in keys):
+                seen.update(keys)
+                pending.append(task)
+                continue
+
+            metrics["skipped"] += 1
+            results.append({
+                "id": product_id,
+                "reference": task['variant'].get('reference'),
+                "action": "already_exists" if product_id is not None else "duplicate",
+                "success": True
+            })
+
+        if len(pending) < len(tasks):
+            logger.info(f"{len(tasks) - len(pending)} variantes já existentes no Moloni foram ignoradas")
+        return pending
+
+    @staticmethod
+    def _run_variant_task(task: Dict, company: Moloni, rate_limiter) -> Dict:
+        close_old_connections()
+        try:
+            return MoloniSyncService._process_single_variant(
+                task['product'], task['variant'], task['variant_idx'], task['total_variants'],
+                company, task['category'], task['supplier'], task['unit'], task['tax'],
+                markup=task['markup'], rate_limiter=rate_limiter
+            )
+        finally:
+            close_old_connections()
     
     @staticmethod
     def _process_single_variant(product: Dict, variant: Dict, variant_idx: int, 
                                total_variants: int, company: Moloni,
-                               category, supplier, unit, tax) -> Dict:
+                               category, supplier, unit, tax,
+                               markup: Optional[float] = None, rate_limiter=None) -> Dict:
 
         product_name = product.get('name', '')
         variant_desc = f"{product_name} - {variant.get('color_name', '')} {variant.get('size', '')}"
@@ -193,7 +335,8 @@ class MoloniSyncService:
             quantity = float(variant.get('quantity', 0) or 0)
             has_stock = 1 if quantity > 0 else 0
 
-            markup = supplier.current_markup
+            if markup is None:
+                markup = supplier.current_markup
             sales_price = unit_price * markup
             
             try:
@@ -243,9 +386,19 @@ class MoloniSyncService:
                     form_data[f'properties[{i}][property_id]'] = prop['property_id']
                     form_data[f'properties[{i}][value]'] = prop['value']
             
+            def find_existing():
+                # Resposta perdida: o insert pode ter criado o produto
+                found, existing, lookup_error = MoloniService.find_product(
+                    company, reference=form_data['reference'], ean=form_data['ean'], rate_limiter=rate_limiter
+                )
+                if existing is not None:
+                    existing = {'valid': 1, 'product_id': existing.get('product_id')}
+                return found, existing, lookup_error
+
             url = f'https://api.moloni.pt/v1/products/insert/'
             success, response_data, error = MoloniService._make_authenticated_request_encode(
-                url, company, method='POST', form_data=form_data
+                url, company, method='POST', form_data=form_data, rate_limiter=rate_limiter,
+                idempotent=False, find_existing=find_existing
             )
             
             if success and response_data and response_data.get('valid') == 1:
@@ -255,6 +408,8 @@ class MoloniSyncService:
                 return {
                     "id": product_id,
                     "reference": variant.get('reference'),
+                    "ean": form_data["ean"],
+                    "price": form_data["price"],
                     "action": "created",
                     "name": form_data["name"],
                     "success": True
@@ -331,204 +486,26 @@ class MoloniSyncService:
             message += f". Total de {metrics['total_variants']} variantes processadas."
         
         return message
-            
-class ShopifySyncService:
-    @staticmethod
-    def create_product(access_token: str, shop_domain: str, product_data: Dict[str, Any]) -> Tuple[bool, Dict, str]:
-        try:
-            url = f"https://{shop_domain}/admin/api/2023-07/products.json"
-            
-            # Configurar headers
-            headers = {
-                "X-Shopify-Access-Token": access_token,
-                "Content-Type": "application/json"
-            }
-            
-            # Log detalhado dos dados enviados
-            logger.info("="*50)
-            logger.info("CRIANDO PRODUTO NO SHOPIFY")
-            logger.info("="*50)
-            logger.info(f"URL: {url}")
-            logger.info(f"Produto: {product_data.get('title', '')}")
-            
-            # Garantir valores padrão para campos obrigatórios
-            if not product_data.get('product_type'):
-                product_data['product_type'] = "Geral"
-                
-            if not product_data.get('vendor'):
-                product_data['vendor'] = "Loja" 
-                
-            # Garantir status ativo
-            if 'status' not in product_data:
-                product_data['status'] = "active"
-            
-            # Verificar se existem opções e são válidas
-            if 'options' in product_data:
-                for option in product_data['options']:
-                    if not option.get('values') or len(option['values']) == 0:
-                        option['values'] = ["Padrão"]
-            
-            # PREVENÇÃO DE VARIANTES DUPLICADAS
-            # Verificar se há variantes definidas e deduplica-las 
-            if 'variants' in product_data and product_data['variants']:
-                logger.info(f"Verificando {len(product_data['variants'])} variantes para possíveis duplicatas")
-                
-                # Mapear variantes por combinação de opções
-                unique_variants = {}
-                
-                for variant in product_data['variants']:
-                    # Criar uma chave única baseada nas opções (cor/tamanho)
-                    option_key = ""
-                    for i in range(1, 4): 
-                        option_name = f"option{i}"
-                        if option_name in variant:
-                            option_key += f"{variant[option_name]}/"
-                        
-                        # Gerar nova chave
-                        option_key = ""
-                        for i in range(1, 4):
-                            option_name = f"option{i}"
-                            if option_name in variant:
-                                option_key += f"{variant[option_name]}/"
-                    
-                    # Armazenar a variante com chave única
-                    unique_variants[option_key] = variant
-                
-                # Substituir lista original por lista deduplicitada
-                product_data['variants'] = list(unique_variants.values())
-                logger.info(f"Após deduplicação: {len(product_data['variants'])} variantes restantes")
-                
-                # Log das variantes
-                for i, variant in enumerate(product_data['variants']):
-                    logger.info(f"Variante {i+1}:")
-                    for key, value in variant.items():
-                        logger.info(f"  {key}: {value}")
-            
-            # Payload completo
-            payload = {"product": product_data}
-            logger.info(f"Payload completo: {json.dumps(payload, indent=2)}")
-            
-            # Fazer requisição para criar produto
-            response = requests.post(url, headers=headers, json=payload)
-            
-            # Log da resposta
-            logger.info(f"Status code: {response.status_code}")
-            logger.info(f"Resposta completa: {response.text[:1000]}")  # Limitar para não logar respostas enormes
-            
-            # Verificar resposta
-            if response.status_code in (200, 201):
-                result = response.json()
-                logger.info(f"Produto criado com sucesso. ID: {result.get('product', {}).get('id')}")
-                return True, result.get("product", {}), "Produto criado com sucesso"
-            else:
-                logger.error(f"Erro ao criar produto no Shopify: {response.status_code} - {response.text}")
-                # Tentar extrair mensagem de erro mais clara
-                error_message = "Erro ao criar produto"
-                try:
-                    error_json = response.json()
-                    if 'errors' in error_json:
-                        error_message = f"{error_message}: {json.dumps(error_json['errors'])}"
-                except:
-                    error_message = f"{error_message}: {response.text}"
-                
-                return False, {}, error_message
-                
-        except Exception as e:
-            logger.exception(f"Exceção ao criar produto no Shopify: {str(e)}")
-            return False, {}, f"Exceção: {str(e)}"
 
     @staticmethod
-    def get_locations(access_token: str, shop_domain: str) -> List[Dict]:
-        """
-        Obtém as localizações disponíveis da loja Shopify para controle de inventário
-        
-        Args:
-            access_token: Token de acesso da API Shopify
-            shop_domain: Domínio da loja Shopify
-            
-        Returns:
-            List[Dict]: Lista de localizações
-        """
-        try:
-            url = f"https://{shop_domain}/admin/api/2023-07/locations.json"
-            
-            headers = {
-                "X-Shopify-Access-Token": access_token,
-                "Content-Type": "application/json"
-            }
-            
-            logger.info(f"Obtendo localizações do Shopify: {url}")
-            
-            response = requests.get(url, headers=headers)
-            
-            logger.info(f"Status code: {response.status_code}")
-            
-            if response.status_code == 200:
-                result = response.json()
-                locations = result.get("locations", [])
-                logger.info(f"Localizações encontradas: {len(locations)}")
-                return locations
-            else:
-                logger.error(f"Erro ao obter localizações: {response.status_code} - {response.text}")
-                return []
-                
-        except Exception as e:
-            logger.exception(f"Exceção ao obter localizações: {str(e)}")
-            return []
+    def push(products_data: List[Dict], company: Moloni, push_id: Optional[str] = None,
+             user_id: Optional[int] = None) -> Dict:
+        """Envio completo para o Moloni; devolve a resposta usada pela view e pelo job aitigos.push"""
+        success, metrics, results = MoloniSyncService.sync_products_to_moloni(
+            products_data, company, push_id=push_id, user_id=user_id
+        )
+        message = MoloniSyncService.generate_sync_message(metrics)
+        logger.info(message)
 
-    @staticmethod
-    def update_inventory_level(access_token: str, shop_domain: str, inventory_item_id: int, location_id: int, quantity: int) -> Tuple[bool, str]:
-        """
-        Atualiza o nível de inventário de uma variante
-        
-        Args:
-            access_token: Token de acesso da API Shopify
-            shop_domain: Domínio da loja Shopify
-            inventory_item_id: ID do item de inventário
-            location_id: ID da localização
-            quantity: Quantidade disponível
-            
-        Returns:
-            Tuple[bool, str]: Sucesso e mensagem
-        """
-        try:
-            # Montar URL da API
-            url = f"https://{shop_domain}/admin/api/2023-07/inventory_levels/set.json"
-            
-            # Configurar headers
-            headers = {
-                "X-Shopify-Access-Token": access_token,
-                "Content-Type": "application/json"
-            }
-            
-            # Dados para atualizar inventário
-            data = {
-                "inventory_item_id": inventory_item_id,
-                "location_id": location_id,
-                "available": quantity
-            }
-            
-            # Log para depuração
-            logger.info(f"Atualizando inventário: Item ID: {inventory_item_id}, Location ID: {location_id}, Quantidade: {quantity}")
-            
-            # Fazer requisição para atualizar inventário
-            response = requests.post(url, headers=headers, json=data)
-            
-            # Log da resposta
-            logger.info(f"Status code: {response.status_code}")
-            logger.info(f"Resposta: {response.text}")
-            
-            # Verificar resposta
-            if response.status_code == 200:
-                return True, "Inventário atualizado com sucesso"
-            else:
-                logger.error(f"Erro ao atualizar inventário: {response.status_code} - {response.text}")
-                return False, f"Erro ao atualizar inventário: {response.text}"
-                
-        except Exception as e:
-            logger.exception(f"Exceção ao atualizar inventário: {str(e)}")
-            return False, f"Exceção: {str(e)}"
+        return {
+            "success": success,
+            "message": message,
+            "metrics": metrics,
+            "results": results,
+            "push_id": push_id
+        }
 
+class ShopifySyncService:
     @staticmethod
     def consolidate_products_by_color(products_data: List[Dict]) -> List[Dict]:
         logger.info("="*60)
@@ -688,6 +665,236 @@ class ShopifySyncService:
         
         return shopify_product
 
+    # ===== ENVIO EM LOTE (GraphQL) =====
+    PRODUCT_SET_COST = 10
+
+    @staticmethod
+    def get_default_location_id(client: ShopifyGraphQLClient) -> Optional[str]:
+        try:
+            data = client.execute("query { locations(first: 1) { nodes { id name } } }", estimated_cost=3)
+            locations = (data.get('locations') or {}).get('nodes') or []
+            return locations[0]['id'] if locations else None
+        except ShopifyGraphQLError as e:
+            logger.error(f"Erro ao obter localizações do Shopify: {str(e)}")
+            return None
+
+    @staticmethod
+    def get_online_store_publication_id(client: ShopifyGraphQLClient) -> Optional[str]:
+        """Canal Online Store (equivalente ao published_scope=web da REST API)"""
+        try:
+            data = client.execute("query { publications(first: 20) { nodes { id name } } }", estimated_cost=3)
+            for publication in (data.get('publications') or {}).get('nodes') or []:
+                if publication.get('name') == 'Online Store':
+                    return publication['id']
+        except ShopifyGraphQLError as e:
+            logger.warning(f"Não foi possível obter o canal Online Store: {str(e)}")
+        return None
+
+    @staticmethod
+    def build_product_set_input(shopify_product: Dict[str, Any], location_id: str) -> Dict[str, Any]:
+        """Converte o produto formatado (formato REST) num ProductSetInput com inventário incluído"""
+        option_name = shopify_product['options'][0]['name']
+
+        # Uma variante por valor de opção (o productSet rejeita combinações repetidas)
+        unique_variants = {}
+        for variant in shopify_product.get('variants', []):
+            unique_variants[variant.get('option1') or 'Default'] = variant
+
+        variants = []
+        for option_value, variant in unique_variants.items():
+            variants.append({
+                'optionValues': [{'optionName': option_name, 'name': option_value}],
+                'price': variant['price'],
+                'barcode': variant.get('barcode') or None,
+                'inventoryPolicy': 'DENY',
+                'taxable': variant.get('taxable', True),
+                'inventoryItem': {
+                    'sku': variant.get('sku', ''),
+                    'cost': variant.get('cost', '0.00'),
+                    'tracked': True,
+                    'requiresShipping': variant.get('requires_shipping', True),
+                },
+                'inventoryQuantities': [{
+                    'locationId': location_id,
+                    'name': 'available',
+                    'quantity': max(int(variant.get('inventory_quantity') or 0), 0),
+                }],
+            })
+
+        return {
+            'title': shopify_product['title'],
+            'descriptionHtml': shopify_product.get('body_html', ''),
+            'vendor': shopify_product.get('vendor') or 'Loja',
+            'productType': shopify_product.get('product_type') or 'Geral',
+            'status': 'ACTIVE',
+            'tags': [tag.strip() for tag in shopify_product.get('tags', '').split(',') if tag.strip()],
+            'productOptions': [{
+                'name': option_name,
+                'values': [{'name': option_value} for option_value in unique_variants],
+            }],
+            'variants': variants,
+        }
+
+    @staticmethod
+    def _build_product_set_mutation(batch_size: int) -> str:
+        """Várias productSet na mesma mutation, com aliases p0..pN"""
+        variables = ", ".join(f"$input{i}: ProductSetInput!" for i in range(batch_size))
+        fields = "\n".join(
+            f"  p{i}: productSet(input: $input{i}, synchronous: true) {{ product {{ id }} userErrors {{ field message }} }}"
+            for i in range(batch_size)
+        )
+        return f"mutation BulkProductSet({variables}) {{\n{fields}\n}}"
+
+    @staticmethod
+    def _publish_products(client: ShopifyGraphQLClient, product_ids: List[str], publication_id: str) -> None:
+        variables = {'publicationInput': [{'publicationId': publication_id}]}
+        declarations = ["$publicationInput: [PublicationInput!]!"]
+        fields = []
+        for i, product_id in enumerate(product_ids):
+            variables[f"id{i}"] = product_id
+            declarations.append(f"$id{i}: ID!")
+            fields.append(
+                f"  pub{i}: publishablePublish(id: $id{i}, input: $publicationInput) {{ userErrors {{ field message }} }}"
+            )
+        mutation = f"mutation PublishProducts({', '.join(declarations)}) {{\n" + "\n".join(fields) + "\n}"
+        try:
+            client.execute(mutation, variables, estimated_cost=ShopifySyncService.PRODUCT_SET_COST * len(product_ids))
+        except ShopifyGraphQLError as e:
+            logger.warning(f"Erro ao publicar produtos no Online Store: {str(e)}")
+
+    @staticmethod
+    def push_products(client: ShopifyGraphQLClient, consolidated_products: List[Dict], location_id: str,
+                      metrics: Dict, push_id: Optional[str] = None, user_id: Optional[int] = None) -> List[Dict]:
+        """
+        Cria os produtos consolidados em lotes de productSet (SHOPIFY_PRODUCT_SET_BATCH_SIZE),
+        com o inventário da localização predefinida definido no mesmo pedido.
+        """
+        batch_size = max(1, getattr(settings, 'SHOPIFY_PRODUCT_SET_BATCH_SIZE', 10))
+        publication_id = ShopifySyncService.get_online_store_publication_id(client)
+        total_variants = metrics.get("consolidated_variants", 0)
+        processed = 0
+        results = []
+
+        PushProgressService.report(push_id, 'shopify', user_id, 'running', total_variants, processed, metrics)
+
+        for start in range(0, len(consolidated_products), batch_size):
+            batch = []
+            for product in consolidated_products[start:start + batch_size]:
+                product_name = product.get('name') or 'Produto'
+                try:
+                    shopify_product = ShopifySyncService.format_product_for_shopify(product)
+                    batch.append((product, ShopifySyncService.build_product_set_input(shopify_product, location_id)))
+                except Exception as e:
+                    logger.exception(f"Erro ao formatar produto {product_name}: {str(e)}")
+                    metrics["failed"] += 1
+                    processed += len(product.get('details', []))
+                    results.append({"name": product_name, "action": "exception", "error": str(e), "success": False})
+
+            if not batch:
+                continue
+
+            batch_error = ''
+            try:
+                data = client.execute(
+                    ShopifySyncService._build_product_set_mutation(len(batch)),
+                    {f"input{i}": product_input for i, (_, product_input) in enumerate(batch)},
+                    estimated_cost=ShopifySyncService.PRODUCT_SET_COST * len(batch)
+                )
+            except ShopifyGraphQLError as e:
+                logger.error(f"Falha ao criar lote de {len(batch)} produtos no Shopify: {str(e)}")
+                data = None
+                batch_error = str(e)
+
+            created_ids = []
+            for i, (product, product_input) in enumerate(batch):
+                product_name = product.get('name') or 'Produto'
+                processed += len(product.get('details', []))
+                payload = (data or {}).get(f"p{i}") or {}
+                created_product = payload.get('product')
+                user_errors = payload.get('userErrors') or []
+
+                if data is not None and created_product and not user_errors:
+                    created_ids.append(created_product['id'])
+                    metrics["created"] += 1
+                    results.append({
+                        "id": int(created_product['id'].rsplit('/', 1)[-1]),
+                        "name": product_name,
+                        "action": "created",
+                        "variants_count": len(product_input['variants']),
+                        "success": True
+                    })
+                else:
+                    error_message = batch_error if data is None else (
+                        "; ".join(error.get('message', '') for error in user_errors) or "Produto não criado"
+                    )
+                    logger.error(f"Falha ao criar produto {product_name}: {error_message}")
+                    metrics["failed"] += 1
+                    results.append({
+                        "name": product_name,
+                        "action": "create_failed",
+                        "error": error_message,
+                        "success": False
+                    })
+
+            if created_ids and publication_id:
+                ShopifySyncService._publish_products(client, created_ids, publication_id)
+
+            PushProgressService.report(push_id, 'shopify', user_id, 'running', total_variants, processed, metrics)
+
+        PushProgressService.report(push_id, 'shopify', user_id, 'completed', total_variants, processed, metrics)
+        return results
+
+    @staticmethod
+    def push(products_data: List[Dict], shop_domain: str, access_token: str, push_id: Optional[str] = None,
+             user_id: Optional[int] = None) -> Tuple[Dict, int]:
+        """Envio completo para o Shopify; devolve (resposta, status HTTP) para a view e o job aitigos.push"""
+        # PASSO 1: CONSOLIDAR PRODUTOS POR COR
+        consolidated_products = ShopifySyncService.consolidate_products_by_color(products_data)
+
+        # Localização predefinida para o inventário (definido no mesmo pedido que o produto)
+        client = ShopifyClient.for_store(shop_domain, access_token).graphql
+        default_location_id = ShopifySyncService.get_default_location_id(client)
+        if not default_location_id:
+            return {"error": "Não foi possível obter as localizações da loja Shopify."}, 400
+
+        # Inicializar métricas
+        original_products = len(products_data)
+        consolidated_count = len(consolidated_products)
+        original_variants = sum(len(p.get('details', [])) for p in products_data)
+        consolidated_variants = sum(len(p.get('details', [])) for p in consolidated_products)
+
+        metrics = {
+            "original_products": original_products,
+            "consolidated_products": consolidated_count,
+            "products_merged": original_products - consolidated_count,
+            "original_variants": original_variants,
+            "consolidated_variants": consolidated_variants,
+            "created": 0,
+            "failed": 0
+        }
+
+        results = ShopifySyncService.push_products(
+            client, consolidated_products, default_location_id, metrics,
+            push_id=push_id, user_id=user_id
+        )
+
+        # Gerar mensagem de resultado
+        message = f"Sincronização com Shopify concluída: {metrics['created']} produtos criados"
+        if metrics["products_merged"] > 0:
+            message += f" (consolidados {metrics['products_merged']} produtos por cor)"
+        if metrics["failed"] > 0:
+            message += f", {metrics['failed']} falhas"
+        message += f". Total de {metrics['consolidated_variants']} variantes processadas."
+
+        logger.info(message)
+        return {
+            "success": metrics["created"] > 0,
+            "message": message,
+            "metrics": metrics,
+            "results": results,
+            "push_id": push_id
+        }, 200
+
 class ProductComparisonService:
     @staticmethod
     def compare_with_moloni(products_data: List[Dict], company) -> Dict:
@@ -979,4 +1186,1017 @@ class ProductComparisonService:
             
         except Exception as e:
             logger.exception(f"Erro ao filtrar produtos: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+
+
+class ExtractionPayloadService:
+    """
+    Normalização do resultado devolvido pelo serviço de IA e conversão nos
+    produtos apresentados na grelha. Usado pelo worker de extração e pelas
+    views de edição, que partilham a conversão dos DataFrames para JSON.
+    """
+
+    @staticmethod
+    def process_extraction_result(job_data) -> Tuple[Dict, bool]:
+        """
+        Normaliza e valida o resultado devolvido pelo serviço de IA. Devolve
+        (dados, validado): quando a validação falha os dados são os originais,
+        normalizados, e não devem ser guardados na cache de extração.
+        """
+        # Extract products, handling different possible structures
+        extraction_data = None
+        
+        # Full structure (model_results -> gemini -> result)
+        if job_data.get('model_results') and job_data['model_results'].get('gemini') and job_data['model_results']['gemini'].get('result'):
+            logger.info("Estrutura completa detectada (model_results -> gemini -> result)")
+            extraction_data = job_data['model_results']['gemini']['result']
+        # Direct structure (products array at root)
+        elif job_data.get('products') and isinstance(job_data['products'], list):
+            logger.info("Estrutura direta detectada (produtos na raiz)")
+            extraction_data = job_data
+        else:
+            logger.warning("Estrutura desconhecida, usando dados brutos")
+            extraction_data = job_data
+        
+        # Log para depuração
+        logger.debug(f"Número de produtos recebidos: {len(extraction_data.get('products', []))}")
+        
+        # Garantir estrutura mínima antes da validação
+        if 'products' not in extraction_data:
+            extraction_data['products'] = []
+        if 'order_info' not in extraction_data:
+            extraction_data['order_info'] = {}
+        
+        serializer = ExtractionResultSerializer(data=extraction_data, context={'strict': True})
+        if serializer.is_valid():
+            logger.info("Dados validados com sucesso pelo serializer")
+            
+            # Garantir que os produtos têm variantes e campo details antes de retornar
+            valid_data = serializer.validated_data
+            
+            if 'products' in valid_data and isinstance(valid_data['products'], list):
+                # Primeiro garantir variantes
+                valid_data['products'] = [ExtractionPayloadService._ensure_product_has_variants(p) for p in valid_data['products']]
+                # Depois garantir campo details
+                valid_data['products'] = ExtractionPayloadService._ensure_details_field(valid_data['products'])
+            
+            return valid_data, True
+        else:
+            # Log detalhado dos erros
+            logger.warning(f"Erros de validação no serializer: {serializer.errors}")
+            
+            # Tentar identificar campos específicos com problemas
+            for field, errors in serializer.errors.items():
+                if field == 'products' and isinstance(errors, list) and errors:
+                    for i, product_errors in enumerate(errors):
+                        if product_errors:
+                            logger.warning(f"Erro no produto {i}: {product_errors}")
+            
+            # Em ambiente de desenvolvimento, pode ser útil ver a estrutura exata
+            # dos dados que estão causando problemas
+            if settings.DEBUG:
+                try:
+                    # Limitar o tamanho para evitar logs enormes
+                    data_str = json.dumps(extraction_data)[:1000]
+                    logger.debug(f"Primeiros 1000 caracteres dos dados: {data_str}...")
+                except:
+                    logger.debug("Não foi possível serializar os dados para log")
+            
+            logger.info("Usando dados originais sem validação completa")
+            
+            # Tentar criar um dicionário válido para retornar
+            valid_data = {
+                'products': [],
+                'order_info': {}
+            }
+            
+            # Copiar produtos se existirem
+            if 'products' in extraction_data and isinstance(extraction_data['products'], list):
+                valid_data['products'] = extraction_data['products']
+            
+            # Copiar order_info se existir
+            if 'order_info' in extraction_data and isinstance(extraction_data['order_info'], dict):
+                valid_data['order_info'] = extraction_data['order_info']
+            
+            # Garantir que os produtos têm variantes e campo details
+            if 'products' in valid_data and isinstance(valid_data['products'], list):
+                # Primeiro garantir variantes
+                valid_data['products'] = [ExtractionPayloadService._ensure_product_has_variants(p) for p in valid_data['products']]
+                # Depois garantir campo details
+                valid_data['products'] = ExtractionPayloadService._ensure_details_field(valid_data['products'])
+            
+            # Adicionar logs para depuração final
+            for idx, product in enumerate(valid_data.get('products', [])):
+                details_count = len(product.get('details', []))
+                logger.debug(f"Produto {idx}: {product.get('name')}, {details_count} detalhes")
+                if details_count == 0:
+                    logger.warning(f"Produto sem detalhes após processamento: {product.get('name')}")
+            
+            return valid_data, False
+    
+    @staticmethod
+    def _ensure_details_field(products):
+        for product in products:
+            product['details'] = []
+            ref_counter = 0
+            
+            # Se tiver cores, usar para gerar details
+            if 'colors' in product and isinstance(product['colors'], list):
+                for color in product['colors']:
+                    color_code = color.get('color_code', '')
+                    color_name = color.get('color_name', '')
+                    
+                    # Adicionar cada tamanho como um detalhe separado
+                    for size_item in color.get('sizes', []):
+                        size = size_item.get('size', '')
+                        quantity = size_item.get('quantity', 0)
+                        
+                        if not size or quantity <= 0:
+                            continue
+                            
+                        # Gerar referência sequencial e código de barras
+                        ref_counter += 1
+                        reference = f"{product.get('material_code', '')}.{ref_counter}"
+                        
+                        # Use a função existente para gerar código de barras
+                        try:
+                            # Extrair apenas dígitos do código de material
+                            material_code = product.get('material_code', '')
+                            ref_digits = re.sub(r'\D', '', material_code).zfill(7)[-7:]
+                            color_digits = str(color_code).zfill(3)[-3:]
+                            counter_str = str(ref_counter).zfill(3)
+                            
+                            # Formar o código de barras
+                            barcode = f"{ref_digits}{color_digits}{counter_str}"
+                        except:
+                            # Fallback em caso de erro
+                            barcode = f"{product.get('material_code', '')}-{color_code}-{ref_counter}"
+                        
+                        product['details'].append({
+                            'reference': reference,
+                            'color_code': color_code,
+                            'color_name': color_name,
+                            'size': size,
+                            'description': f"{product.get('name', '')}[{color_code}/{size}]",
+                            'quantity': quantity,
+                            'unit_price': color.get('unit_price', 0),
+                            'sales_price': color.get('sales_price', 0),
+                            'barcode': barcode
+                        })
+        return products
+
+    @staticmethod
+    def _ensure_product_has_variants(product):
+        """Garante que cada produto tenha pelo menos uma variante básica"""
+        if 'details' in product and product['details']:
+            return product
+            
+        if 'references' in product and product['references']:
+            return product
+        
+        if 'colors' in product and any(color.get('sizes') for color in product.get('colors', [])):
+            return product
+        
+        logger.warning(f"Adicionando variante padrão para produto sem variantes: {product.get('name')}")
+        
+        if 'colors' not in product or not isinstance(product['colors'], list) or not product['colors']:
+            product['colors'] = [{
+                'color_code': '100', 
+                'color_name': 'Padrão',
+                'sizes': [{'size': 'M', 'quantity': 1}],
+                'unit_price': 0.0,
+                'sales_price': 0.0
+            }]
+        
+        # Garantir que a primeira cor tem tamanhos
+        if not product['colors'][0].get('sizes'):
+            product['colors'][0]['sizes'] = [{'size': 'M', 'quantity': 1}]
+        
+        return product
+
+    @staticmethod
+    def build_extraction_payload(extraction_result, company=None):
+        """
+        Converte o resultado validado da extração nos produtos apresentados na grelha,
+        aplicando o markup do fornecedor. Usado pelos workers de extração.
+        """
+        serializer = ExtractionResultSerializer(data=extraction_result)
+        if not serializer.is_valid():
+            raise ValidationError(f'Dados inválidos: {serializer.errors}')
+        
+        validated_data = serializer.validated_data
+
+        products_df, variants_df, order_info = ExtractionPayloadService._convert_to_dataframes(validated_data)
+        
+        supplier_name = (order_info.get('supplier') or '').strip()
+        supplier = None
+        
+        if company and supplier_name:
+            supplier = Supplier.objects.filter(company=company, name=supplier_name).first()
+
+        if supplier:
+            markup = supplier.current_markup or 1.0
+            variants_df['sales_price'] = variants_df['unit_price'] * markup
+
+            logger.info(f"[ExtractionPayloadService] sales_price recalculado: unit_price × {markup}")
+        else:
+            logger.warning(f"[ExtractionPayloadService] fornecedor '{supplier_name}' não encontrado; sales_price não recalculado")
+
+        processed_products = ExtractionPayloadService.dataframes_to_json(products_df, variants_df)
+        
+        return {
+            'products': processed_products,
+            'order_info': order_info
+        }
+
+    @staticmethod
+    def normalize_gender(gender_value):
+        """
+        Normaliza o valor do campo gender para os valores permitidos:
+        - Homem, Senhora, Crianças
+        """
+        if not gender_value or not isinstance(gender_value, str):
+            return 'Homem'
+        
+        normalized_value = gender_value.lower().strip()
+        
+        # Tratamento para "Homem"
+        if normalized_value in ['homem', 'masculino', 'male', 'man', 'men']:
+            return 'Homem'
+        
+        # Tratamento para "Senhora"
+        if normalized_value in ['senhora', 'mulher', 'feminino', 'female', 'woman', 'women']:
+            return 'Senhora'
+        
+        # Tratamento para "Crianças"
+        if normalized_value in ['crianças', 'criancas', 'criança', 'crianca', 'kids', 'children', 'infantil', 'child']:
+            return 'Crianças'
+        
+        # Se já está no formato correto
+        if gender_value in ['Homem', 'Senhora', 'Crianças']:
+            return gender_value
+        
+        return 'Homem'
+    
+    @staticmethod
+    def determine_gender_from_category(category):
+
+        if not category or not isinstance(category, str):
+            return 'Homem'
+        
+        category_upper = category.upper()
+        
+        # Verificar termos femininos
+        feminine_terms = ['WOMAN', 'WOMEN', 'SENHORA', 'FEMININO', 'MULHER', 'FEMALE', 'LADY', 'LADIES']
+        if any(term in category_upper for term in feminine_terms):
+            return 'Senhora'
+        
+        # Verificar termos infantis
+        children_terms = ['KIDS', 'CHILDREN', 'CRIANÇA', 'CRIANÇAS', 'INFANTIL', 'CHILD', 'BABY', 'BEBÊ']
+        if any(term in category_upper for term in children_terms):
+            return 'Crianças'
+        
+        return 'Homem'
+
+    @staticmethod
+    def _convert_to_dataframes(extraction_data):
+        import pandas as pd
+
+        # Extrair produtos e informações do pedido
+        products = extraction_data.get('products', [])
+        order_info = extraction_data.get('order_info', {})
+        
+        # Criar listas para popular os DataFrames
+        products_data = []
+        variants_data = []
+        
+        # Processar cada produto e suas variantes
+        for product_idx, product in enumerate(products):
+            # Dados básicos do produto
+            material_code = product.get('material_code', '')
+            name = product.get('name', '')
+            composition = product.get('composition', '')
+            category = product.get('category', '')
+            brand = product.get('brand', order_info.get('brand', ''))
+            
+            # Determinar gênero baseado na categoria
+            gender = ExtractionPayloadService.determine_gender_from_category(category)
+            
+            if 'gender' in product:
+                gender = ExtractionPayloadService.normalize_gender(product['gender'])
+
+            # Aplicar tratamento final
+            gender = ExtractionPayloadService.normalize_gender(gender)
+
+            # Adicionar produto ao DataFrame de produtos
+            products_data.append({
+                'product_id': product_idx,  # ID interno para relacionamento
+                'material_code': material_code,
+                'name': name,
+                'composition': composition,
+                'category': category,
+                'gender': gender,
+                'brand': brand,
+                'supplier': order_info.get('supplier', ''),
+                'date': order_info.get('date', ''),
+                'integrated': '0'  # Valor padrão
+            })
+            
+            # Criar um mapeamento de referências para acessar os códigos de barras originais
+            reference_barcode_map = {}
+            if 'references' in product and isinstance(product['references'], list):
+                for ref in product['references']:
+                    key = f"{ref.get('color_code')}_{ref.get('size')}"
+                    reference_barcode_map[key] = ref.get('barcode', '')
+            
+            # Processar cores e tamanhos
+            variant_counter = 0
+            for color in product.get('colors', []):
+                color_code = color.get('color_code', '')
+                color_name = color.get('color_name', '')
+                
+                for size_item in color.get('sizes', []):
+                    size = size_item.get('size', '')
+                    quantity = size_item.get('quantity', 0)
+                    
+                    # Pular itens sem tamanho ou quantidade <= 0
+                    if not size or quantity <= 0:
+                        continue
+                    
+                    variant_counter += 1
+                    reference = f"{material_code}.{variant_counter}"
+                    
+                    # Verificar se temos um código de barras original para esta combinação de cor/tamanho
+                    key = f"{color_code}_{size}"
+                    barcode = reference_barcode_map.get(key, '')
+                    
+                    # Se não temos um código de barras original, gerar um
+                    if not barcode:
+                        barcode = ExtractionPayloadService._generate_barcode(material_code, color_code, variant_counter)
+                    
+                    variants_data.append({
+                        'product_id': product_idx,
+                        'variant_id': variant_counter - 1,  # ID 0-indexed
+                        'reference': reference,
+                        'color_code': color_code,
+                        'color_name': color_name,
+                        'size': size,
+                        'description': f"{name}[{color_code}/{size}]",
+                        'quantity': quantity,
+                        'unit_price': color.get('unit_price', 0),
+                        'sales_price': color.get('sales_price'),
+                        'barcode': barcode
+                    })
+        
+        # Criar os DataFrames
+        products_df = pd.DataFrame(products_data) if products_data else pd.DataFrame(columns=[
+            'product_id', 'material_code', 'name', 'composition', 'category', 
+            'gender', 'brand', 'supplier', 'date', 'integrated'
+        ])
+        
+        variants_df = pd.DataFrame(variants_data) if variants_data else pd.DataFrame(columns=[
+            'product_id', 'variant_id', 'reference', 'color_code', 'color_name', 
+            'size', 'description', 'quantity', 'unit_price', 'sales_price', 'barcode'
+        ])
+        
+        return products_df, variants_df, order_info
+
+    @staticmethod
+    def _generate_barcode(material_code, color_code, counter):
+        """
+        Gera um código de barras para o produto
+        
+        O formato é: [dígitos do material_code][dígitos do color_code][contador]
+        """
+        try:
+            ref_digits = re.sub(r'\D', '', material_code).zfill(7)[-7:]
+            color_digits = str(color_code).zfill(3)[-3:]
+            counter_str = str(counter).zfill(3)
+            
+            barcode = f"{ref_digits}{color_digits}{counter_str}"
+            return barcode
+        except:
+            return f"{material_code}-{color_code}-{counter}"
+
+    @staticmethod
+    def dataframes_to_json(products_df, variants_df):
+
+        logger.info("[dataframes_to_json] INÍCIO da conversão")
+        
+        if products_df.empty:
+            return []
+        
+        shared_date = ExtractionPayloadService.find_shared_date(products_df)
+        if shared_date:
+            logger.info(f"[dataframes_to_json] Data identificada: '{shared_date}'")
+        else:
+            logger.error("[dataframes_to_json] ERRO: Nenhuma data válida encontrada!")
+        
+        date_to_use = shared_date if shared_date else ''
+        
+        # Agrupar as variantes por produto numa única passagem (mantém a ordem das linhas)
+        variant_fields = [
+            ('reference', ''), ('color_code', ''), ('color_name', ''), ('size', ''), ('description', ''),
+            ('quantity', 0), ('unit_price', 0), ('sales_price', 0), ('barcode', '')
+        ]
+        variant_columns = [
+            variants_df[field].tolist() if field in variants_df.columns else [default] * len(variants_df)
+            for field, default in variant_fields
+        ]
+        field_names = [field for field, _ in variant_fields]
+        
+        variants_by_product: Dict[Any, List[Dict]] = {}
+        for product_id, *values in zip(variants_df['product_id'].tolist(), *variant_columns):
+            variants_by_product.setdefault(product_id, []).append(dict(zip(field_names, values)))
+        
+        result = []
+        for product in products_df.to_dict('records'):
+            result.append({
+                'material_code': product.get('material_code', ''),
+                'name': product.get('name', ''),
+                'composition': product.get('composition', ''),
+                'category': product.get('category', ''),
+                'gender': ExtractionPayloadService.normalize_gender(product.get('gender', 'Homem')),                
+                'brand': product.get('brand', ''),
+                'supplier': product.get('supplier', ''),
+                'date': date_to_use,
+                'warehouse': product.get('warehouse', '1'),
+                'integrated': product.get('integrated', '0'),
+                'details': variants_by_product.get(product['product_id'], [])
+            })
+        
+        logger.info(f"[dataframes_to_json] FIM - {len(result)} produtos, "
+                    f"{len(result) if date_to_use else 0} com data válida")
+        
+        if not date_to_use:
+            logger.error(f"[dataframes_to_json] PROBLEMA: {len(result)} produtos sem data!")
+        
+        return result
+    
+    @staticmethod
+    def find_shared_date(products_df):
+        """Primeira data válida da coluna 'date' (ignora vazios, None e NaN)"""
+        if products_df.empty or 'date' not in products_df.columns:
+            return None
+        
+        dates = products_df['date']
+        as_text = dates.astype(str).str.strip()
+        valid = dates.notna() & (dates != '') & ~as_text.str.lower().isin(['', 'none', 'null', 'nan'])
+        
+        if not valid.any():
+            return None
+        return as_text[valid].iloc[0]
+
+
+class ExtractionJobService:
+    """
+    Gere os jobs de extração de documentos: o pedido HTTP apenas regista o job,
+    a submissão ao serviço de IA, o polling e a obtenção do resultado correm
+    no worker de jobs (manage.py run_jobs) fora do ciclo do pedido.
+    """
+
+    @staticmethod
+    def get_api_base_url() -> str:
+        return getattr(
+            settings, 'AITIGOS_EXTRACTION_API_URL',
+            os.getenv("API_BASE_URL", "http://172.20.141.28:8011")
+        ).rstrip('/')
+
+    @staticmethod
+    def create_job(user, company: Optional[Moloni], uploaded_file) -> ExtractionJob:
+        job = ExtractionJob(user=user, company=company, file_name=uploaded_file.name)
+
+        uploaded_file.seek(0)
+        content = uploaded_file.read()
+        job.file_digest = ExtractionCacheService.compute_digest(content)
+
+        cached_result = ExtractionCacheService.get(job.file_digest)
+        if cached_result is not None:
+            try:
+                job.result = ExtractionPayloadService.build_extraction_payload(cached_result, company)
+            except Exception as e:
+                # Entrada inutilizável (ex.: gravada por uma versão anterior): remove e extrai de novo
+                logger.warning(f"Resultado em cache {job.file_digest[:12]} inválido, a extrair de novo: {str(e)}")
+                ExtractionCacheService.delete(job.file_digest)
+                cached_result = None
+
+        if cached_result is not None:
+            job.status = ExtractionJob.STATUS_COMPLETED
+            job.progress = 100
+            job.completed_at = timezone.now()
+            job.save()
+            ExtractionJobService._cache_job_status(job)
+
+            logger.info(f"⚡ Job de extração {job.id} servido da cache ({job.file_digest[:12]})")
+            return job
+
+        job.file_content = content
+        job.save()
+
+        ExtractionJobService._cache_job_status(job)
+        JobService.enqueue(
+            'aitigos.extraction',
+            {'extraction_job_id': str(job.id)},
+            user_id=user.id,
+            dedupe_key=f"aitigos.extraction:{job.id}"
+        )
+
+        logger.info(f"📄 Job de extração {job.id} criado para {job.file_name}")
+        return job
+
+    @staticmethod
+    def run_job(job_id) -> None:
+        close_old_connections()
+        try:
+            job = ExtractionJob.objects.select_related('company').get(pk=job_id)
+        except ExtractionJob.DoesNotExist:
+            logger.error(f"Job de extração {job_id} não encontrado")
+            close_old_connections()
+            return
+
+        try:
+            ExtractionJobService._update_job(job, status=ExtractionJob.STATUS_PROCESSING)
+
+            if not job.file_content:
+                raise Exception('Ficheiro do job não encontrado')
+            remote_job_id = ExtractionJobService.submit_document(job.file_name, BytesIO(bytes(job.file_content)))
+            ExtractionJobService._update_job(job, remote_job_id=remote_job_id)
+
+            ExtractionJobService.wait_for_remote_job(remote_job_id, job)
+            job_data = ExtractionJobService.fetch_remote_result(remote_job_id)
+
+            extraction_result, validated = ExtractionPayloadService.process_extraction_result(job_data)
+            payload = ExtractionPayloadService.build_extraction_payload(extraction_result, job.company)
+
+            # Só resultados validados e convertidos com sucesso são reutilizados
+            if job.file_digest and validated:
+                ExtractionCacheService.store(job.file_digest, extraction_result)
+
+            ExtractionJobService._update_job(
+                job,
+                status=ExtractionJob.STATUS_COMPLETED,
+                progress=100,
+                result=payload,
+                completed_at=timezone.now()
+            )
+            logger.info(f"✅ Job de extração {job.id} concluído: {len(payload.get('products', []))} produtos")
+
+        except Exception as e:
+            logger.exception(f"Erro no job de extração {job.id}: {str(e)}")
+            ExtractionJobService._update_job(
+                job,
+                status=ExtractionJob.STATUS_FAILED,
+                result=None,
+                error=str(e),
+                completed_at=timezone.now()
+            )
+        finally:
+            ExtractionJobService._clear_stored_file(job)
+            close_old_connections()
+
+    @staticmethod
+    def submit_document(file_name: str, file_obj) -> str:
+        api_base_url = ExtractionJobService.get_api_base_url()
+        files = {'file': (file_name, file_obj, 'application/pdf')}
+
+        logger.info(f"Enviando arquivo {file_name} para processamento")
+        response = requests.post(
+            f'{api_base_url}/process',
+            files=files,
+            timeout=getattr(settings, 'AITIGOS_EXTRACTION_REQUEST_TIMEOUT', 60)
+        )
+        if response.status_code != 200:
+            raise Exception(f'Erro ao enviar arquivo: {response.text}')
+
+        remote_job_id = response.json().get('job_id')
+        if not remote_job_id:
+            raise Exception('ID do job não encontrado na resposta')
+
+        logger.info(f"Job criado com ID: {remote_job_id}")
+        return remote_job_id
+
+    @staticmethod
+    def wait_for_remote_job(remote_job_id: str, job: Optional[ExtractionJob] = None) -> None:
+        api_base_url = ExtractionJobService.get_api_base_url()
+        max_attempts = getattr(settings, 'AITIGOS_EXTRACTION_MAX_ATTEMPTS', 30)
+        poll_interval = getattr(settings, 'AITIGOS_EXTRACTION_POLL_INTERVAL', 2)
+        timeout = getattr(settings, 'AITIGOS_EXTRACTION_REQUEST_TIMEOUT', 60)
+
+        for attempt in range(max_attempts):
+            response = requests.get(f'{api_base_url}/job/{remote_job_id}', timeout=timeout)
+            if response.status_code != 200:
+                raise Exception(f'Erro ao verificar status: {response.text}')
+
+            status_data = response.json()
+            status = status_data.get('status')
+
+            if status == 'completed':
+                logger.info(f"Job {remote_job_id} concluído após {attempt + 1} tentativas")
+                return
+            if status == 'failed':
+                raise Exception('Processamento falhou')
+
+            progress = status_data.get('progress', 0)
+            logger.debug(f"Job em processamento. Tentativa {attempt + 1}/{max_attempts}. Progresso: {progress}%")
+            if job is not None and progress != job.progress:
+                ExtractionJobService._update_job(job, progress=int(progress or 0))
+
+            time.sleep(poll_interval)
+
+        raise Exception('Tempo limite excedido aguardando processamento')
+
+    @staticmethod
+    def fetch_remote_result(remote_job_id: str) -> Dict:
+        api_base_url = ExtractionJobService.get_api_base_url()
+
+        logger.info(f"Obtendo resultados para o job {remote_job_id}")
+        response = requests.get(
+            f'{api_base_url}/job/{remote_job_id}/json',
+            timeout=getattr(settings, 'AITIGOS_EXTRACTION_REQUEST_TIMEOUT', 60)
+        )
+        if response.status_code != 200:
+            raise Exception(f'Erro ao obter resultados: {response.text}')
+
+        return response.json()
+
+    @staticmethod
+    def get_job_status(job_id, user) -> Optional[Dict]:
+        """Estado do job para polling; só vai à base de dados quando há resultado a devolver."""
+        cached = AitigosCacheManager.get_cached_extraction_status(job_id)
+        if cached and cached.get('user_id') == user.id and cached.get('status') not in (
+            ExtractionJob.STATUS_COMPLETED, ExtractionJob.STATUS_FAILED
+        ):
+            return cached
+
+        job = ExtractionJob.objects.filter(pk=job_id, user=user).defer('file_content').first()
+        if not job:
+            return None
+
+        status = ExtractionJobService._build_status(job)
+        if job.status == ExtractionJob.STATUS_COMPLETED:
+            status.update(job.result or {})
+
+            # A grelha extraída passa a ser editada numa sessão do lado do servidor
+            session = ProductsSessionService.get_session(user.id, job.id.hex)
+            if session is None:
+                session = ProductsSessionService.open_session(
+                    user.id, status.get('products', []), session_id=job.id.hex)
+            status['products'] = session['products']
+            status['session_id'] = session['session_id']
+            status['version'] = session['version']
+        return status
+
+    @staticmethod
+    def _update_job(job: ExtractionJob, **fields) -> None:
+        for field, value in fields.items():
+            setattr(job, field, value)
+        job.save(update_fields=list(fields.keys()) + ['updated_at'])
+        ExtractionJobService._cache_job_status(job)
+
+    @staticmethod
+    def _build_status(job: ExtractionJob) -> Dict:
+        return {
+            'job_id': str(job.id),
+            'user_id': job.user_id,
+            'status': job.status,
+            'progress': job.progress,
+            'file_name': job.file_name,
+            'error': job.error,
+        }
+
+    @staticmethod
+    def _cache_job_status(job: ExtractionJob) -> None:
+        AitigosCacheManager.cache_extraction_status(job.id, ExtractionJobService._build_status(job))
+        ProgressStream.publish(AitigosCacheManager.get_extraction_status_cache_key(job.id))
+
+    @staticmethod
+    def _clear_stored_file(job: ExtractionJob) -> None:
+        try:
+            ExtractionJob.objects.filter(pk=job.pk).update(file_content=None)
+            job.file_content = None
+        except Exception as e:
+            logger.warning(f"Não foi possível remover o ficheiro do job {job.id}: {str(e)}")
+
+
+class ExtractionCacheService:
+    """
+    Cache endereçada por conteúdo dos resultados de extração: a chave é o
+    SHA-256 do PDF e a versão do extrator, o valor é o resultado já validado
+    pelo ExtractionResultSerializer.
+    """
+
+    @staticmethod
+    def get_extractor_version() -> str:
+        return str(getattr(settings, 'AITIGOS_EXTRACTOR_VERSION', '1'))
+
+    @staticmethod
+    def compute_digest(content: bytes) -> str:
+        return hashlib.sha256(content).hexdigest()
+
+    @staticmethod
+    def get(digest: str) -> Optional[Dict]:
+        try:
+            ttl = getattr(settings, 'AITIGOS_EXTRACTION_CACHE_TTL', 30 * 24 * 3600)
+            now = timezone.now()
+            entries = ExtractionCacheEntry.objects.filter(
+                digest=digest,
+                extractor_version=ExtractionCacheService.get_extractor_version(),
+                created_at__gte=now - timedelta(seconds=ttl)
+            )
+            entry = entries.only('id', 'result').first()
+
+            if entry is None:
+                AitigosCacheManager.increment_extraction_cache_counter('misses')
+                return None
+
+            entries.filter(pk=entry.pk).update(hits=F('hits') + 1, last_accessed_at=now)
+            AitigosCacheManager.increment_extraction_cache_counter('hits')
+            return entry.result
+
+        except Exception as e:
+            logger.warning(f"Erro ao consultar cache de extração: {str(e)}")
+            return None
+
+    @staticmethod
+    def store(digest: str, extraction_result: Dict) -> bool:
+        try:
+            serialized = json.dumps(extraction_result, cls=DjangoJSONEncoder)
+            size_bytes = len(serialized.encode('utf-8'))
+
+            max_entry_bytes = getattr(settings, 'AITIGOS_EXTRACTION_CACHE_MAX_ENTRY_BYTES', 5 * 1024 * 1024)
+            if size_bytes > max_entry_bytes:
+                logger.info(f"Resultado de extração {digest[:12]} demasiado grande para cache ({size_bytes} bytes)")
+                return False
+
+            now = timezone.now()
+            ExtractionCacheEntry.objects.update_or_create(
+                digest=digest,
+                extractor_version=ExtractionCacheService.get_extractor_version(),
+                defaults={
+                    'result': json.loads(serialized),
+                    'size_bytes': size_bytes,
+                    'created_at': now,
+                    'last_accessed_at': now,
+                }
+            )
+
+            ExtractionCacheService.evict()
+            return True
+
+        except Exception as e:
+            logger.warning(f"Erro ao guardar resultado na cache de extração: {str(e)}")
+            return False
+
+    @staticmethod
+    def delete(digest: str) -> int:
+        deleted, _ = ExtractionCacheEntry.objects.filter(
+            digest=digest, extractor_version=ExtractionCacheService.get_extractor_version()
+        ).delete()
+        return deleted
+
+    @staticmethod
+    def evict() -> int:
+        """Remove entradas expiradas e, por ordem LRU, as que excedem os limites"""
+        ttl = getattr(settings, 'AITIGOS_EXTRACTION_CACHE_TTL', 30 * 24 * 3600)
+        max_entries = getattr(settings, 'AITIGOS_EXTRACTION_CACHE_MAX_ENTRIES', 500)
+        max_bytes = getattr(settings, 'AITIGOS_EXTRACTION_CACHE_MAX_BYTES', 200 * 1024 * 1024)
+
+        removed, _ = ExtractionCacheEntry.objects.filter(
+            created_at__lt=timezone.now() - timedelta(seconds=ttl)
+        ).delete()
+
+        total_entries = ExtractionCacheEntry.objects.count()
+        total_bytes = ExtractionCacheEntry.objects.aggregate(total=Sum('size_bytes'))['total'] or 0
+
+        if total_entries <= max_entries and total_bytes <= max_bytes:
+            return removed
+
+        to_delete = []
+        for entry_id, size_bytes in ExtractionCacheEntry.objects.order_by(
+            'last_accessed_at'
+        ).values_list('id', 'size_bytes').iterator():
+            if total_entries <= max_entries and total_bytes <= max_bytes:
+                break
+            to_delete.append(entry_id)
+            total_entries -= 1
+            total_bytes -= size_bytes
+
+        if to_delete:
+            deleted, _ = ExtractionCacheEntry.objects.filter(id__in=to_delete).delete()
+            removed += deleted
+            logger.info(f"🧹 Cache de extração: {deleted} entradas removidas (LRU)")
+
+        return removed
+
+    @staticmethod
+    def get_stats() -> Dict:
+        counters = AitigosCacheManager.get_extraction_cache_counters()
+        totals = ExtractionCacheEntry.objects.aggregate(total_bytes=Sum('size_bytes'))
+        lookups = counters['hits'] + counters['misses']
+
+        return {
+            'hits': counters['hits'],
+            'misses': counters['misses'],
+            'hit_rate': round(counters['hits'] / lookups, 4) if lookups else 0.0,
+            'entries': ExtractionCacheEntry.objects.count(),
+            'size_bytes': totals['total_bytes'] or 0,
+            'extractor_version': ExtractionCacheService.get_extractor_version(),
+        }
+
+
+class ProductsSessionService:
+    """
+    Sessão de edição da grelha de produtos mantida no servidor. O cliente envia
+    apenas a ação e a versão que conhece; versões desatualizadas são rejeitadas.
+    """
+
+    @staticmethod
+    def open_session(user_id: int, products: List[Dict], session_id: Optional[str] = None) -> Dict:
+        session = {
+            'session_id': session_id or uuid.uuid4().hex,
+            'version': 1,
+            'products': list(products),
+        }
+        AitigosCacheManager.cache_products_session(user_id, session['session_id'], session)
+        return session
+
+    @staticmethod
+    def get_session(user_id: int, session_id: str) -> Optional[Dict]:
+        return AitigosCacheManager.get_cached_products_session(user_id, session_id)
+
+    @staticmethod
+    def commit(user_id: int, session_id: str, expected_version: int, products: List[Dict]) -> Optional[int]:
+        """Grava a nova versão se ninguém a alterou entretanto; devolve None em caso de conflito"""
+        if not AitigosCacheManager.acquire_products_session_lock(user_id, session_id):
+            return None
+
+        try:
+            session = ProductsSessionService.get_session(user_id, session_id)
+            if not session or session['version'] != expected_version:
+                return None
+
+            session['version'] = expected_version + 1
+            session['products'] = products
+            AitigosCacheManager.cache_products_session(user_id, session_id, session)
+            return session['version']
+        finally:
+            AitigosCacheManager.release_products_session_lock(user_id, session_id)
+
+    @staticmethod
+    def diff_products(old_products: List[Dict], new_products: List[Dict], removed: List[int]) -> Dict:
+        """
+        Linhas alteradas entre duas versões. Os índices em 'removed' referem-se à
+        versão antiga; os de 'updated' à nova, depois de aplicadas as remoções.
+        """
+        removed_set = set(removed)
+        remaining = [p for idx, p in enumerate(old_products) if idx not in removed_set]
+
+        updated = {}
+        for idx, product in enumerate(new_products):
+            if idx >= len(remaining) or remaining[idx] != product:
+                updated[idx] = product
+
+        return {
+            'removed': sorted(removed),
+            'updated': updated,
+            'total': len(new_products),
+        }
+
+
+class PushProgressService:
+    """
+    Progresso dos envios de produtos em curso. Cada plataforma escreve na sua
+    própria chave (um único escritor por chave), pelo que não há corridas entre
+    envios paralelos para Moloni e Shopify.
+    """
+    PLATFORMS = ('moloni', 'shopify')
+
+    @staticmethod
+    def report(push_id: Optional[str], platform: str, user_id: Optional[int], status: str,
+               total: int, processed: int, metrics: Dict) -> None:
+        if not push_id:
+            return
+        AitigosCacheManager.cache_push_progress(push_id, platform, {
+            'user_id': user_id,
+            'status': status,
+            'total': total,
+            'processed': processed,
+            'metrics': dict(metrics),
+            'updated_at': timezone.now().isoformat(),
+        })
+
+    @staticmethod
+    def get(push_id: str, user_id: int) -> Optional[Dict]:
+        platforms = {
+            platform: {key: value for key, value in progress.items() if key != 'user_id'}
+            for platform, progress in AitigosCacheManager.get_cached_push_progress(
+                push_id, PushProgressService.PLATFORMS
+            ).items()
+            if progress.get('user_id') == user_id
+        }
+        if not platforms:
+            return None
+
+        statuses = {progress['status'] for progress in platforms.values()}
+        if 'running' in statuses:
+            status = 'running'
+        elif statuses == {'failed'}:
+            status = 'failed'
+        else:
+            status = 'completed'
+
+        return {
+            'push_id': push_id,
+            'status': status,
+            'total': sum(progress['total'] for progress in platforms.values()),
+            'processed': sum(progress['processed'] for progress in platforms.values()),
+            'platforms': platforms,
+        }
+
+
+class PushService:
+    """
+    Envios para as plataformas fora do ciclo do pedido (job aitigos.push) e
+    combinação das respostas de Moloni e Shopify num envio para ambas.
+    """
+    PLATFORM_NAMES = {'moloni': 'Moloni', 'shopify': 'Shopify'}
+
+    @staticmethod
+    def platform_result(payload: Dict, status: int, platform_name: str) -> Dict:
+        if status == 200:
+            return payload
+        return {
+            "success": False,
+            "message": payload.get('error') or f"Erro ao sincronizar com {platform_name}: {status}",
+            "metrics": {}
+        }
+
+    @staticmethod
+    def combine(moloni_response: Dict, shopify_response: Dict, push_id: str) -> Dict:
+        moloni_success = moloni_response.get('success', False)
+        moloni_message = moloni_response.get('message', 'Erro desconhecido')
+        shopify_success = shopify_response.get('success', False)
+        shopify_message = shopify_response.get('message', 'Erro desconhecido')
+
+        return {
+            "success": moloni_success or shopify_success,
+            "partial": moloni_success != shopify_success,
+            "message": f"Moloni: {moloni_message} | Shopify: {shopify_message}",
+            "metrics": {
+                "moloni": moloni_response.get('metrics', {}),
+                "shopify": shopify_response.get('metrics', {})
+            },
+            "platforms": {
+                "moloni": {"success": moloni_success, "message": moloni_message},
+                "shopify": {"success": shopify_success, "message": shopify_message}
+            },
+            "push_id": push_id
+        }
+
+    @staticmethod
+    def run_platform(platform: str, products_data: List[Dict], payload: Dict, user_id: Optional[int]) -> Dict:
+        close_old_connections()
+        platform_name = PushService.PLATFORM_NAMES[platform]
+        push_id = payload.get('push_id')
+        try:
+            if platform == 'moloni':
+                company = Moloni.objects.filter(pk=payload.get('moloni_company_id')).first()
+                if not company:
+                    return PushService.platform_result(
+                        {"error": "É necessário selecionar uma empresa Moloni primeiro"}, 401, platform_name
+                    )
+                return MoloniSyncService.push(products_data, company, push_id=push_id, user_id=user_id)
+
+            store = Shopify.objects.filter(pk=payload.get('shopify_store_id')).first()
+            if not store or not store.shop_domain or not store.access_token:
+                return PushService.platform_result(
+                    {"error": "Não há lojas Shopify configuradas para este usuário."}, 400, platform_name
+                )
+            response, status = ShopifySyncService.push(
+                products_data, store.shop_domain, store.access_token, push_id=push_id, user_id=user_id
+            )
+            return PushService.platform_result(response, status, platform_name)
+
+        except Exception as e:
+            logger.exception(f"Erro ao enviar para {platform_name}: {str(e)}")
+            PushProgressService.report(push_id, platform, user_id, 'failed', 0, 0, {})
+            return {"success": False, "message": f"Exceção: {str(e)}", "metrics": {}}
+        finally:
+            close_old_connections()
+
+    @staticmethod
+    def run_background(payload: Dict, user_id: Optional[int]) -> Dict:
+        """Executa um envio em fila: payload com platform, products, push_id e as lojas resolvidas na view"""
+        serializer = ProductSerializer(data=payload.get('products', []), many=True)
+        if not serializer.is_valid():
+            return {'success': False, 'error': 'Dados de produtos inválidos', 'details': serializer.errors}
+        products_data = serializer.validated_data
+
+        platform = payload.get('platform')
+        if platform != 'both':
+            return PushService.run_platform(platform, products_data, payload, user_id)
+
+        with ThreadPoolExecutor(max_workers=2, thread_name_prefix='push-both') as executor:
+            moloni_future = executor.submit(PushService.run_platform, 'moloni', products_data, payload, user_id)
+            shopify_future = executor.submit(PushService.run_platform, 'shopify', products_data, payload, user_id)
+            return PushService.combine(moloni_future.result(), shopify_future.result(), payload.get('push_id'))
@@ -1,3 +1,266 @@
-from django.test import TestCase
+import json
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.signed_cookies import SessionStore
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import RequestFactory, SimpleTestCase, TransactionTestCase, override_settings
+
+from apps.moloni.models import Moloni
+from apps.shopify.models import Shopify
+
+from .fake_extractor import make_fake_extractor_server, sample_result
+from .grid import OrderGrid
+from .models import ExtractionCacheEntry, ExtractionJob
+from .services import ExtractionCacheService, ExtractionJobService, ExtractionPayloadService
+from .views import SyncToBothView
+
+PDF = b'%PDF-1.4\n% encomenda de teste\n'
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}},
+    AITIGOS_EXTRACTION_POLL_INTERVAL=0,
+)
+class ExtractionJobFlowTests(TransactionTestCase):
+    """Submissão, polling e obtenção do resultado contra o extrator falso"""
+
+    def setUp(self):
+        cache.clear()
+        self.server = make_fake_extractor_server(running_polls=2)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+        api_url = override_settings(AITIGOS_EXTRACTION_API_URL=f"http://127.0.0.1:{self.server.server_port}")
+        api_url.enable()
+        self.addCleanup(api_url.disable)
+
+        self.user = User.objects.create_user('extrator', email='extrator@example.com', password='x')
+
+    def _create_job(self, content=PDF):
+        with mock.patch('apps.aitigos.services.JobService.enqueue') as enqueue:
+            job = ExtractionJobService.create_job(self.user, None, SimpleUploadedFile('encomenda.pdf', content))
+        return job, enqueue
+
+    def test_job_is_submitted_polled_and_completed(self):
+        job, enqueue = self._create_job()
+        self.assertEqual(job.status, ExtractionJob.STATUS_PENDING)
+        enqueue.assert_called_once()
+
+        ExtractionJobService.run_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExtractionJob.STATUS_COMPLETED, job.error)
+        self.assertEqual(self.server.state.jobs['job1']['polls'], 3)
+        self.assertIn(PDF, self.server.state.documents[0])
+        # O PDF só fica na base de dados até ser enviado
+        self.assertIsNone(job.file_content)
+
+        products = job.result['products']
+        self.assertEqual(len(products), 1)
+        self.assertEqual(products[0]['gender'], 'Senhora')
+        self.assertEqual(
+            [(d['reference'], d['color_code'], d['size']) for d in products[0]['details']],
+            [('1234567.1', '010', 'S'), ('1234567.2', '010', 'M'), ('1234567.3', '020', 'M')]
+        )
+        self.assertEqual(job.result['order_info']['order_number'], 'ENC-1')
+
+        # O mesmo PDF é servido da cache sem novo pedido ao extrator
+        cached_job, enqueue = self._create_job()
+        self.assertEqual(cached_job.status, ExtractionJob.STATUS_COMPLETED)
+        self.assertEqual(cached_job.result, job.result)
+        enqueue.assert_not_called()
+        self.assertEqual(len(self.server.state.documents), 1)
+
+    def test_unvalidated_result_is_not_cached(self):
+        result = sample_result()
+        result['order_info']['supplier'] = ''
+        self.server.state.result = result
+        job, _ = self._create_job()
+
+        ExtractionJobService.run_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExtractionJob.STATUS_COMPLETED, job.error)
+        self.assertFalse(ExtractionCacheEntry.objects.exists())
+
+    def test_unusable_cache_entry_is_evicted(self):
+        ExtractionCacheService.store(ExtractionCacheService.compute_digest(PDF), {'products': 'corrompido'})
+
+        with self.assertLogs('apps.aitigos.services', 'WARNING'):
+            job, enqueue = self._create_job()
+
+        self.assertEqual(job.status, ExtractionJob.STATUS_PENDING)
+        enqueue.assert_called_once()
+        self.assertFalse(ExtractionCacheEntry.objects.exists())
+
+    def test_remote_failure_marks_job_failed(self):
+        job, _ = self._create_job()
+
+        with override_settings(AITIGOS_EXTRACTION_MAX_ATTEMPTS=1), \
+                self.assertLogs('apps.aitigos.services', 'ERROR'):
+            ExtractionJobService.run_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ExtractionJob.STATUS_FAILED)
+        self.assertIn('Tempo limite', job.error)
+        self.assertIsNone(job.file_content)
+
+
+def sample_grid():
+    return [
+        {'material_code': '100200', 'name': 'Camisa', 'composition': '100% Algodão', 'category': 'CAMISAS',
+         'gender': 'Homem', 'brand': 'Marca', 'supplier': 'FORN1', 'date': '', 'integrated': '0', 'details': [
+             {'reference': '100200.1', 'color_code': '001', 'color_name': 'Preto', 'size': 'S',
+              'description': 'Camisa[001/S]', 'quantity': 1, 'unit_price': 10.0, 'sales_price': 20.0,
+              'barcode': '5612101001002'},
+             {'reference': '100200.2', 'color_code': '001', 'color_name': 'Preto', 'size': 'M',
+              'description': 'Camisa[001/M]', 'quantity': 2, 'unit_price': 10.0, 'sales_price': 20.0,
+              'barcode': '5612102001003'},
+             {'reference': '100200.3', 'color_code': '002', 'color_name': 'Branco', 'size': 'L',
+              'description': 'Camisa[002/L]', 'quantity': 3, 'unit_price': 12.5, 'sales_price': 25.0,
+              'barcode': '5612103002004'},
+         ]},
+        {'material_code': '100300', 'name': 'Calça', 'composition': '98% Algodão', 'category': 'CALÇAS',
+         'gender': 'Senhora', 'brand': 'Marca', 'supplier': 'FORN2', 'date': '2025-01-15', 'integrated': '0', 'details': [
+             {'reference': '100300.1', 'color_code': '003', 'color_name': 'Azul', 'size': '38',
+              'description': 'Calça[003/38]', 'quantity': 1, 'unit_price': 20.0, 'sales_price': 40.0,
+              'barcode': '123456'},
+             {'reference': '100300.2', 'color_code': '003', 'color_name': 'Azul', 'size': '40',
+              'description': 'Calça[003/40]', 'quantity': 1, 'unit_price': 20.0, 'sales_price': 40.0,
+              'barcode': ''},
+         ]},
+    ]
+
+
+class OrderGridTests(SimpleTestCase):
+    """
+    O OrderGrid tem de devolver a mesma grelha que os antigos helpers de DataFrame
+    da AitigosView/ProductEditView; os valores esperados foram obtidos com esses helpers.
+    """
+
+    def _grid(self):
+        return OrderGrid.from_json(sample_grid(), ExtractionPayloadService.normalize_gender)
+
+    def _rows(self, products):
+        return [
+            (product['supplier'], product['date'],
+             [(detail['reference'], detail['sales_price'], detail['barcode']) for detail in product['details']])
+            for product in products
+        ]
+
+    def test_markup_for_one_supplier(self):
+        grid = self._grid()
+        grid.apply_markup(2.5, supplier='FORN2')
+
+        self.assertEqual(self._rows(grid.to_json()), [
+            ('FORN1', '2025-01-15', [('100200.1', 20.0, '5612101001002'), ('100200.2', 20.0, '5612102001003'),
+                                     ('100200.3', 25.0, '5612103002004')]),
+            ('FORN2', '2025-01-15', [('100300.1', 50.0, '123456'), ('100300.2', 50.0, '')]),
+        ])
+
+    def test_markup_for_all_products(self):
+        grid = self._grid()
+        grid.apply_markup(3.0)
+
+        self.assertEqual(self._rows(grid.to_json()), [
+            ('FORN1', '2025-01-15', [('100200.1', 30.0, '5612101001002'), ('100200.2', 30.0, '5612102001003'),
+                                     ('100200.3', 37.5, '5612103002004')]),
+            ('FORN2', '2025-01-15', [('100300.1', 60.0, '123456'), ('100300.2', 60.0, '')]),
+        ])
+
+    def test_change_supplier(self):
+        grid = self._grid()
+        grid.change_supplier('NOVO')
+
+        self.assertEqual([product['supplier'] for product in grid.to_json()], ['NOVO', 'NOVO'])
+
+    def test_barcode_prefix_pads_short_barcodes_and_keeps_empty_ones(self):
+        grid = self._grid()
+        grid.update_barcode_prefix('78')
+
+        self.assertEqual(self._rows(grid.to_json()), [
+            ('FORN1', '2025-01-15', [('100200.1', 20.0, '7812101001002'), ('100200.2', 20.0, '7812102001003'),
+                                     ('100200.3', 25.0, '7812103002004')]),
+            ('FORN2', '2025-01-15', [('100300.1', 40.0, '7800000123456'), ('100300.2', 40.0, '')]),
+        ])
+
+    def test_invalid_barcode_prefix(self):
+        with self.assertRaisesMessage(ValueError, '2 dígitos'):
+            self._grid().update_barcode_prefix('7A')
+
+    def test_delete_product(self):
+        grid = self._grid()
+        grid.delete_product(0)
+
+        expected = sample_grid()[1]
+        expected['warehouse'] = '1'
+        self.assertEqual(grid.to_json(), [expected])
+
+    def test_delete_variant_reindexes_references_and_barcodes(self):
+        grid = self._grid()
+        grid.delete_variant_with_reindexing(0, 0)
+
+        self.assertEqual(self._rows(grid.to_json()), [
+            ('FORN1', '2025-01-15', [('100200.1', 20.0, '5612101001003'), ('100200.2', 25.0, '5612102002004')]),
+            ('FORN2', '2025-01-15', [('100300.1', 40.0, '123456'), ('100300.2', 40.0, '')]),
+        ])
+
+    def test_reindex_keeps_short_barcodes(self):
+        grid = self._grid()
+        grid.delete_variant_with_reindexing(1, 0)
+
+        self.assertEqual(self._rows(grid.to_json())[1], ('FORN2', '2025-01-15', [('100300.1', 40.0, '')]))
+
+    def test_delete_variant_out_of_bounds(self):
+        with self.assertRaisesMessage(ValueError, 'Índice de variante fora dos limites'):
+            self._grid().delete_variant_with_reindexing(1, 2)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class SyncToBothViewTests(TransactionTestCase):
+    """Os envios em paralelo recebem empresa e loja já resolvidas; a sessão só é alterada no fim"""
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('envios', email='envios@example.com', password='x')
+        self.company = Moloni.objects.create(company_id=1234, name='Empresa')
+        self.store = Shopify.objects.create(shop_domain='loja.myshopify.com', access_token='token')
+
+    def _post(self):
+        request = RequestFactory().post(
+            '/aitigos/api/sync-both/', data=json.dumps({'products': sample_grid()}), content_type='application/json'
+        )
+        request.user = self.user
+        request.session = SessionStore()
+        request.session['products_to_moloni'] = sample_grid()
+        request.tenant = mock.Mock(moloni_company=self.company, shopify_store=self.store)
+        return request, SyncToBothView().post(request)
+
+    def test_platforms_receive_resolved_company_and_store(self):
+        moloni_payload = {'success': True, 'message': 'ok', 'metrics': {}, 'results': [], 'push_id': None}
+        with mock.patch('apps.aitigos.services.MoloniSyncService.push', return_value=moloni_payload) as moloni_push, \
+                mock.patch('apps.aitigos.services.ShopifySyncService.push',
+                           return_value=({'success': True, 'message': 'ok', 'metrics': {}}, 200)) as shopify_push:
+            request, response = self._post()
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(json.loads(response.content)['success'])
+        self.assertEqual(moloni_push.call_args.args[1], self.company)
+        self.assertEqual(shopify_push.call_args.args[1:3], ('loja.myshopify.com', 'token'))
+        self.assertNotIn('products_to_moloni', request.session)
+
+    def test_invalid_moloni_grant_is_flagged_in_session(self):
+        with mock.patch('apps.aitigos.services.MoloniSyncService.push', side_effect=Exception('invalid_grant')), \
+                mock.patch('apps.aitigos.services.ShopifySyncService.push',
+                           return_value=({'success': True, 'message': 'ok', 'metrics': {}}, 200)), \
+                self.assertLogs('apps.aitigos', 'WARNING'):
+            request, response = self._post()
+
+        result = json.loads(response.content)
+        self.assertTrue(result['partial'])
+        self.assertTrue(request.session['moloni_token_invalid'])
+        self.assertIn('products_to_moloni', request.session)
@@ -1,6 +1,6 @@
 # apps/aitigos/urls.py
 from django.urls import path
-from .views import AitigosView, SyncToMoloniView, SyncToShopifyView, SyncToBothView, ProductEditView, ProductComparisonView, FilteredSyncView
+from .views import AitigosView, ExtractionJobStatusView, ExtractionJobStreamView, ExtractionCacheStatsView, PushProgressView, SyncToMoloniView, SyncToShopifyView, SyncToBothView, ProductEditView, ProductComparisonView, FilteredSyncView
 
 
 urlpatterns = [
@@ -9,6 +9,10 @@ urlpatterns = [
         AitigosView.as_view(template_name="aitigos.html"),
         name="aitigos",
     ),
+    path('api/extraction/cache-stats/', ExtractionCacheStatsView.as_view(), name='aitigos_extraction_cache_stats'),
+    path('api/extraction/<uuid:job_id>/', ExtractionJobStatusView.as_view(), name='aitigos_extraction_status'),
+    path('api/extraction/<uuid:job_id>/stream/', ExtractionJobStreamView.as_view(), name='aitigos_extraction_stream'),
+    path('api/push-progress/<str:push_id>/', PushProgressView.as_view(), name='aitigos_push_progress'),
     path('api/sync-products/', SyncToMoloniView.as_view(), name='sync_to_moloni'),
     path('api/sync-shopify/', SyncToShopifyView.as_view(), name='sync_shopify'),
     path('api/sync-both/', SyncToBothView.as_view(), name='sync_both'),
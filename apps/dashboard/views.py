@@ -23,8 +23,8 @@ class DashboardView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = TemplateLayout.init(self, super().get_context_data(**kwargs))
 
-        if hasattr(self.request.user, 'profile') and self.request.user.profile.selected_moloni_company:
-            company = self.request.user.profile.selected_moloni_company
+        if self.request.tenant.moloni_company:
+            company = self.request.tenant.moloni_company
             
             # Atualizar dados da sessão
             self.request.session.update({
@@ -40,10 +40,10 @@ class DashboardView(LoginRequiredMixin, TemplateView):
                 token_status = company.get_token_status()
                 
                 if token_status == 'access_expiring':
-                    from apps.sechic.services import MoloniService
+                    from apps.moloni.tokens import MoloniTokenManager
                     
                     logger.info(f"Token expirando para {company.name}, fazendo refresh proativo...")
-                    success, new_token, error = MoloniService.refresh_access_token(company)
+                    success, new_token, error = MoloniTokenManager.get_token(company)
                     
                     if success:
                         self.request.session['access_token'] = new_token
@@ -88,8 +88,7 @@ class DashboardView(LoginRequiredMixin, TemplateView):
         context.update({
             'has_shopify': Shopify.objects.filter(users=self.request.user, is_active=True).exists(),
             'has_moloni_credentials': hasattr(self.request.user, 'moloni_credentials'),
-            'has_moloni_company': hasattr(self.request.user, 'profile') and 
-                                 self.request.user.profile.selected_moloni_company is not None,
+            'has_moloni_company': self.request.tenant.moloni_company is not None,
         })
 
         return context
@@ -0,0 +1,23 @@
+# apps/jobs/management/commands/run_jobs.py
+from django.core.management.base import BaseCommand
+
+from apps.jobs.registry import get_job_types
+from apps.jobs.worker import JobWorker
+
+
+class Command(BaseCommand):
+    help = 'Executa os jobs em fila (sincronizações, extrações e envios)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4, help='Número de jobs em paralelo')
+        parser.add_argument('--type', action='append', dest='job_types',
+                            help=f"Processar apenas este tipo de job (pode repetir). Tipos: {', '.join(get_job_types())}")
+        parser.add_argument('--once', action='store_true', help='Processar os jobs prontos e terminar')
+
+    def handle(self, *args, **options):
+        worker = JobWorker(concurrency=options['concurrency'], job_types=options['job_types'])
+        if not options['once']:
+            worker.install_signal_handlers()
+
+        processed = worker.run(once=options['once'])
+        self.stdout.write(self.style.SUCCESS(f'{processed} jobs processados'))
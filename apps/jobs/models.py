@@ -0,0 +1,71 @@
+# apps/jobs/models.py
+import uuid
+
+from django.db import models
+from django.db.models import Q
+from django.core.serializers.json import DjangoJSONEncoder
+from django.contrib.auth.models import User
+from django.utils import timezone
+
+
+class Job(models.Model):
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_SUCCEEDED = 'succeeded'
+    STATUS_FAILED = 'failed'
+    STATUS_CANCELLED = 'cancelled'
+
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Em fila'),
+        (STATUS_RUNNING, 'Em execução'),
+        (STATUS_SUCCEEDED, 'Concluído'),
+        (STATUS_FAILED, 'Falhou'),
+        (STATUS_CANCELLED, 'Cancelado'),
+    ]
+
+    ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+    FINISHED_STATUSES = (STATUS_SUCCEEDED, STATUS_FAILED, STATUS_CANCELLED)
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    job_type = models.CharField(max_length=100, db_index=True)
+    payload = models.JSONField(default=dict, encoder=DjangoJSONEncoder)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='jobs')
+    # Jobs com a mesma chave (ex.: "moloni:<empresa>") partilham o limite de concorrência
+    concurrency_key = models.CharField(max_length=100, blank=True, default='', db_index=True)
+    # Só pode existir um job ativo (em fila ou em execução) por dedupe_key
+    dedupe_key = models.CharField(max_length=200, null=True, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED, db_index=True)
+    attempts = models.IntegerField(default=0)
+    max_attempts = models.IntegerField(default=3)
+    run_after = models.DateTimeField(default=timezone.now, db_index=True)
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    worker_id = models.CharField(max_length=100, blank=True, default='')
+    cancel_requested = models.BooleanField(default=False)
+    result = models.JSONField(null=True, blank=True, encoder=DjangoJSONEncoder)
+    error = models.TextField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.job_type} ({self.status})"
+
+    @property
+    def is_finished(self):
+        return self.status in self.FINISHED_STATUSES
+
+    class Meta:
+        verbose_name = "Job"
+        verbose_name_plural = "Jobs"
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'run_after'], name='jobs_status_run_after_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(
+                fields=['dedupe_key'],
+                condition=Q(status__in=['queued', 'running']),
+                name='jobs_unique_active_dedupe_key',
+            ),
+        ]
@@ -0,0 +1,34 @@
+# apps/jobs/registry.py
+from typing import Callable, Dict, Optional
+
+
+class JobHandler:
+    __slots__ = ('job_type', 'func', 'max_attempts', 'lease_seconds')
+
+    def __init__(self, job_type: str, func: Callable, max_attempts: int, lease_seconds: int):
+        self.job_type = job_type
+        self.func = func
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+
+
+_handlers: Dict[str, JobHandler] = {}
+
+
+def register(job_type: str, max_attempts: int = 3, lease_seconds: int = 300):
+    """
+    Regista um handler: func(job, context) -> resultado JSON (guardado em job.result).
+    Os handlers vivem nos módulos jobs.py de cada app (carregados em JobsConfig.ready).
+    """
+    def decorator(func):
+        _handlers[job_type] = JobHandler(job_type, func, max_attempts, lease_seconds)
+        return func
+    return decorator
+
+
+def get_handler(job_type: str) -> Optional[JobHandler]:
+    return _handlers.get(job_type)
+
+
+def get_job_types():
+    return list(_handlers)
@@ -0,0 +1,248 @@
+# apps/jobs/services.py
+import logging
+import threading
+from datetime import timedelta
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import Job
+from .registry import get_handler
+
+logger = logging.getLogger(__name__)
+
+
+class JobCancelled(Exception):
+    """Lançada pelos handlers (via JobContext.check_cancelled) para terminar um job cancelado"""
+
+
+class JobContext:
+    """Passado aos handlers: informa sobre pedidos de cancelamento feitos durante a execução"""
+
+    def __init__(self, job: Job):
+        self.job = job
+        self.cancelled = threading.Event()
+
+    def check_cancelled(self) -> None:
+        if self.cancelled.is_set():
+            raise JobCancelled()
+
+
+class JobService:
+    CLAIM_BATCH_SIZE = 20
+    CLAIM_LOCK_TIMEOUT = 10
+
+    # ===== ENFILEIRAR / CANCELAR =====
+    @staticmethod
+    def enqueue(job_type: str, payload: Optional[Dict] = None, user_id: Optional[int] = None, concurrency_key: str = '',
+                dedupe_key: Optional[str] = None, run_after=None) -> Job:
+        """
+        Cria um job em fila. Com dedupe_key, se já existir um job ativo com a mesma
+        chave é devolvido esse job (não há duplicados entre workers do gunicorn).
+        """
+        handler = get_handler(job_type)
+        if handler is None:
+            raise ValueError(f"Tipo de job desconhecido: {job_type}")
+
+        if dedupe_key:
+            existing = JobService.get_active_job(dedupe_key)
+            if existing:
+                return existing
+
+        try:
+            with transaction.atomic():
+                job = Job.objects.create(
+                    job_type=job_type,
+                    payload=payload or {},
+                    user_id=user_id,
+                    concurrency_key=concurrency_key,
+                    dedupe_key=dedupe_key,
+                    max_attempts=handler.max_attempts,
+                    run_after=run_after or timezone.now(),
+                )
+        except IntegrityError:
+            # Outro processo criou o mesmo job entretanto
+            existing = JobService.get_active_job(dedupe_key)
+            if existing:
+                return existing
+            raise
+
+        logger.info(f"Job {job.id} ({job_type}) em fila")
+        return job
+
+    @staticmethod
+    def get_active_job(dedupe_key: str) -> Optional[Job]:
+        return Job.objects.filter(dedupe_key=dedupe_key, status__in=Job.ACTIVE_STATUSES).first()
+
+    @staticmethod
+    def cancel(job_id) -> bool:
+        """Cancela um job em fila de imediato; num job em execução pede o cancelamento ao worker"""
+        now = timezone.now()
+        if Job.objects.filter(pk=job_id, status=Job.STATUS_QUEUED).update(
+            status=Job.STATUS_CANCELLED, cancel_requested=True, finished_at=now
+        ):
+            return True
+        return bool(Job.objects.filter(pk=job_id, status=Job.STATUS_RUNNING).update(cancel_requested=True))
+
+    # ===== WORKER =====
+    @staticmethod
+    def get_max_concurrent_per_key() -> int:
+        return getattr(settings, 'JOBS_MAX_CONCURRENT_PER_KEY', 2)
+
+    @staticmethod
+    def claim_next(worker_id: str, job_types=None) -> Optional[Job]:
+        """
+        Reserva o próximo job pronto a correr (SELECT ... FOR UPDATE SKIP LOCKED),
+        respeitando o limite de jobs em execução por concurrency_key.
+        """
+        now = timezone.now()
+        queryset = Job.objects.filter(status=Job.STATUS_QUEUED, run_after__lte=now)
+        if job_types:
+            queryset = queryset.filter(job_type__in=job_types)
+
+        claimed = None
+        held_lock = None
+        try:
+            with transaction.atomic():
+                candidates = list(
+                    queryset.select_for_update(skip_locked=True)
+                    .order_by('run_after', 'created_at')[:JobService.CLAIM_BATCH_SIZE]
+                )
+
+                for job in candidates:
+                    handler = get_handler(job.job_type)
+                    if handler is None:
+                        continue
+
+                    claim_lock = None
+                    if job.concurrency_key:
+                        # Serializa a verificação do limite entre workers para a mesma chave
+                        claim_lock = f"jobs:claim:{job.concurrency_key}"
+                        if not cache.add(claim_lock, worker_id, JobService.CLAIM_LOCK_TIMEOUT):
+                            continue
+
+                    try:
+                        if job.concurrency_key:
+                            running = Job.objects.filter(
+                                status=Job.STATUS_RUNNING,
+                                concurrency_key=job.concurrency_key,
+                                lease_expires_at__gt=now,
+                            ).count()
+                            if running >= JobService.get_max_concurrent_per_key():
+                                continue
+
+                        job.status = Job.STATUS_RUNNING
+                        job.attempts = F('attempts') + 1
+                        job.worker_id = worker_id
+                        job.started_at = now
+                        job.lease_expires_at = now + timedelta(seconds=handler.lease_seconds)
+                        job.save(update_fields=['status', 'attempts', 'worker_id', 'started_at',
+                                                'lease_expires_at', 'updated_at'])
+                        job.refresh_from_db()
+                        claimed, held_lock = job, claim_lock
+                        break
+                    finally:
+                        if claim_lock and claimed is None:
+                            cache.delete(claim_lock)
+        finally:
+            # Só depois do commit os outros workers contam este job como running;
+            # libertar o lock antes deixava-os ultrapassar o limite da chave
+            if held_lock:
+                cache.delete(held_lock)
+
+        return claimed
+
+    @staticmethod
+    def renew_lease(job: Job, worker_id: str) -> Optional[bool]:
+        """Prolonga a lease; devolve se foi pedido cancelamento (None se o job já não é deste worker)"""
+        handler = get_handler(job.job_type)
+        lease_seconds = handler.lease_seconds if handler else 300
+        updated = Job.objects.filter(
+            pk=job.pk, status=Job.STATUS_RUNNING, worker_id=worker_id
+        ).update(lease_expires_at=timezone.now() + timedelta(seconds=lease_seconds))
+        if not updated:
+            return None
+        return Job.objects.filter(pk=job.pk).values_list('cancel_requested', flat=True).first()
+
+    @staticmethod
+    def complete(job: Job, worker_id: str, result: Any = None) -> None:
+        Job.objects.filter(pk=job.pk, worker_id=worker_id, status=Job.STATUS_RUNNING).update(
+            status=Job.STATUS_SUCCEEDED, result=result, lease_expires_at=None,
+            finished_at=timezone.now(), updated_at=timezone.now()
+        )
+        logger.info(f"Job {job.id} ({job.job_type}) concluído")
+
+    @staticmethod
+    def mark_cancelled(job: Job, worker_id: str) -> None:
+        Job.objects.filter(pk=job.pk, worker_id=worker_id, status=Job.STATUS_RUNNING).update(
+            status=Job.STATUS_CANCELLED, lease_expires_at=None,
+            finished_at=timezone.now(), updated_at=timezone.now()
+        )
+        logger.info(f"Job {job.id} ({job.job_type}) cancelado")
+
+    @staticmethod
+    def get_retry_delay(attempts: int) -> timedelta:
+        return timedelta(seconds=min(30 * 2 ** max(attempts - 1, 0), 3600))
+
+    @staticmethod
+    def fail(job: Job, worker_id: str, error: str) -> None:
+        """Volta a pôr o job em fila com backoff exponencial enquanto houver tentativas"""
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            updates = dict(status=Job.STATUS_QUEUED, run_after=now + JobService.get_retry_delay(job.attempts))
+            logger.warning(f"Job {job.id} ({job.job_type}) falhou (tentativa {job.attempts}/{job.max_attempts}): {error}")
+        else:
+            updates = dict(status=Job.STATUS_FAILED, finished_at=now)
+            logger.error(f"Job {job.id} ({job.job_type}) falhou definitivamente: {error}")
+
+        Job.objects.filter(pk=job.pk, worker_id=worker_id, status=Job.STATUS_RUNNING).update(
+            error=error, lease_expires_at=None, updated_at=now, **updates
+        )
+
+    @staticmethod
+    def requeue_expired_leases() -> int:
+        """Jobs cujo worker morreu (lease expirada) voltam à fila, ou falham se esgotaram as tentativas"""
+        now = timezone.now()
+        expired = Job.objects.filter(status=Job.STATUS_RUNNING, lease_expires_at__lt=now)
+        failed = expired.filter(attempts__gte=F('max_attempts')).update(
+            status=Job.STATUS_FAILED, error='Lease expirada: o worker terminou durante a execução',
+            lease_expires_at=None, finished_at=now, updated_at=now
+        )
+        requeued = expired.filter(cancel_requested=False).update(
+            status=Job.STATUS_QUEUED, run_after=now, lease_expires_at=None, worker_id='', updated_at=now
+        )
+        cancelled = expired.filter(cancel_requested=True).update(
+            status=Job.STATUS_CANCELLED, lease_expires_at=None, finished_at=now, updated_at=now
+        )
+        total = failed + requeued + cancelled
+        if total:
+            logger.warning(f"{requeued} jobs com lease expirada voltaram à fila ({failed} falharam, {cancelled} cancelados)")
+        return total
+
+    @staticmethod
+    def purge_finished(days: Optional[int] = None) -> int:
+        days = days if days is not None else getattr(settings, 'JOBS_RETENTION_DAYS', 14)
+        deleted, _ = Job.objects.filter(
+            status__in=Job.FINISHED_STATUSES, finished_at__lt=timezone.now() - timedelta(days=days)
+        ).delete()
+        return deleted
+
+    @staticmethod
+    def get_job_status(job_id, user) -> Optional[Dict]:
+        job = Job.objects.filter(pk=job_id, user=user).first()
+        if job is None:
+            return None
+        return {
+            'job_id': str(job.id),
+            'job_type': job.job_type,
+            'status': job.status,
+            'attempts': job.attempts,
+            'result': job.result,
+            'error': job.error,
+            'created_at': job.created_at.isoformat(),
+            'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        }
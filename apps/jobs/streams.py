@@ -0,0 +1,182 @@
+# apps/jobs/streams.py
+import json
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import close_old_connections
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressStream:
+    """
+    Progresso de jobs em background enviado ao browser por server-sent events.
+
+    Quem escreve o progresso chama `publish(canal)` depois de gravar o estado;
+    cada ligação SSE subscreve o canal no Redis e volta a ler o snapshot quando
+    é notificada, por isso as mensagens publicadas não levam dados. Sem Redis
+    (ex.: cache local em desenvolvimento) a ligação lê o snapshot a cada
+    POLL_INTERVAL segundos.
+
+    Cada ligação ocupa uma thread do gunicorn, por isso fecha ao fim de
+    SSE_MAX_DURATION segundos e o EventSource volta a ligar-se sozinho. Cada
+    processo aceita no máximo SSE_MAX_STREAMS_PER_PROCESS ligações; acima disso
+    responde 503 e o browser passa a fazer polling do endpoint de estado.
+    """
+    POLL_INTERVAL = 1
+    RETRY_MS = 2000
+
+    _slots = None
+    _slots_lock = threading.Lock()
+
+    @staticmethod
+    def _acquire_slot() -> bool:
+        with ProgressStream._slots_lock:
+            if ProgressStream._slots is None:
+                ProgressStream._slots = threading.BoundedSemaphore(
+                    getattr(settings, 'SSE_MAX_STREAMS_PER_PROCESS', 2)
+                )
+        return ProgressStream._slots.acquire(blocking=False)
+
+    @staticmethod
+    def _redis():
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except (ImportError, NotImplementedError):
+            return None
+
+    @staticmethod
+    def get_channel(name: str) -> str:
+        return cache.make_key(f"{name}:events")
+
+    @staticmethod
+    def publish(name: str) -> None:
+        """Notifica as ligações abertas de que o progresso mudou"""
+        client = ProgressStream._redis()
+        if client is None:
+            return
+        try:
+            client.publish(ProgressStream.get_channel(name), 1)
+        except Exception as e:
+            logger.warning(f"Não foi possível publicar progresso em {name}: {str(e)}")
+
+    @staticmethod
+    def format_event(event: str, data: Any) -> str:
+        return f"event: {event}\ndata: {json.dumps(data, cls=DjangoJSONEncoder)}\n\n"
+
+    @staticmethod
+    def events(name: str,
+               snapshot: Callable[[], Optional[Dict]],
+               is_finished: Callable[[Optional[Dict]], bool]) -> Iterator[str]:
+        """
+        Envia `progress` sempre que o snapshot muda e `end` quando o job termina.
+        Entre alterações envia um comentário de keep-alive a cada SSE_HEARTBEAT
+        segundos para que proxies não fechem a ligação.
+        """
+        max_duration = getattr(settings, 'SSE_MAX_DURATION', 60)
+        heartbeat = getattr(settings, 'SSE_HEARTBEAT', 15)
+
+        client = ProgressStream._redis()
+        pubsub = None
+        if client is not None:
+            try:
+                pubsub = client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(ProgressStream.get_channel(name))
+            except Exception as e:
+                logger.warning(f"Subscrição de {name} falhou, a usar polling: {str(e)}")
+                pubsub = None
+
+        deadline = time.monotonic() + max_duration
+        last_data = None
+        last_sent = time.monotonic()
+
+        try:
+            yield f"retry: {ProgressStream.RETRY_MS}\n\n"
+
+            while True:
+                data = snapshot()
+                if is_finished(data):
+                    yield ProgressStream.format_event('end', data)
+                    return
+
+                if data != last_data:
+                    yield ProgressStream.format_event('progress', data)
+                    last_data = data
+                    last_sent = time.monotonic()
+
+                now = time.monotonic()
+                if now >= deadline:
+                    return
+                if now - last_sent >= heartbeat:
+                    yield ": keep-alive\n\n"
+                    last_sent = now
+
+                wait = min(heartbeat, deadline - now)
+                if pubsub is not None:
+                    if pubsub.get_message(timeout=wait) is not None:
+                        # Várias escritas seguidas resultam numa única leitura
+                        while pubsub.get_message(timeout=0) is not None:
+                            pass
+                else:
+                    time.sleep(min(ProgressStream.POLL_INTERVAL, wait))
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+            close_old_connections()
+
+    @staticmethod
+    def response(name: str,
+                 snapshot: Callable[[], Optional[Dict]],
+                 is_finished: Callable[[Optional[Dict]], bool]) -> HttpResponse:
+        if not ProgressStream._acquire_slot():
+            logger.info(f"Limite de streams SSE atingido neste processo, {name} passa a polling")
+            response = JsonResponse(
+                {'success': False, 'message': 'Demasiadas ligações de progresso, a usar polling'},
+                status=503
+            )
+            response['Retry-After'] = str(ProgressStream.RETRY_MS // 1000)
+            return response
+
+        response = StreamingHttpResponse(
+            _SlotReleasingIterator(ProgressStream.events(name, snapshot, is_finished)),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Impede o nginx de acumular o stream em buffer
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+
+class _SlotReleasingIterator:
+    """
+    Liberta o lugar do stream quando o gerador termina ou quando o servidor
+    fecha a resposta (inclui ligações fechadas antes do primeiro evento).
+    """
+    def __init__(self, events: Iterator[str]):
+        self._events = events
+        self._released = False
+
+    def __iter__(self):
+        try:
+            yield from self._events
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        if self._released:
+            return
+        self._released = True
+        try:
+            self._events.close()
+        finally:
+            ProgressStream._slots.release()
@@ -0,0 +1,9 @@
+# apps/jobs/urls.py
+from django.urls import path
+from .views import JobStatusView, JobCancelView
+
+
+urlpatterns = [
+    path('api/<uuid:job_id>/', JobStatusView.as_view(), name='job_status'),
+    path('api/<uuid:job_id>/cancel/', JobCancelView.as_view(), name='job_cancel'),
+]
@@ -0,0 +1,25 @@
+# apps/jobs/views.py
+from django.contrib.auth.mixins import LoginRequiredMixin
+from django.http import JsonResponse
+from django.views import View
+
+from .models import Job
+from .services import JobService
+
+
+class JobStatusView(LoginRequiredMixin, View):
+    def get(self, request, job_id, *args, **kwargs):
+        status = JobService.get_job_status(job_id, request.user)
+        if status is None:
+            return JsonResponse({'error': 'Job não encontrado'}, status=404)
+        return JsonResponse(status)
+
+
+class JobCancelView(LoginRequiredMixin, View):
+    def post(self, request, job_id, *args, **kwargs):
+        if not Job.objects.filter(pk=job_id, user=request.user).exists():
+            return JsonResponse({'error': 'Job não encontrado'}, status=404)
+
+        if not JobService.cancel(job_id):
+            return JsonResponse({'success': False, 'message': 'O job já terminou'})
+        return JsonResponse({'success': True, 'message': 'Cancelamento solicitado'})
@@ -0,0 +1,129 @@
+# apps/jobs/worker.py
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .registry import get_handler
+from .services import JobCancelled, JobContext, JobService
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorker:
+    """
+    Processo worker (manage.py run_jobs): reserva jobs da base de dados e executa-os
+    num pool de threads, renovando a lease de cada job enquanto corre.
+    """
+    MAINTENANCE_INTERVAL = 30
+    PURGE_INTERVAL = 3600
+
+    def __init__(self, concurrency: int = 4, job_types=None, poll_interval: float = None):
+        self.concurrency = max(1, concurrency)
+        self.job_types = job_types or None
+        self.poll_interval = poll_interval or getattr(settings, 'JOBS_POLL_INTERVAL', 2)
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stop = threading.Event()
+        self._slots = threading.Semaphore(self.concurrency)
+        self._last_maintenance = 0.0
+        self._last_purge = 0.0
+
+    def stop(self, *args):
+        if not self._stop.is_set():
+            logger.info(f"Worker {self.worker_id}: a terminar após os jobs em curso")
+        self._stop.set()
+
+    def install_signal_handlers(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+    def run(self, once: bool = False) -> int:
+        """Ciclo principal; com once=True processa o que estiver pronto e termina"""
+        logger.info(f"Worker {self.worker_id} iniciado (concorrência {self.concurrency})")
+        processed = 0
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='job') as executor:
+            while not self._stop.is_set():
+                self._run_maintenance()
+
+                if not self._slots.acquire(timeout=self.poll_interval):
+                    continue
+
+                try:
+                    close_old_connections()
+                    job = JobService.claim_next(self.worker_id, self.job_types)
+                except Exception as e:
+                    logger.exception(f"Erro ao reservar job: {str(e)}")
+                    job = None
+
+                if job is None:
+                    self._slots.release()
+                    if once:
+                        break
+                    self._stop.wait(self.poll_interval)
+                    continue
+
+                processed += 1
+                executor.submit(self._execute, job)
+
+        logger.info(f"Worker {self.worker_id} terminado ({processed} jobs processados)")
+        return processed
+
+    def _run_maintenance(self):
+        now = time.monotonic()
+        try:
+            if now - self._last_maintenance >= self.MAINTENANCE_INTERVAL:
+                self._last_maintenance = now
+                JobService.requeue_expired_leases()
+            if now - self._last_purge >= self.PURGE_INTERVAL:
+                self._last_purge = now
+                JobService.purge_finished()
+        except Exception as e:
+            logger.exception(f"Erro na manutenção de jobs: {str(e)}")
+
+    def _heartbeat(self, job, context, done: threading.Event, interval: float):
+        while not done.wait(interval):
+            try:
+                cancel_requested = JobService.renew_lease(job, self.worker_id)
+            except Exception as e:
+                logger.warning(f"Erro ao renovar a lease do job {job.id}: {str(e)}")
+                continue
+            finally:
+                close_old_connections()
+
+            if cancel_requested is None or cancel_requested:
+                context.cancelled.set()
+
+    def _execute(self, job):
+        handler = get_handler(job.job_type)
+        context = JobContext(job)
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat,
+            args=(job, context, done, max(handler.lease_seconds / 3, 1)),
+            daemon=True
+        )
+        heartbeat.start()
+
+        try:
+            close_old_connections()
+            if job.cancel_requested:
+                raise JobCancelled()
+            result = handler.func(job, context)
+            JobService.complete(job, self.worker_id, result)
+        except JobCancelled:
+            JobService.mark_cancelled(job, self.worker_id)
+        except Exception as e:
+            logger.exception(f"Erro no job {job.id} ({job.job_type}): {str(e)}")
+            JobService.fail(job, self.worker_id, f"{str(e)}\n{traceback.format_exc(limit=5)}")
+        finally:
+            done.set()
+            close_old_connections()
+            self._slots.release()
@@ -0,0 +1,222 @@
+# apps/moloni/client.py
+import logging
+import os
+import threading
+import time
+from typing import Dict, Tuple
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class MoloniHttpClient:
+    """
+    Cliente HTTP partilhado para a API Moloni: uma requests.Session por
+    processo com pool de ligações keep-alive, timeouts de ligação/leitura
+    explícitos e métricas de latência por endpoint.
+
+    As métricas são agregadas no Redis (um hash por endpoint, atualizado por
+    um script Lua), para que /moloni/api/http-metrics/ mostre todos os workers
+    do gunicorn e do run_jobs. Sem Redis (ex.: cache local em desenvolvimento)
+    ficam na memória de cada processo.
+
+    A sessão é criada na primeira utilização (depois do fork do gunicorn) e
+    volta a ser criada se o PID mudar, para que processos filhos não partilhem
+    sockets. As novas tentativas continuam a cargo dos chamadores
+    (MoloniService), por isso o adapter não repete pedidos.
+    """
+    _session = None
+    _session_pid = None
+    _lock = threading.Lock()
+
+    _metrics = {}
+    _metrics_lock = threading.Lock()
+
+    METRICS_PREFIX = "moloni:http_metrics"
+    METRICS_TTL = 7 * 24 * 3600
+    # KEYS: hash do endpoint, set de endpoints; ARGV: segundos, erro (0/1), TTL, endpoint
+    RECORD_SCRIPT = """
+    redis.call('hincrby', KEYS[1], 'count', 1)
+    redis.call('hincrby', KEYS[1], 'errors', ARGV[2])
+    redis.call('hincrbyfloat', KEYS[1], 'total_seconds', ARGV[1])
+    if tonumber(ARGV[1]) > tonumber(redis.call('hget', KEYS[1], 'max_seconds') or '0') then
+        redis.call('hset', KEYS[1], 'max_seconds', ARGV[1])
+    end
+    redis.call('expire', KEYS[1], ARGV[3])
+    redis.call('sadd', KEYS[2], ARGV[4])
+    redis.call('expire', KEYS[2], ARGV[3])
+    return 1
+    """
+
+    @staticmethod
+    def get_session() -> requests.Session:
+        pid = os.getpid()
+        if MoloniHttpClient._session is not None and MoloniHttpClient._session_pid == pid:
+            return MoloniHttpClient._session
+
+        with MoloniHttpClient._lock:
+            if MoloniHttpClient._session is None or MoloniHttpClient._session_pid != pid:
+                adapter = HTTPAdapter(
+                    pool_connections=getattr(settings, 'MOLONI_HTTP_POOL_CONNECTIONS', 4),
+                    pool_maxsize=getattr(settings, 'MOLONI_HTTP_POOL_MAXSIZE', 20),
+                    max_retries=0,
+                )
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                MoloniHttpClient._session = session
+                MoloniHttpClient._session_pid = pid
+            return MoloniHttpClient._session
+
+    @staticmethod
+    def get_timeout():
+        return (
+            getattr(settings, 'MOLONI_CONNECT_TIMEOUT', 5),
+            getattr(settings, 'MOLONI_READ_TIMEOUT', 60),
+        )
+
+    @staticmethod
+    def get_endpoint(url: str) -> str:
+        """https://api.moloni.pt/v1/products/getAll/?access_token=... -> products/getAll"""
+        path = urlsplit(url).path.strip('/')
+        if path.startswith('v1/'):
+            path = path[3:]
+        return path or '/'
+
+    @staticmethod
+    def request(method: str, url: str, **kwargs) -> requests.Response:
+        kwargs.setdefault('timeout', MoloniHttpClient.get_timeout())
+        endpoint = MoloniHttpClient.get_endpoint(url)
+
+        started = time.monotonic()
+        status = None
+        try:
+            response = MoloniHttpClient.get_session().request(method, url, **kwargs)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.monotonic() - started
+            MoloniHttpClient._record(endpoint, elapsed, status)
+
+            slow_threshold = getattr(settings, 'MOLONI_SLOW_REQUEST_SECONDS', 5)
+            if elapsed >= slow_threshold:
+                logger.warning(f"Pedido Moloni lento: {method} {endpoint} demorou {elapsed:.2f}s (status {status})")
+
+    @staticmethod
+    def get(url: str, **kwargs) -> requests.Response:
+        return MoloniHttpClient.request('GET', url, **kwargs)
+
+    @staticmethod
+    def post(url: str, **kwargs) -> requests.Response:
+        return MoloniHttpClient.request('POST', url, **kwargs)
+
+    # ===== MÉTRICAS =====
+    @staticmethod
+    def _redis():
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except (ImportError, NotImplementedError):
+            return None
+
+    @staticmethod
+    def _metrics_key(endpoint: str) -> str:
+        return cache.make_key(f"{MoloniHttpClient.METRICS_PREFIX}:{endpoint}")
+
+    @staticmethod
+    def _endpoints_key() -> str:
+        return cache.make_key(f"{MoloniHttpClient.METRICS_PREFIX}:endpoints")
+
+    @staticmethod
+    def _record(endpoint: str, elapsed: float, status) -> None:
+        # Sem status = exceção de rede (timeout, ligação recusada)
+        is_error = status is None or status >= 400
+
+        client = MoloniHttpClient._redis()
+        if client is not None:
+            try:
+                client.eval(
+                    MoloniHttpClient.RECORD_SCRIPT, 2,
+                    MoloniHttpClient._metrics_key(endpoint), MoloniHttpClient._endpoints_key(),
+                    repr(elapsed), int(is_error), MoloniHttpClient.METRICS_TTL, endpoint
+                )
+                return
+            except Exception as e:
+                logger.debug(f"Métricas Moloni no Redis indisponíveis, a guardar no processo: {str(e)}")
+
+        with MoloniHttpClient._metrics_lock:
+            stats = MoloniHttpClient._metrics.setdefault(
+                endpoint, {'count': 0, 'errors': 0, 'total_seconds': 0.0, 'max_seconds': 0.0}
+            )
+            stats['count'] += 1
+            stats['total_seconds'] += elapsed
+            stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            if is_error:
+                stats['errors'] += 1
+
+    @staticmethod
+    def _summarize(raw: Dict[str, Dict]) -> Dict[str, Dict]:
+        return {
+            endpoint: {
+                'count': int(stats['count']),
+                'errors': int(stats['errors']),
+                'avg_seconds': round(stats['total_seconds'] / stats['count'], 4) if stats['count'] else 0.0,
+                'max_seconds': round(stats['max_seconds'], 4),
+            }
+            for endpoint, stats in raw.items()
+        }
+
+    @staticmethod
+    def _get_shared_metrics(client, reset: bool) -> Dict[str, Dict]:
+        endpoints_key = MoloniHttpClient._endpoints_key()
+        endpoints = sorted(
+            e.decode() if isinstance(e, bytes) else e for e in client.smembers(endpoints_key)
+        )
+        keys = [MoloniHttpClient._metrics_key(endpoint) for endpoint in endpoints]
+
+        pipe = client.pipeline()
+        for key in keys:
+            pipe.hgetall(key)
+        if reset:
+            # Pedidos registados entre a leitura e o reset perdem-se; aceitável para métricas
+            pipe.delete(endpoints_key, *keys)
+        results = pipe.execute()
+
+        raw = {}
+        for endpoint, values in zip(endpoints, results):
+            if not values:
+                continue
+            values = {
+                (k.decode() if isinstance(k, bytes) else k): float(v) for k, v in values.items()
+            }
+            raw[endpoint] = {
+                'count': values.get('count', 0),
+                'errors': values.get('errors', 0),
+                'total_seconds': values.get('total_seconds', 0.0),
+                'max_seconds': values.get('max_seconds', 0.0),
+            }
+        return MoloniHttpClient._summarize(raw)
+
+    @staticmethod
+    def get_metrics(reset: bool = False) -> Tuple[Dict[str, Dict], str]:
+        """
+        Latência por endpoint (pedidos, erros, média e máximo em segundos) e o
+        âmbito: 'global' se agregada no Redis, 'process' se só deste processo.
+        """
+        client = MoloniHttpClient._redis()
+        if client is not None:
+            try:
+                return MoloniHttpClient._get_shared_metrics(client, reset), 'global'
+            except Exception as e:
+                logger.warning(f"Não foi possível ler as métricas Moloni do Redis: {str(e)}")
+
+        with MoloniHttpClient._metrics_lock:
+            metrics = MoloniHttpClient._summarize(MoloniHttpClient._metrics)
+            if reset:
+                MoloniHttpClient._metrics = {}
+        return metrics, 'process'
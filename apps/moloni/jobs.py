@@ -0,0 +1,26 @@
+# apps/moloni/jobs.py
+from django.conf import settings
+
+from apps.jobs.registry import register
+
+from .models import Moloni
+from .tokens import MoloniTokenManager, MoloniTokenStatus
+
+
+@register('moloni.token_refresh', max_attempts=3, lease_seconds=60)
+def run_token_refresh(job, context):
+    company = Moloni.objects.filter(company_id=job.payload['company_id']).first()
+    if company is None:
+        return {'ignored': True, 'reason': 'Empresa removida'}
+
+    success, _, message = MoloniTokenManager.refresh(
+        company, min_validity=getattr(settings, 'MOLONI_TOKEN_PROACTIVE_MINUTES', 25) * 60
+    )
+    # O refresh pode terminar pela cache sem ler a linha; o snapshot do middleware parte da base de dados
+    company.refresh_from_db()
+    MoloniTokenStatus.publish(company)
+
+    # Refresh token expirado não melhora com novas tentativas
+    if not success and 're-autenticação' not in message and 'Sem token' not in message:
+        raise Exception(message)
+    return {'success': success, 'message': message}
@@ -6,7 +6,7 @@ from django.shortcuts import redirect
 from django.urls import reverse
 from django.contrib import messages
 from .models import Moloni, MoloniCredentials
-from apps.sechic.services import MoloniService
+from .tokens import MoloniTokenManager, MoloniTokenStatus
 
 logger = logging.getLogger(__name__)
 
@@ -28,21 +28,31 @@ class MoloniTokenRefreshMiddleware:
         if not self._should_process_request(request):
             return self.get_response(request)
         
-        if request.user.is_authenticated:
-            try:
-                # Verificar se o usuário tem uma empresa selecionada
-                if hasattr(request.user, 'profile') and request.user.profile.selected_moloni_company:
-                    company = request.user.profile.selected_moloni_company
-                    
-                    # Processar refresh de tokens
-                    self._process_token_refresh(request, company)
-                    
-            except Exception as e:
-                logger.error(f"Erro no middleware Moloni para usuário {request.user.username}: {str(e)}")
+        try:
+            company_id = self._get_selected_company_id(request)
+            if company_id:
+                # Processar estado dos tokens a partir do snapshot em cache (sem BD nem rede)
+                self._process_token_status(request, company_id)
+                
+        except Exception as e:
+            logger.error(f"Erro no middleware Moloni para usuário {request.user.username}: {str(e)}")
                 
         response = self.get_response(request)
         return response
     
+    def _get_selected_company_id(self, request):
+        """
+        Empresa selecionada guardada na sessão (select_company / callback OAuth);
+        o perfil só é lido na primeira vez de cada sessão.
+        """
+        if 'selected_company_id' in request.session:
+            return request.session['selected_company_id']
+        
+        company = request.tenant.moloni_company
+        request.session['selected_company_id'] = company.company_id if company else None
+        request.session.modified = True
+        return request.session['selected_company_id']
+    
     def _should_process_request(self, request):
         """Determina se deve processar este request"""
         # Não processar se não é usuário autenticado
@@ -61,9 +71,17 @@ class MoloniTokenRefreshMiddleware:
             
         return True
     
-    def _process_token_refresh(self, request, company):
-        """Processa o refresh de tokens para a empresa"""
+    def _process_token_status(self, request, company_id):
+        """Processa o estado dos tokens da empresa; a renovação é sempre feita em background"""
         try:
+            snapshot = MoloniTokenStatus.get(company_id)
+            
+            # Sem snapshot (cache vazia) - o job de renovação volta a publicá-lo
+            if snapshot is None:
+                MoloniTokenManager.schedule_refresh(company_id)
+                return
+            
+            company = MoloniTokenStatus.as_company(snapshot)
             token_status = company.get_token_status()
             
             # Token expirado ou sem token - redirecionar para login
@@ -81,48 +99,19 @@ class MoloniTokenRefreshMiddleware:
                     request.session.modified = True
                     logger.info(f"Aviso de refresh token expirando para {company.name} ({days_left} dias)")
             
-            # Access token expirando - fazer refresh automático
+            # Access token expirando - pedir refresh em background
             elif token_status == 'access_expiring':
-                self._auto_refresh_access_token(request, company)
+                minutes_left = company.minutes_until_access_expires()
+                logger.info(f"🔄 Refresh em background para {company.name} (expira em {minutes_left} min)")
+                MoloniTokenManager.schedule_refresh(company_id)
+                self._sync_session_token(request, company)
             
             # Token válido - sincronizar sessão
             elif token_status == 'valid':
                 self._sync_session_token(request, company)
                 
         except Exception as e:
-            logger.exception(f"Erro ao processar refresh de tokens: {str(e)}")
-    
-    def _auto_refresh_access_token(self, request, company):
-        """Faz refresh automático do access token"""
-        try:
-            from apps.sechic.services import MoloniService
-            
-            minutes_left = company.minutes_until_access_expires()
-            logger.info(f"🔄 Fazendo refresh automático para {company.name} (expira em {minutes_left} min)")
-            
-            success, new_token, error = MoloniService.refresh_access_token(company)
-            
-            if success:
-                # Atualizar sessão com novo token
-                request.session['access_token'] = new_token
-                request.session.modified = True
-                logger.info(f"✅ Token renovado automaticamente para {company.name}")
-                
-                # Limpar avisos anteriores
-                if 'moloni_refresh_warning_shown' in request.session:
-                    del request.session['moloni_refresh_warning_shown']
-                    request.session.modified = True
-                    
-            else:
-                logger.warning(f"❌ Falha no refresh automático para {company.name}: {error}")
-                
-                # Se refresh token expirou, marcar para redirecionamento
-                if "re-autenticação necessária" in error:
-                    request.session['moloni_token_invalid'] = True
-                    request.session.modified = True
-                    
-        except Exception as e:
-            logger.exception(f"Erro no refresh automático: {str(e)}")
+            logger.exception(f"Erro ao processar estado dos tokens: {str(e)}")
     
     def _sync_session_token(self, request, company):
         """Sincroniza o token da sessão com o da empresa"""
@@ -133,5 +122,9 @@ class MoloniTokenRefreshMiddleware:
                 request.session.modified = True
                 logger.debug(f"Token da sessão sincronizado para {company.name}")
                 
+                # Token novo - limpar avisos anteriores
+                if 'moloni_refresh_warning_shown' in request.session and not company.needs_reauth():
+                    del request.session['moloni_refresh_warning_shown']
+                
         except Exception as e:
-            logger.warning(f"Erro ao sincronizar token da sessão: {str(e)}")
\ No newline at end of file
+            logger.warning(f"Erro ao sincronizar token da sessão: {str(e)}")
@@ -0,0 +1,64 @@
+# apps/moloni/rate_limit.py
+import threading
+import time
+
+from django.conf import settings
+
+
+class TokenBucket:
+    """Token bucket thread-safe: `rate` pedidos por segundo com rajadas até `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+        self._tokens = float(capacity)
+        self._updated_at = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated_at = now
+
+    def acquire(self, tokens: float = 1, timeout: float = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+
+                if now >= self._blocked_until and self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+
+                wait = max(self._blocked_until - now, (tokens - self._tokens) / self.rate)
+
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+    def pause(self, seconds: float) -> None:
+        """Suspende a emissão de tokens (ex.: após um 429 com Retry-After)"""
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+class MoloniRateLimiter:
+    """Um token bucket por empresa, partilhado por todas as threads do processo"""
+    _limiters = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def for_company(company_id) -> TokenBucket:
+        with MoloniRateLimiter._lock:
+            limiter = MoloniRateLimiter._limiters.get(company_id)
+            if limiter is None:
+                limiter = TokenBucket(
+                    rate=getattr(settings, 'MOLONI_RATE_LIMIT_PER_SECOND', 5),
+                    capacity=getattr(settings, 'MOLONI_RATE_LIMIT_BURST', 10)
+                )
+                MoloniRateLimiter._limiters[company_id] = limiter
+            return limiter
@@ -1,3 +1,165 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from auth.tenant import TenantContext
+
+from .client import MoloniHttpClient
+from .middleware import MoloniTokenRefreshMiddleware
+from .models import Moloni
+from .tokens import MoloniTokenManager, MoloniTokenStatus
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MoloniTokenRefreshMiddlewareTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('moloni', email='moloni@example.com', password='x')
+        self.company = Moloni.objects.create(
+            company_id=1234,
+            name='Empresa',
+            moloni_access_token='token-atual',
+            moloni_refresh_token='refresh',
+            token_expires_at=timezone.now() + timedelta(hours=1),
+            token_last_refreshed=timezone.now(),
+        )
+        self.user.profile.selected_moloni_company = self.company
+        self.user.profile.save()
+
+        self.get_response = mock.Mock(return_value=HttpResponse())
+        self.middleware = MoloniTokenRefreshMiddleware(self.get_response)
+
+    def _request(self, session_data=None):
+        request = RequestFactory().get('/dashboard/')
+        # Utilizador já carregado pelo AuthenticationMiddleware
+        request.user = User.objects.select_related('profile').get(pk=self.user.pk)
+        request.tenant = TenantContext.for_user(request.user)
+        request.session = SessionStore()
+        for key, value in (session_data or {}).items():
+            request.session[key] = value
+        return request
+
+    def test_valid_token_adds_no_queries(self):
+        MoloniTokenStatus.publish(self.company)
+        request = self._request({'selected_company_id': self.company.company_id})
+
+        with mock.patch('apps.sechic.services.MoloniService.refresh_access_token') as refresh:
+            with self.assertNumQueries(0):
+                self.middleware(request)
+
+        refresh.assert_not_called()
+        self.get_response.assert_called_once_with(request)
+        self.assertEqual(request.session['access_token'], 'token-atual')
+
+    def test_expiring_token_is_refreshed_in_background(self):
+        self.company.token_expires_at = timezone.now() + timedelta(minutes=5)
+        MoloniTokenStatus.publish(self.company)
+        request = self._request({'selected_company_id': self.company.company_id})
+
+        with mock.patch('apps.sechic.services.MoloniService.refresh_access_token') as refresh, \
+                mock.patch.object(MoloniTokenManager, 'schedule_refresh') as schedule:
+            self.middleware(request)
+
+        refresh.assert_not_called()
+        schedule.assert_called_once_with(self.company.company_id)
+        self.get_response.assert_called_once_with(request)
+
+    def test_missing_snapshot_schedules_refresh(self):
+        request = self._request()
+
+        with mock.patch.object(MoloniTokenManager, 'schedule_refresh') as schedule:
+            self.middleware(request)
+
+        # Sem empresa na sessão o perfil é lido uma vez e a empresa fica guardada
+        self.assertEqual(request.session['selected_company_id'], self.company.company_id)
+        schedule.assert_called_once_with(self.company.company_id)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class MoloniTokenLockTests(SimpleTestCase):
+    """Lock distribuído da renovação do token"""
+
+    def setUp(self):
+        cache.clear()
+        self.lock_key = MoloniTokenManager.get_lock_key(1234)
+
+    @override_settings(MOLONI_CONNECT_TIMEOUT=5, MOLONI_READ_TIMEOUT=60, MOLONI_TOKEN_LOCK_TIMEOUT=30)
+    def test_lock_outlives_the_grant_request(self):
+        self.assertGreater(MoloniTokenManager.get_lock_timeout(), 65)
+
+    def test_redis_lock_is_released_with_compare_and_delete(self):
+        client = mock.Mock()
+        client.set.return_value = True
+
+        with mock.patch.object(MoloniTokenManager, '_redis', return_value=client):
+            self.assertTrue(MoloniTokenManager._acquire_lock(self.lock_key, 'dono', 80))
+            MoloniTokenManager._release_lock(self.lock_key, 'dono')
+
+        client.set.assert_called_once_with(cache.make_key(self.lock_key), 'dono', nx=True, ex=80)
+        client.eval.assert_called_once_with(
+            MoloniTokenManager.RELEASE_LOCK_SCRIPT, 1, cache.make_key(self.lock_key), 'dono'
+        )
+        client.delete.assert_not_called()
+
+    def test_expired_lock_taken_by_another_owner_is_kept(self):
+        self.assertTrue(MoloniTokenManager._acquire_lock(self.lock_key, 'outro', 80))
+        self.assertFalse(MoloniTokenManager._acquire_lock(self.lock_key, 'dono', 80))
+
+        MoloniTokenManager._release_lock(self.lock_key, 'dono')
+
+        self.assertEqual(cache.get(self.lock_key), 'outro')
+
+
+class MoloniHttpMetricsTests(SimpleTestCase):
+    """Métricas de latência por endpoint: agregadas no Redis ou, sem Redis, por processo"""
+
+    def setUp(self):
+        MoloniHttpClient._metrics = {}
+        self.addCleanup(setattr, MoloniHttpClient, '_metrics', {})
+
+    def test_without_redis_metrics_are_per_process(self):
+        with mock.patch.object(MoloniHttpClient, '_redis', return_value=None):
+            MoloniHttpClient._record('products/getAll', 1.0, 200)
+            MoloniHttpClient._record('products/getAll', 3.0, None)
+            metrics, scope = MoloniHttpClient.get_metrics(reset=True)
+            self.assertEqual(MoloniHttpClient.get_metrics(), ({}, 'process'))
+
+        self.assertEqual(scope, 'process')
+        self.assertEqual(metrics['products/getAll'], {
+            'count': 2, 'errors': 1, 'avg_seconds': 2.0, 'max_seconds': 3.0,
+        })
+
+    def test_with_redis_metrics_are_aggregated(self):
+        client = mock.Mock()
+        client.smembers.return_value = {b'products/getAll'}
+        client.pipeline.return_value.execute.return_value = [
+            {b'count': b'4', b'errors': b'1', b'total_seconds': b'6.0', b'max_seconds': b'3.5'},
+        ]
+
+        with mock.patch.object(MoloniHttpClient, '_redis', return_value=client):
+            MoloniHttpClient._record('products/getAll', 0.5, 502)
+            metrics, scope = MoloniHttpClient.get_metrics()
+
+        args = client.eval.call_args.args
+        self.assertEqual(args[0], MoloniHttpClient.RECORD_SCRIPT)
+        self.assertEqual(args[4:], ('0.5', 1, MoloniHttpClient.METRICS_TTL, 'products/getAll'))
+        self.assertEqual(MoloniHttpClient._metrics, {})
+        self.assertEqual(scope, 'global')
+        self.assertEqual(metrics['products/getAll'], {
+            'count': 4, 'errors': 1, 'avg_seconds': 1.5, 'max_seconds': 3.5,
+        })
+
+    def test_redis_failure_falls_back_to_process_metrics(self):
+        client = mock.Mock()
+        client.eval.side_effect = ConnectionError('redis em baixo')
+
+        with mock.patch.object(MoloniHttpClient, '_redis', return_value=client):
+            MoloniHttpClient._record('products/insert', 0.2, 200)
+
+        self.assertEqual(MoloniHttpClient._metrics['products/insert']['count'], 1)
@@ -0,0 +1,305 @@
+# apps/moloni/tokens.py
+import logging
+import math
+import threading
+import time
+import uuid
+from datetime import datetime, timezone as dt_timezone
+from typing import Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Moloni
+
+logger = logging.getLogger(__name__)
+
+
+class MoloniTokenStatus:
+    """
+    Snapshot do estado dos tokens de cada empresa, mantido na cache por quem
+    renova tokens (MoloniTokenManager, job moloni.token_refresh, callback
+    OAuth). Permite ao middleware saber o estado sem ler a base de dados nem
+    fazer pedidos ao Moloni; o estado é calculado no momento da leitura pelas
+    mesmas regras do modelo.
+    """
+    TIMEOUT = 24 * 3600
+
+    @staticmethod
+    def get_cache_key(company_id) -> str:
+        return f"moloni:token_status:company:{company_id}"
+
+    @staticmethod
+    def publish(company: Moloni) -> Dict:
+        snapshot = {
+            'company_id': company.company_id,
+            'name': company.name,
+            'access_token': company.moloni_access_token,
+            'expires_at': company.token_expires_at.timestamp() if company.token_expires_at else None,
+            'last_refreshed': company.token_last_refreshed.timestamp() if company.token_last_refreshed else None,
+        }
+        cache.set(MoloniTokenStatus.get_cache_key(company.company_id), snapshot, MoloniTokenStatus.TIMEOUT)
+        return snapshot
+
+    @staticmethod
+    def get(company_id) -> Optional[Dict]:
+        return cache.get(MoloniTokenStatus.get_cache_key(company_id))
+
+    @staticmethod
+    def as_company(snapshot: Dict) -> Moloni:
+        """Instância não gravada com os campos do snapshot, para usar os métodos de estado do modelo"""
+        def _to_datetime(value):
+            return datetime.fromtimestamp(value, tz=dt_timezone.utc) if value else None
+
+        return Moloni(
+            company_id=snapshot['company_id'],
+            name=snapshot.get('name') or '',
+            moloni_access_token=snapshot.get('access_token'),
+            token_expires_at=_to_datetime(snapshot.get('expires_at')),
+            token_last_refreshed=_to_datetime(snapshot.get('last_refreshed')),
+        )
+
+
+class MoloniTokenManager:
+    """
+    Access tokens Moloni por empresa, em cache no processo e no Redis, para que
+    cada pedido à API não volte a ler a linha da empresa.
+
+    A renovação é single-flight: as threads do mesmo processo esperam num lock
+    local e, entre processos, só quem obtém o lock distribuído (SET NX no
+    Redis) faz o pedido ao /grant/; os restantes esperam pelo token que ele
+    publica na cache. Quando faltam menos de MOLONI_TOKEN_PROACTIVE_MINUTES para expirar,
+    o token atual continua a ser usado e a renovação é posta em fila (job
+    moloni.token_refresh), para que nenhum pedido espere pelo /grant/.
+    """
+    # Igual a Moloni.needs_access_token_refresh: abaixo disto o token não é usado
+    REFRESH_MARGIN = 15 * 60
+    # Tempo máximo que a cache do processo é usada sem voltar a ler a do Redis
+    LOCAL_TTL = 60
+    WAIT_POLL_INTERVAL = 0.25
+    # Folga do lock de renovação além do timeout do pedido ao /grant/
+    LOCK_MARGIN = 15
+    # Apaga o lock só se ainda for de quem o obteve (get + delete atómico)
+    RELEASE_LOCK_SCRIPT = """
+    if redis.call('get', KEYS[1]) == ARGV[1] then
+        return redis.call('del', KEYS[1])
+    end
+    return 0
+    """
+
+    _local = {}
+    _local_lock = threading.Lock()
+    _flight_locks = {}
+
+    # ===== CACHE =====
+    @staticmethod
+    def get_cache_key(company_id) -> str:
+        return f"moloni:token:company:{company_id}"
+
+    @staticmethod
+    def get_lock_key(company_id) -> str:
+        return f"moloni:token_refresh_lock:company:{company_id}"
+
+    @staticmethod
+    def _redis():
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except (ImportError, NotImplementedError):
+            return None
+
+    @staticmethod
+    def get_lock_timeout() -> int:
+        """
+        O lock tem de durar mais do que o pedido ao /grant/ (ligação + leitura):
+        se expirar a meio, outro processo renova em paralelo com o mesmo refresh token.
+        """
+        request_timeout = (getattr(settings, 'MOLONI_CONNECT_TIMEOUT', 5)
+                           + getattr(settings, 'MOLONI_READ_TIMEOUT', 60))
+        return max(getattr(settings, 'MOLONI_TOKEN_LOCK_TIMEOUT', 0),
+                   math.ceil(request_timeout) + MoloniTokenManager.LOCK_MARGIN)
+
+    @staticmethod
+    def _acquire_lock(lock_key: str, owner: str, timeout: int) -> bool:
+        client = MoloniTokenManager._redis()
+        if client is None:
+            return cache.add(lock_key, owner, timeout)
+        return bool(client.set(cache.make_key(lock_key), owner, nx=True, ex=timeout))
+
+    @staticmethod
+    def _release_lock(lock_key: str, owner: str) -> None:
+        client = MoloniTokenManager._redis()
+        if client is None:
+            # Cache local: só este processo vê a chave e o lock local já serializa as threads
+            if cache.get(lock_key) == owner:
+                cache.delete(lock_key)
+            return
+        try:
+            client.eval(MoloniTokenManager.RELEASE_LOCK_SCRIPT, 1, cache.make_key(lock_key), owner)
+        except Exception as e:
+            logger.warning(f"Não foi possível libertar o lock {lock_key} (expira sozinho): {str(e)}")
+
+    @staticmethod
+    def _read(company_id) -> Optional[Dict]:
+        with MoloniTokenManager._local_lock:
+            local = MoloniTokenManager._local.get(company_id)
+        if local and time.monotonic() - local['checked_at'] < MoloniTokenManager.LOCAL_TTL:
+            return local['entry']
+
+        entry = cache.get(MoloniTokenManager.get_cache_key(company_id))
+        if entry:
+            MoloniTokenManager._remember_local(company_id, entry)
+        return entry
+
+    @staticmethod
+    def _remember_local(company_id, entry: Dict) -> None:
+        with MoloniTokenManager._local_lock:
+            MoloniTokenManager._local[company_id] = {'entry': entry, 'checked_at': time.monotonic()}
+
+    @staticmethod
+    def remember(company: Moloni) -> Optional[Dict]:
+        """Publica o token atual da empresa na cache (após refresh ou novo login OAuth)"""
+        MoloniTokenStatus.publish(company)
+        if not company.moloni_access_token or not company.token_expires_at:
+            MoloniTokenManager.forget(company.company_id)
+            return None
+
+        entry = {
+            'access_token': company.moloni_access_token,
+            'expires_at': company.token_expires_at.timestamp(),
+        }
+        timeout = int(entry['expires_at'] - time.time())
+        if timeout <= 0:
+            MoloniTokenManager.forget(company.company_id)
+            return None
+
+        cache.set(MoloniTokenManager.get_cache_key(company.company_id), entry, timeout)
+        MoloniTokenManager._remember_local(company.company_id, entry)
+        return entry
+
+    @staticmethod
+    def forget(company_id) -> None:
+        cache.delete(MoloniTokenManager.get_cache_key(company_id))
+        with MoloniTokenManager._local_lock:
+            MoloniTokenManager._local.pop(company_id, None)
+
+    @staticmethod
+    def _is_usable(entry: Optional[Dict], margin: float, stale_token: Optional[str] = None) -> bool:
+        if not entry or not entry.get('access_token'):
+            return False
+        if stale_token and entry['access_token'] == stale_token:
+            return False
+        return entry['expires_at'] - time.time() > margin
+
+    @staticmethod
+    def _apply(company: Moloni, entry: Dict) -> None:
+        """Mantém a instância do chamador coerente com o token em cache"""
+        company.moloni_access_token = entry['access_token']
+        company.token_expires_at = datetime.fromtimestamp(entry['expires_at'], tz=dt_timezone.utc)
+
+    # ===== OBTER TOKEN =====
+    @staticmethod
+    def get_token(company: Moloni) -> Tuple[bool, Optional[str], str]:
+        """Devolve (sucesso, token, mensagem), renovando o token só quando já não pode ser usado"""
+        entry = MoloniTokenManager._read(company.company_id)
+        if MoloniTokenManager._is_usable(entry, MoloniTokenManager.REFRESH_MARGIN):
+            if entry['expires_at'] - time.time() <= getattr(settings, 'MOLONI_TOKEN_PROACTIVE_MINUTES', 25) * 60:
+                MoloniTokenManager.schedule_refresh(company.company_id)
+            MoloniTokenManager._apply(company, entry)
+            return True, entry['access_token'], "Token válido"
+
+        return MoloniTokenManager.refresh(company)
+
+    @staticmethod
+    def schedule_refresh(company_id) -> None:
+        """Põe a renovação em fila sem esperar por ela (no máximo uma vez por minuto e por empresa)"""
+        if not cache.add(f"{MoloniTokenManager.get_cache_key(company_id)}:scheduled", 1, 60):
+            return
+        try:
+            from apps.jobs.services import JobService
+            JobService.enqueue(
+                'moloni.token_refresh',
+                payload={'company_id': company_id},
+                dedupe_key=f"moloni:token_refresh:{company_id}",
+            )
+        except Exception as e:
+            logger.warning(f"Não foi possível agendar a renovação do token da empresa {company_id}: {str(e)}")
+
+    # ===== RENOVAÇÃO =====
+    @staticmethod
+    def _get_flight_lock(company_id) -> threading.Lock:
+        with MoloniTokenManager._local_lock:
+            lock = MoloniTokenManager._flight_locks.get(company_id)
+            if lock is None:
+                lock = threading.Lock()
+                MoloniTokenManager._flight_locks[company_id] = lock
+            return lock
+
+    @staticmethod
+    def refresh(company: Moloni, min_validity: Optional[float] = None,
+                stale_token: Optional[str] = None) -> Tuple[bool, Optional[str], str]:
+        """
+        Garante um token válido por mais de `min_validity` segundos, fazendo no
+        máximo uma renovação por empresa de cada vez. `stale_token` é o token
+        rejeitado pela API (401): obriga a renovar mesmo que ainda não expire.
+        """
+        margin = MoloniTokenManager.REFRESH_MARGIN if min_validity is None else min_validity
+        cache_key = MoloniTokenManager.get_cache_key(company.company_id)
+        lock_key = MoloniTokenManager.get_lock_key(company.company_id)
+        lock_timeout = MoloniTokenManager.get_lock_timeout()
+        deadline = time.monotonic() + getattr(settings, 'MOLONI_TOKEN_WAIT_SECONDS', 20)
+
+        with MoloniTokenManager._get_flight_lock(company.company_id):
+            owner = uuid.uuid4().hex
+            while True:
+                # Outra thread ou processo pode ter renovado enquanto se esperava
+                entry = cache.get(cache_key)
+                if MoloniTokenManager._is_usable(entry, margin, stale_token):
+                    MoloniTokenManager._remember_local(company.company_id, entry)
+                    MoloniTokenManager._apply(company, entry)
+                    return True, entry['access_token'], "Token renovado"
+
+                if MoloniTokenManager._acquire_lock(lock_key, owner, lock_timeout):
+                    try:
+                        return MoloniTokenManager._refresh_locked(company, margin, stale_token)
+                    finally:
+                        MoloniTokenManager._release_lock(lock_key, owner)
+
+                if time.monotonic() >= deadline:
+                    logger.warning(f"Tempo esgotado à espera da renovação do token de {company.name}")
+                    return False, None, "Tempo esgotado à espera da renovação do token"
+                time.sleep(MoloniTokenManager.WAIT_POLL_INTERVAL)
+
+    @staticmethod
+    def _refresh_locked(company: Moloni, margin: float,
+                        stale_token: Optional[str]) -> Tuple[bool, Optional[str], str]:
+        from apps.sechic.services import MoloniService
+
+        # A cache pode ter sido esvaziada sem o token na base de dados ter mudado
+        company.refresh_from_db(fields=[
+            'moloni_access_token', 'moloni_refresh_token', 'token_expires_at', 'token_last_refreshed'
+        ])
+        if not company.moloni_access_token:
+            MoloniTokenManager.forget(company.company_id)
+            MoloniTokenStatus.publish(company)
+            return False, None, "Sem token - autenticação necessária"
+
+        if company.token_expires_at and company.moloni_access_token != stale_token:
+            entry = {'access_token': company.moloni_access_token, 'expires_at': company.token_expires_at.timestamp()}
+            if MoloniTokenManager._is_usable(entry, margin):
+                MoloniTokenManager.remember(company)
+                return True, company.moloni_access_token, "Token válido"
+
+        if company.needs_reauth():
+            MoloniTokenManager.forget(company.company_id)
+            MoloniTokenStatus.publish(company)
+            return False, None, "Refresh token expirado - re-autenticação necessária"
+
+        success, new_token, error = MoloniService.refresh_access_token(company)
+        if not success:
+            MoloniTokenManager.forget(company.company_id)
+            MoloniTokenStatus.publish(company)
+            return False, None, error
+
+        MoloniTokenManager.remember(company)
+        return True, new_token, "Token renovado"
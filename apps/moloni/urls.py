@@ -1,7 +1,7 @@
 # apps/moloni/urls.py
 
 from django.urls import path
-from .views import SelectCompanyView, moloni_login, moloni_user_callback, select_company, ConfigMoloniView, save_credentials
+from .views import SelectCompanyView, moloni_login, moloni_user_callback, select_company, ConfigMoloniView, save_credentials, http_metrics
 
 app_name = 'moloni'
 
@@ -12,4 +12,5 @@ urlpatterns = [
     path('select/<int:company_id>/', select_company, name='select_company_id'), 
     path('config/', ConfigMoloniView.as_view(), name='config'),
     path('save-credentials/', save_credentials, name='save_credentials'),
+    path('api/http-metrics/', http_metrics, name='http_metrics'),
 ]
@@ -1,6 +1,6 @@
 # apps/moloni/views.py
 
-import requests
+import os
 import urllib.parse
 import logging
 
@@ -9,7 +9,7 @@ from django.views.generic import ListView, TemplateView, View
 from web_project import TemplateLayout
 from django.contrib.auth.decorators import login_required
 from django.utils.decorators import method_decorator
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.conf import settings
 from django.contrib import messages
 from django.shortcuts import get_object_or_404
@@ -21,7 +21,9 @@ from django.contrib.auth.models import User
 from auth.models import Profile
 from apps.sechic.services import MoloniService
 from apps.product_moloni.services import ProductMoloniService
+from .client import MoloniHttpClient
 from .models import MoloniCredentials, Moloni
+from .tokens import MoloniTokenManager
 
 logger = logging.getLogger(__name__)
 
@@ -196,7 +198,7 @@ def moloni_user_callback(request):
         }
 
         token_url_with_params = f"{base_token_url}?{urllib.parse.urlencode(params)}"
-        response = requests.get(token_url_with_params)
+        response = MoloniHttpClient.get(token_url_with_params)
         
         if response.status_code != 200:
             messages.error(request, f"Falha ao obter token de acesso: {response.text}")
@@ -212,7 +214,7 @@ def moloni_user_callback(request):
 
         # Obter dados do usuário
         user_info_url = f"https://api.moloni.pt/v1/users/getMe/?access_token={access_token}"
-        user_info_response = requests.get(user_info_url)
+        user_info_response = MoloniHttpClient.get(user_info_url)
         user_info = user_info_response.json()
 
         if 'user_id' not in user_info:
@@ -221,7 +223,7 @@ def moloni_user_callback(request):
 
         # Obter empresas
         companies_url = f"https://api.moloni.pt/v1/companies/getAll/?access_token={access_token}"
-        companies_response = requests.get(companies_url)
+        companies_response = MoloniHttpClient.get(companies_url)
         companies_data = companies_response.json()
         
         if not companies_data or not isinstance(companies_data, list):
@@ -249,6 +251,7 @@ def moloni_user_callback(request):
                 }
             )
             company.users.add(request.user)
+            MoloniTokenManager.remember(company)
         
         # Verificar se o usuário já tem uma empresa selecionada
         if hasattr(request.user, 'profile') and request.user.profile.selected_moloni_company:
@@ -260,6 +263,7 @@ def moloni_user_callback(request):
             selected_company.token_last_refreshed = timezone.now()
             selected_company.token_expires_at = token_expires_at
             selected_company.save()
+            MoloniTokenManager.remember(selected_company)
             
             # Atualizar sessão
             request.session['access_token'] = access_token
@@ -335,4 +339,21 @@ def save_credentials(request):
         messages.success(request, "Credenciais do Moloni salvas com sucesso!")
         return redirect('moloni:moloni-login')
     
-    return redirect('moloni:config')
\ No newline at end of file
+    return redirect('moloni:config')
+
+@login_required
+def http_metrics(request):
+    """
+    Latência por endpoint da API Moloni. Com Redis agrega todos os processos
+    (scope 'global'); sem Redis só o processo `pid` que atende o pedido.
+    """
+    if not request.user.is_staff:
+        return JsonResponse({'success': False, 'message': 'Acesso negado'}, status=403)
+
+    metrics, scope = MoloniHttpClient.get_metrics(reset=request.GET.get('reset') == '1')
+    return JsonResponse({
+        'success': True,
+        'scope': scope,
+        'pid': os.getpid(),
+        'metrics': metrics,
+    })
@@ -0,0 +1,34 @@
+# apps/product_moloni/jobs.py
+from apps.jobs.registry import register
+from apps.moloni.models import Moloni
+
+from .progress import SyncProgressStore
+from .services import BackgroundSyncService
+
+
+@register('product_moloni.catalog_sync', max_attempts=2, lease_seconds=300)
+def run_catalog_sync(job, context):
+    company = Moloni.objects.get(pk=job.payload['company_id'])
+    sync_key = f"sync_progress_{company.id}"
+
+    # Cancelamentos via cancel_sync são vistos pelo próprio ciclo (_should_continue)
+    context.check_cancelled()
+    if job.attempts > 1 and SyncProgressStore.get_status(sync_key) == 'error':
+        # Nova tentativa: com o estado 'error' o _should_continue pararia logo no início
+        BackgroundSyncService._update_progress(sync_key, {
+            'status': 'processing',
+            'message': f'Nova tentativa ({job.attempts}/{job.max_attempts})...',
+            'progress': 0
+        })
+
+    if job.payload.get('mode') == 'delta':
+        BackgroundSyncService._sync_products_delta(company, sync_key)
+    else:
+        BackgroundSyncService._sync_products_background(company, job.payload.get('force_delete', False), sync_key)
+
+    progress = BackgroundSyncService.get_sync_progress(company.id) or {}
+    # Os métodos de sincronização registam a exceção no progresso; o job tem de falhar
+    # para que o estado e as novas tentativas reflitam o erro
+    if progress.get('status') == 'error':
+        raise Exception(progress.get('message') or 'Erro na sincronização')
+    return {'status': progress.get('status'), 'stats': progress.get('stats', {})}
@@ -0,0 +1,37 @@
+# apps/product_moloni/management/commands/reconcile_moloni_products.py
+from django.core.management.base import BaseCommand
+
+from apps.moloni.models import Moloni
+from apps.product_moloni.services import ProductMoloniService
+
+
+class Command(BaseCommand):
+    help = (
+        "Reconciliação completa do espelho local de produtos com o catálogo Moloni. "
+        "Os envios do aitigos só atualizam os produtos inseridos; este comando deve "
+        "ser agendado (ex.: cron diário) para apanhar alterações feitas diretamente no Moloni."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--company', type=int, action='append', dest='company_ids',
+                            help='company_id Moloni a reconciliar (pode repetir); por omissão todas')
+        parser.add_argument('--force-delete', action='store_true',
+                            help='Remove do espelho local os produtos que já não existem no Moloni')
+
+    def handle(self, *args, **options):
+        companies = Moloni.objects.exclude(moloni_access_token__isnull=True).exclude(moloni_access_token='')
+        if options['company_ids']:
+            companies = companies.filter(company_id__in=options['company_ids'])
+
+        for company in companies:
+            if company.needs_reauth():
+                self.stderr.write(self.style.WARNING(f"{company.name}: re-autenticação necessária, ignorada"))
+                continue
+
+            success, message, stats = ProductMoloniService.fetch_and_store_products(
+                company, force_delete=options['force_delete']
+            )
+            if success:
+                self.stdout.write(self.style.SUCCESS(f"{company.name}: {message}"))
+            else:
+                self.stderr.write(self.style.ERROR(f"{company.name}: {message}"))
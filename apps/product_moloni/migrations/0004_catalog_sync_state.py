@@ -0,0 +1,30 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:43
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('moloni', '0003_molonicredentials'),
+        ('product_moloni', '0003_alter_product_ean'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CatalogSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modified_since', models.DateTimeField(blank=True, null=True)),
+                ('last_delta_sync_at', models.DateTimeField(blank=True, null=True)),
+                ('last_full_sync_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_sync_state', to='moloni.moloni')),
+            ],
+            options={
+                'verbose_name': 'Catalog Sync State',
+                'verbose_name_plural': 'Catalog Sync States',
+            },
+        ),
+    ]
@@ -42,4 +42,20 @@ class ProductVariant(models.Model):
     
     class Meta:
         verbose_name = "Product Variant"
-        verbose_name_plural = "Product Variants"
\ No newline at end of file
+        verbose_name_plural = "Product Variants"
+
+class CatalogSyncState(models.Model):
+    """Marca de água da sincronização incremental do catálogo Moloni (uma por empresa)"""
+    company = models.OneToOneField(Moloni, on_delete=models.CASCADE, related_name='catalog_sync_state')
+    # Produtos alterados depois desta data ainda não estão no espelho local
+    modified_since = models.DateTimeField(null=True, blank=True)
+    last_delta_sync_at = models.DateTimeField(null=True, blank=True)
+    last_full_sync_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.company} ({self.modified_since})"
+
+    class Meta:
+        verbose_name = "Catalog Sync State"
+        verbose_name_plural = "Catalog Sync States"
@@ -0,0 +1,192 @@
+# apps/product_moloni/progress.py
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+
+from apps.jobs.streams import ProgressStream
+
+
+class SyncProgressStore:
+    """
+    Progresso das sincronizações em background em chaves Redis separadas, para
+    que vários workers possam reportar sem se sobreporem:
+
+    - `<chave>:status`   estado (lido por _should_continue sem carregar o resto)
+    - `<chave>:fields`   hash com os restantes campos (progress, message, ...)
+    - `<chave>:stats`    hash de contadores atualizados com HINCRBY
+    - `<chave>:messages` lista limitada às últimas MAX_MESSAGES mensagens
+
+    Cada escrita publica uma notificação no canal da chave (ver ProgressStream)
+    para as ligações SSE abertas. Sem Redis (ex.: cache local em desenvolvimento)
+    usa a cache do Django com um lock de processo.
+    """
+    TIMEOUT = 7200
+    FINISHED_TIMEOUT = 300
+    MAX_MESSAGES = 50
+
+    _fallback_lock = threading.Lock()
+
+    @staticmethod
+    def _redis():
+        try:
+            from django_redis import get_redis_connection
+            return get_redis_connection('default')
+        except (ImportError, NotImplementedError):
+            return None
+
+    @staticmethod
+    def _keys(sync_key: str) -> Dict[str, str]:
+        return {part: cache.make_key(f"{sync_key}:{part}") for part in ('status', 'fields', 'stats', 'messages')}
+
+    @staticmethod
+    def _dumps(value: Any) -> str:
+        return json.dumps(value, cls=DjangoJSONEncoder)
+
+    # ===== ESCRITA =====
+    @staticmethod
+    def start(sync_key: str, fields: Dict[str, Any], stats: Dict[str, int]) -> None:
+        fields = dict(fields)
+        status = fields.pop('status', 'started')
+        client = SyncProgressStore._redis()
+
+        if client is None:
+            with SyncProgressStore._fallback_lock:
+                cache.set(f"{sync_key}:status", status, SyncProgressStore.TIMEOUT)
+                cache.set(f"{sync_key}:fields", fields, SyncProgressStore.TIMEOUT)
+                cache.set(f"{sync_key}:stats", dict(stats), SyncProgressStore.TIMEOUT)
+                cache.set(f"{sync_key}:messages", [], SyncProgressStore.TIMEOUT)
+            return
+
+        keys = SyncProgressStore._keys(sync_key)
+        pipe = client.pipeline()
+        pipe.delete(*keys.values())
+        pipe.set(keys['status'], status, ex=SyncProgressStore.TIMEOUT)
+        if fields:
+            pipe.hset(keys['fields'], mapping={k: SyncProgressStore._dumps(v) for k, v in fields.items()})
+        if stats:
+            pipe.hset(keys['stats'], mapping={k: int(v) for k, v in stats.items()})
+        for key in (keys['fields'], keys['stats']):
+            pipe.expire(key, SyncProgressStore.TIMEOUT)
+        pipe.publish(ProgressStream.get_channel(sync_key), 1)
+        pipe.execute()
+
+    @staticmethod
+    def set_fields(sync_key: str, updates: Dict[str, Any], timeout: Optional[int] = None) -> None:
+        updates = dict(updates)
+        status = updates.pop('status', None)
+        timeout = timeout or SyncProgressStore.TIMEOUT
+        client = SyncProgressStore._redis()
+
+        if client is None:
+            with SyncProgressStore._fallback_lock:
+                if status is not None:
+                    cache.set(f"{sync_key}:status", status, timeout)
+                fields = cache.get(f"{sync_key}:fields") or {}
+                fields.update(updates)
+                cache.set(f"{sync_key}:fields", fields, timeout)
+                if timeout != SyncProgressStore.TIMEOUT:
+                    for part in ('status', 'stats', 'messages'):
+                        cache.touch(f"{sync_key}:{part}", timeout)
+            return
+
+        keys = SyncProgressStore._keys(sync_key)
+        pipe = client.pipeline()
+        if status is not None:
+            pipe.set(keys['status'], status, ex=timeout)
+        if updates:
+            pipe.hset(keys['fields'], mapping={k: SyncProgressStore._dumps(v) for k, v in updates.items()})
+        pipe.expire(keys['fields'], timeout)
+        if timeout != SyncProgressStore.TIMEOUT:
+            for part in ('status', 'stats', 'messages'):
+                pipe.expire(keys[part], timeout)
+        pipe.publish(ProgressStream.get_channel(sync_key), 1)
+        pipe.execute()
+
+    @staticmethod
+    def incr_stats(sync_key: str, stats: Dict[str, int]) -> None:
+        stats = {k: int(v) for k, v in stats.items() if v}
+        if not stats:
+            return
+        client = SyncProgressStore._redis()
+
+        if client is None:
+            with SyncProgressStore._fallback_lock:
+                current = cache.get(f"{sync_key}:stats") or {}
+                for key, value in stats.items():
+                    current[key] = current.get(key, 0) + value
+                cache.set(f"{sync_key}:stats", current, SyncProgressStore.TIMEOUT)
+            return
+
+        key = SyncProgressStore._keys(sync_key)['stats']
+        pipe = client.pipeline()
+        for field, value in stats.items():
+            pipe.hincrby(key, field, value)
+        pipe.expire(key, SyncProgressStore.TIMEOUT)
+        pipe.publish(ProgressStream.get_channel(sync_key), 1)
+        pipe.execute()
+
+    @staticmethod
+    def add_message(sync_key: str, message: Dict[str, Any]) -> None:
+        client = SyncProgressStore._redis()
+
+        if client is None:
+            with SyncProgressStore._fallback_lock:
+                messages = cache.get(f"{sync_key}:messages") or []
+                messages = (messages + [message])[-SyncProgressStore.MAX_MESSAGES:]
+                cache.set(f"{sync_key}:messages", messages, SyncProgressStore.TIMEOUT)
+            return
+
+        key = SyncProgressStore._keys(sync_key)['messages']
+        pipe = client.pipeline()
+        pipe.rpush(key, SyncProgressStore._dumps(message))
+        pipe.ltrim(key, -SyncProgressStore.MAX_MESSAGES, -1)
+        pipe.expire(key, SyncProgressStore.TIMEOUT)
+        pipe.publish(ProgressStream.get_channel(sync_key), 1)
+        pipe.execute()
+
+    # ===== LEITURA =====
+    @staticmethod
+    def get_status(sync_key: str) -> Optional[str]:
+        client = SyncProgressStore._redis()
+        if client is None:
+            return cache.get(f"{sync_key}:status")
+
+        status = client.get(SyncProgressStore._keys(sync_key)['status'])
+        return status.decode() if isinstance(status, bytes) else status
+
+    @staticmethod
+    def get(sync_key: str) -> Optional[Dict[str, Any]]:
+        client = SyncProgressStore._redis()
+
+        if client is None:
+            status = cache.get(f"{sync_key}:status")
+            if status is None:
+                return None
+            progress = dict(cache.get(f"{sync_key}:fields") or {})
+            progress.update({
+                'status': status,
+                'stats': dict(cache.get(f"{sync_key}:stats") or {}),
+                'messages': list(cache.get(f"{sync_key}:messages") or []),
+            })
+            return progress
+
+        keys = SyncProgressStore._keys(sync_key)
+        pipe = client.pipeline()
+        pipe.get(keys['status'])
+        pipe.hgetall(keys['fields'])
+        pipe.hgetall(keys['stats'])
+        pipe.lrange(keys['messages'], 0, -1)
+        status, fields, stats, messages = pipe.execute()
+        if status is None:
+            return None
+
+        progress = {k.decode(): json.loads(v) for k, v in fields.items()}
+        progress.update({
+            'status': status.decode(),
+            'stats': {k.decode(): int(v) for k, v in stats.items()},
+            'messages': [json.loads(m) for m in messages],
+        })
+        return progress
@@ -5,20 +5,30 @@ import json
 import time
 import threading
 
-from django.db import transaction, connection
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.db import transaction, connection, close_old_connections
 from django.utils import timezone
 from django.core.cache import cache
 
 from typing import Dict, List, Any, Tuple, Optional
 from django.conf import settings
 from apps.sechic.models import Category, Supplier
-from apps.product_moloni.models import Product, ProductVariant
+from apps.product_moloni.models import Product, ProductVariant, CatalogSyncState
 from apps.sechic.services import MoloniService
 from apps.moloni.models import Moloni   
+from apps.moloni.rate_limit import MoloniRateLimiter
+from apps.jobs.services import JobService
+from .progress import SyncProgressStore
 
 logger = logging.getLogger(__name__)
 
 class ProductMoloniService:
+    BULK_UPSERT_BATCH_SIZE = 500
+    # Máximo de produtos por página aceite por products/getAll
+    GET_ALL_PAGE_SIZE = 50
+
     @staticmethod
     def _safe_moloni_request(url, company, method='POST', data=None):
         try:
@@ -34,13 +44,13 @@ class ProductMoloniService:
             return False, None, f"Erro inesperado: {str(e)}"
 
     @staticmethod
-    def get_product_details(company, product_id):
+    def get_product_details(company, product_id, rate_limiter=None):
         try:
             url = "https://api.moloni.pt/v1/products/getOne/"
             data = {"product_id": product_id}
             
             success, product_data, error = MoloniService._make_authenticated_request_encode(
-                url, company, 'POST', data
+                url, company, 'POST', data, rate_limiter=rate_limiter
             )
             
             if success and product_data:
@@ -55,63 +65,62 @@ class ProductMoloniService:
 
     @staticmethod
     def _get_category_products_list(company, category_id):
-        try:
-            count_url = "https://api.moloni.pt/v1/products/count/"
-            count_data = {"category_id": category_id}
-            
-            count_success, count_response, count_error = MoloniService._make_authenticated_request_encode(
-                count_url, company, 'POST', count_data
+        """
+        Lista completa dos produtos da categoria. Uma listagem incompleta lança
+        exceção: os ids em falta levariam à remoção dos produtos locais.
+        """
+        count_url = "https://api.moloni.pt/v1/products/count/"
+        count_data = {"category_id": category_id}
+        
+        rate_limiter = MoloniRateLimiter.for_company(company.id)
+        count_success, count_response, count_error = MoloniService._make_authenticated_request_encode(
+            count_url, company, 'POST', count_data, rate_limiter=rate_limiter
+        )
+        
+        if not count_success:
+            raise Exception(f"Erro ao obter contagem da categoria {category_id}: {count_error}")
+        
+        total_products = int(count_response.get("count", 0))
+        
+        if total_products == 0:
+            return []
+        
+        all_products = []
+        batch_size = ProductMoloniService.GET_ALL_PAGE_SIZE
+        offset = 0
+        
+        while offset < total_products:
+            params = {
+                "category_id": category_id,
+                "offset": offset,
+                "qty": batch_size,
+                "with_invisible": 1  
+            }
+            
+            url = "https://api.moloni.pt/v1/products/getAll/"
+            success, products_data, error = MoloniService._make_authenticated_request_encode(
+                url, company, 'POST', params, rate_limiter=rate_limiter
             )
             
-            if not count_success:
-                logger.warning(f"Erro ao obter contagem da categoria {category_id}: {count_error}")
-                return []
+            if not success:
+                raise Exception(f"Erro ao buscar produtos da categoria {category_id}, offset {offset}: {error}")
+            if not products_data:
+                break
             
-            total_products = int(count_response.get("count", 0))
+            all_products.extend(products_data)
+            offset += len(products_data)
             
-            if total_products == 0:
-                return []
-            
-            all_products = []
-            batch_size = 50 
-            offset = 0
-            
-            while offset < total_products:
-                params = {
-                    "category_id": category_id,
-                    "offset": offset,
-                    "qty": batch_size,
-                    "with_invisible": 1  
-                }
-                
-                url = "https://api.moloni.pt/v1/products/getAll/"
-                success, products_data, error = MoloniService._make_authenticated_request_encode(
-                    url, company, 'POST', params
-                )
-                
-                if not success or not products_data:
-                    logger.warning(f"Erro ao buscar produtos da categoria {category_id}, offset {offset}: {error}")
-                    break
-                
-                all_products.extend(products_data)
-                offset += len(products_data)
-                
-                if len(products_data) < batch_size:
-                    break
-                
-                time.sleep(0.2)
-            
-            logger.info(f"Categoria {category_id}: obtidos {len(all_products)} produtos")
-            return all_products
-            
-        except Exception as e:
-            logger.exception(f"Erro ao obter lista de produtos da categoria {category_id}: {str(e)}")
-            return []
+            if len(products_data) < batch_size:
+                break
+        
+        logger.info(f"Categoria {category_id}: obtidos {len(all_products)} produtos")
+        return all_products
 
     @staticmethod
     def fetch_and_store_products(company, force_delete: bool = False) -> Tuple[bool, str, Dict[str, int]]:
         logger.info(f"Iniciando sincronização DETALHADA de produtos do Moloni - Empresa: {company.name}")
         start_time = time.time()
+        started_at = timezone.now()
         
         moloni_product_ids = set()
         stats = {
@@ -119,7 +128,9 @@ class ProductMoloniService:
             "updated": 0,
             "deleted": 0,
             "total": 0,
-            "errors": 0
+            "errors": 0,
+            "details_fetched": 0,
+            "details_skipped": 0
         }
         
         try:
@@ -145,58 +156,35 @@ class ProductMoloniService:
                     found_any_products = True
                     stats["total"] += len(products_list)
                     
-                    # Processar cada produto individualmente para obter detalhes completos
-                    for basic_product in products_list:
-                        try:
-                            product_id = basic_product.get("product_id")
-                            if not product_id:
-                                continue
-                            
-                            moloni_product_ids.add(product_id)
-                            
-                            # Obter detalhes completos do produto
-                            detailed_product = ProductMoloniService.get_product_details(company, product_id)
-                            
-                            if detailed_product:
-                                # Usar dados detalhados que incluem supplier
-                                product, created = ProductMoloniService.create_or_update_product(
-                                    detailed_product, company
-                                )
-                                
-                                if product:
-                                    if created:
-                                        stats["added"] += 1
-                                    else:
-                                        stats["updated"] += 1
-                                else:
-                                    stats["errors"] += 1
-                            else:
-                                # Fallback: usar dados básicos se não conseguir obter detalhes
-                                product, created = ProductMoloniService.create_or_update_product(
-                                    basic_product, company
-                                )
-                                
-                                if product:
-                                    if created:
-                                        stats["added"] += 1
-                                    else:
-                                        stats["updated"] += 1
-                                else:
-                                    stats["errors"] += 1
-                            
-                            # Pausa pequena para não sobrecarregar a API
-                            time.sleep(0.1)
-                            
-                        except Exception as e:
-                            logger.exception(f"Erro ao processar produto {product_id}: {str(e)}")
-                            stats["errors"] += 1
+                    products_list = [p for p in products_list if p.get("product_id")]
+                    moloni_product_ids.update(p["product_id"] for p in products_list)
+                    
+                    # getOne só para produtos novos/alterados cujo getAll não traz o fornecedor
+                    ready, to_fetch = ProductMoloniService._split_by_detail_need(products_list)
+                    stats["details_skipped"] += len(ready)
+                    stats["details_fetched"] += len(to_fetch)
+                    
+                    page = ready + ProductMoloniService._fetch_product_details(company, to_fetch)
+                    for start in range(0, len(page), ProductMoloniService.BULK_UPSERT_BATCH_SIZE):
+                        ProductMoloniService._store_page(
+                            page[start:start + ProductMoloniService.BULK_UPSERT_BATCH_SIZE], company, stats
+                        )
                     
                 except Exception as e:
                     logger.exception(f"Erro ao processar categoria {category_id}: {str(e)}")
                     stats["errors"] += 1
             
+            # Com categorias ou lotes falhados a lista de ids está incompleta:
+            # não remover produtos nem avançar a marca de sincronização
+            complete = stats["errors"] == 0
+            
             # Limpeza de produtos obsoletos
-            if not found_any_products or stats["total"] == 0:
+            if not complete:
+                logger.warning(
+                    f"Sincronização incompleta ({stats['errors']} erros): limpeza de obsoletos e marca de sincronização adiadas"
+                )
+            
+            elif not found_any_products or stats["total"] == 0:
                 logger.info("NENHUM produto encontrado no Moloni.")
                 local_products = Product.objects.filter(company=company)
                 local_count = local_products.count()
@@ -235,6 +223,11 @@ class ProductMoloniService:
                     message += f", {stats['deleted']} excluídos"
                 if stats["errors"] > 0:
                     message += f", {stats['errors']} erros"
+                if stats["details_skipped"] > 0:
+                    message += f" ({stats['details_skipped']} pedidos de detalhe evitados)"
+            
+            if complete:
+                ProductMoloniService.mark_catalog_synced(company, started_at, full=True)
             
             elapsed_time = time.time() - start_time
             logger.info(f"Sincronização detalhada concluída em {elapsed_time:.2f} segundos")
@@ -247,6 +240,128 @@ class ProductMoloniService:
             logger.exception(f"Erro na sincronização detalhada após {elapsed_time:.2f}s: {str(e)}")
             return (False, f"Erro na sincronização: {str(e)}", stats)
 
+    @staticmethod
+    def fetch_modified_products(company, since) -> Tuple[bool, List[Dict], Optional[str]]:
+        """Produtos alterados no Moloni desde `since` (products/getModifiedSince, paginado)"""
+        url = "https://api.moloni.pt/v1/products/getModifiedSince/"
+        lastmodified = timezone.localtime(since).strftime('%Y-%m-%d %H:%M:%S')
+        rate_limiter = MoloniRateLimiter.for_company(company.id)
+        batch_size = 50
+        offset = 0
+        products = []
+        
+        while True:
+            success, products_data, error = MoloniService._make_authenticated_request_encode(
+                url, company, 'POST',
+                {"lastmodified": lastmodified, "offset": offset, "qty": batch_size, "with_invisible": 1},
+                rate_limiter=rate_limiter
+            )
+            if not success:
+                return False, products, error
+            if not products_data:
+                break
+            
+            products.extend(products_data)
+            offset += len(products_data)
+            if len(products_data) < batch_size:
+                break
+        
+        return True, products, None
+
+    @staticmethod
+    def get_sync_state(company) -> CatalogSyncState:
+        state, _ = CatalogSyncState.objects.get_or_create(company=company)
+        return state
+
+    @staticmethod
+    def mark_catalog_synced(company, started_at, full: bool) -> None:
+        """
+        Avança a marca de água para o início da sincronização (menos uma margem,
+        para não perder alterações feitas durante a própria sincronização).
+        """
+        overlap = timedelta(seconds=getattr(settings, 'MOLONI_DELTA_SYNC_OVERLAP_SECONDS', 300))
+        updates = {
+            'modified_since': started_at - overlap,
+            'last_delta_sync_at': timezone.now(),
+        }
+        if full:
+            updates['last_full_sync_at'] = timezone.now()
+        CatalogSyncState.objects.update_or_create(company=company, defaults=updates)
+
+    @staticmethod
+    def _has_supplier_data(product_data) -> bool:
+        return any(product_data.get(key) for key in ("suppliers", "supplier", "supplier_id"))
+
+    @staticmethod
+    def _split_by_detail_need(products_list: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+        """
+        Separa os produtos do getAll entre os que podem ser gravados diretamente
+        e os que precisam de products/getOne: só estes últimos não trazem o
+        fornecedor e são novos ou diferem do espelho local.
+        """
+        ids = [
+            ProductMoloniService.safe_int_conversion(p.get("product_id")) for p in products_list
+        ]
+        local = {
+            row["product_id"]: row
+            for row in Product.objects.filter(product_id__in=[i for i in ids if i]).values(
+                "product_id", "reference", "name", "ean", "price", "supplier_id"
+            )
+        }
+        
+        ready, to_fetch = [], []
+        for basic_product in products_list:
+            if ProductMoloniService._has_supplier_data(basic_product):
+                ready.append(basic_product)
+                continue
+            
+            fields = ProductMoloniService.build_product_fields(basic_product)
+            current = local.get(fields["product_id"]) if fields else None
+            unchanged = current is not None and current["supplier_id"] is not None and (
+                current["reference"] == fields["reference"]
+                and current["name"] == fields["name"]
+                and (not fields["ean"] or current["ean"] == fields["ean"])
+                and float(current["price"]) == float(fields["price"])
+            )
+            (ready if unchanged else to_fetch).append(basic_product)
+        
+        return ready, to_fetch
+
+    @staticmethod
+    def _fetch_product_details(company, products_list: List[Dict]) -> List[Dict]:
+        """products/getOne em paralelo, limitado pelo token bucket da empresa"""
+        if not products_list:
+            return []
+        
+        rate_limiter = MoloniRateLimiter.for_company(company.id)
+        
+        def fetch(basic_product):
+            close_old_connections()
+            try:
+                detailed_product = ProductMoloniService.get_product_details(
+                    company, basic_product.get("product_id"), rate_limiter=rate_limiter
+                )
+                # Fallback: usar dados básicos se não conseguir obter detalhes
+                return detailed_product or basic_product
+            finally:
+                close_old_connections()
+        
+        workers = getattr(settings, 'MOLONI_SYNC_DETAIL_WORKERS', 4)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='moloni-details') as executor:
+            return list(executor.map(fetch, products_list))
+
+    @staticmethod
+    def _store_page(page: List[Dict], company, stats: Dict[str, int]) -> None:
+        if not page:
+            return
+        try:
+            page_stats, _ = ProductMoloniService.bulk_upsert_products(page, company)
+            for key, value in page_stats.items():
+                stats[key] += value
+        except Exception as e:
+            logger.exception(f"Erro ao gravar lote de {len(page)} produtos: {str(e)}")
+            stats["errors"] += len(page)
+
     @staticmethod
     def clean_field_data(value, max_length=None, field_name="campo"):
         if value is None:
@@ -308,54 +423,50 @@ class ProductMoloniService:
         return ""
 
     @staticmethod
-    def create_or_update_product(product_data, company):
-        try:
-            product_id = ProductMoloniService.safe_int_conversion(product_data.get("product_id"))
-            
-            if not product_id:
-                logger.warning(f"Product ID inválido: {product_data.get('product_id')}")
-                return None, False
-            
-            # Limpar e validar dados básicos
-            reference = ProductMoloniService.clean_field_data(
+    def build_product_fields(product_data) -> Optional[Dict[str, Any]]:
+        """Campos do espelho local a partir de um produto Moloni (None se o product_id for inválido)"""
+        product_id = ProductMoloniService.safe_int_conversion(product_data.get("product_id"))
+        
+        if not product_id:
+            logger.warning(f"Product ID inválido: {product_data.get('product_id')}")
+            return None
+        
+        return {
+            "product_id": product_id,
+            "reference": ProductMoloniService.clean_field_data(
                 product_data.get("reference", ""), max_length=100, field_name="Reference"
-            )
-            
-            name = ProductMoloniService.clean_field_data(
+            ),
+            "name": ProductMoloniService.clean_field_data(
                 product_data.get("name", ""), max_length=255, field_name="Name"
-            )
-            
-            summary = ProductMoloniService.clean_field_data(
+            ),
+            "summary": ProductMoloniService.clean_field_data(
                 product_data.get("summary", ""), field_name="Summary"
-            )
-            
-            ean = ProductMoloniService.extract_ean_from_product_data(product_data)
-            
-            price = ProductMoloniService.safe_decimal_conversion(product_data.get("price", 0))
-            stock = ProductMoloniService.safe_decimal_conversion(product_data.get("stock", 0))
-            
-            type_value = ProductMoloniService.safe_int_conversion(product_data.get("type", 1), default=1)
-            unit_id = ProductMoloniService.safe_int_conversion(product_data.get("unit_id"))
-            
-            has_stock = bool(product_data.get("has_stock", False))
+            ),
+            "ean": ProductMoloniService.extract_ean_from_product_data(product_data),
+            "price": ProductMoloniService.safe_decimal_conversion(product_data.get("price", 0)),
+            "stock": ProductMoloniService.safe_decimal_conversion(product_data.get("stock", 0)),
+            "type": ProductMoloniService.safe_int_conversion(product_data.get("type", 1), default=1),
+            "unit_id": ProductMoloniService.safe_int_conversion(product_data.get("unit_id")),
+            "has_stock": bool(product_data.get("has_stock", False)),
+        }
+
+    @staticmethod
+    def create_or_update_product(product_data, company):
+        try:
+            fields = ProductMoloniService.build_product_fields(product_data)
+            if not fields:
+                return None, False
             
             # Tentar obter produto existente
             try:
-                product = Product.objects.get(product_id=product_id)
+                product = Product.objects.get(product_id=fields["product_id"])
                 created = False
             except Product.DoesNotExist:
-                product = Product(product_id=product_id, company=company)
+                product = Product(product_id=fields["product_id"], company=company)
                 created = True
             
-            product.reference = reference
-            product.name = name
-            product.summary = summary
-            product.ean = ean
-            product.price = price
-            product.stock = stock
-            product.type = type_value
-            product.unit_id = unit_id
-            product.has_stock = has_stock
+            for field, value in fields.items():
+                setattr(product, field, value)
             product.company = company
             
             product.save()
@@ -369,7 +480,208 @@ class ProductMoloniService:
         except Exception as e:
             logger.exception(f"Erro ao criar/atualizar produto {product_data.get('product_id')}: {str(e)}")
             return None, False
-    
+
+    @staticmethod
+    def extract_category_ref(product_data) -> Optional[Tuple[int, str]]:
+        category_data = product_data.get("category")
+        if not category_data or not isinstance(category_data, dict):
+            return None
+        
+        category_id = ProductMoloniService.safe_int_conversion(category_data.get("category_id"))
+        if not category_id:
+            return None
+        
+        return category_id, ProductMoloniService.clean_field_data(
+            category_data.get("name", ""), max_length=255, field_name="Category Name"
+        )
+
+    @staticmethod
+    def extract_supplier_ref(product_data) -> Optional[Tuple[int, Optional[str]]]:
+        """(supplier_id, nome) do fornecedor do produto; o nome é None quando a API só devolve o ID"""
+        supplier_id = None
+        supplier_name = None
+        
+        suppliers_array = product_data.get("suppliers")
+        if suppliers_array:
+            if isinstance(suppliers_array, list) and isinstance(suppliers_array[0], dict):
+                supplier_id = suppliers_array[0].get("supplier_id")
+        elif product_data.get("supplier"):
+            supplier_data = product_data["supplier"]
+            if isinstance(supplier_data, dict):
+                supplier_id = supplier_data.get("supplier_id")
+                supplier_name = supplier_data.get("name")
+        elif product_data.get("supplier_id"):
+            supplier_id = product_data["supplier_id"]
+        
+        supplier_id = ProductMoloniService.safe_int_conversion(supplier_id)
+        if not supplier_id:
+            return None
+        
+        if supplier_name:
+            supplier_name = ProductMoloniService.clean_field_data(
+                supplier_name, max_length=255, field_name="Supplier Name"
+            )
+        return supplier_id, supplier_name or None
+
+    @staticmethod
+    def _resolve_categories(company, category_refs: Dict[int, str]) -> Dict[int, Category]:
+        if not category_refs:
+            return {}
+        
+        categories = Category.objects.filter(company=company).in_bulk(list(category_refs))
+        missing = [
+            Category(category_id=category_id, company=company, name=name)
+            for category_id, name in category_refs.items() if category_id not in categories
+        ]
+        if missing:
+            Category.objects.bulk_create(missing, ignore_conflicts=True)
+            categories = Category.objects.filter(company=company).in_bulk(list(category_refs))
+        
+        return categories
+
+    @staticmethod
+    def _resolve_suppliers(company, supplier_refs: Dict[int, Optional[str]]) -> Dict[int, Supplier]:
+        if not supplier_refs:
+            return {}
+        
+        suppliers = Supplier.objects.filter(company=company).in_bulk(list(supplier_refs))
+        
+        renamed = []
+        for supplier_id, name in supplier_refs.items():
+            supplier = suppliers.get(supplier_id)
+            if supplier and name and supplier.name != name:
+                supplier.name = name
+                renamed.append(supplier)
+        if renamed:
+            Supplier.objects.bulk_update(renamed, ['name'])
+        
+        missing = []
+        for supplier_id, name in supplier_refs.items():
+            if supplier_id in suppliers:
+                continue
+            # Só os fornecedores desconhecidos localmente custam um pedido ao Moloni
+            name = name or ProductMoloniService.get_supplier_name_by_id(company, supplier_id)
+            missing.append(Supplier(supplier_id=supplier_id, company=company, name=name or f"Fornecedor {supplier_id}"))
+        if missing:
+            Supplier.objects.bulk_create(missing, ignore_conflicts=True)
+            suppliers = Supplier.objects.filter(company=company).in_bulk(list(supplier_refs))
+        
+        return suppliers
+
+    @staticmethod
+    def bulk_upsert_products(products_data: List[Dict], company) -> Tuple[Dict[str, int], List[int]]:
+        """
+        Escreve uma página de produtos Moloni no espelho local: categorias e
+        fornecedores são resolvidos em memória e os produtos gravados com um
+        único INSERT ... ON CONFLICT. Devolve (estatísticas, product_ids gravados).
+        """
+        stats = {"added": 0, "updated": 0, "errors": 0}
+        
+        rows = {}
+        category_refs = {}
+        supplier_refs = {}
+        for product_data in products_data:
+            try:
+                fields = ProductMoloniService.build_product_fields(product_data)
+            except Exception as e:
+                logger.exception(f"Erro ao preparar produto {product_data.get('product_id')}: {str(e)}")
+                fields = None
+            if not fields:
+                stats["errors"] += 1
+                continue
+            
+            category_ref = ProductMoloniService.extract_category_ref(product_data)
+            if category_ref:
+                category_refs[category_ref[0]] = category_ref[1]
+            supplier_ref = ProductMoloniService.extract_supplier_ref(product_data)
+            if supplier_ref:
+                supplier_refs[supplier_ref[0]] = supplier_ref[1] or supplier_refs.get(supplier_ref[0])
+            
+            # O mesmo produto pode repetir-se entre páginas/categorias: fica a última versão
+            rows[fields["product_id"]] = (fields, category_ref, supplier_ref)
+        
+        if not rows:
+            return stats, []
+        
+        categories = ProductMoloniService._resolve_categories(company, category_refs)
+        suppliers = ProductMoloniService._resolve_suppliers(company, supplier_refs)
+        
+        # Produtos sem categoria/fornecedor na resposta mantêm as associações atuais
+        existing = {
+            product_id: (category_id, supplier_id)
+            for product_id, category_id, supplier_id in Product.objects.filter(
+                product_id__in=list(rows)
+            ).values_list('product_id', 'category_id', 'supplier_id')
+        }
+        
+        products = []
+        for product_id, (fields, category_ref, supplier_ref) in rows.items():
+            current_category_id, current_supplier_id = existing.get(product_id, (None, None))
+            category = categories.get(category_ref[0]) if category_ref else None
+            supplier = suppliers.get(supplier_ref[0]) if supplier_ref else None
+            
+            products.append(Product(
+                company=company,
+                category_id=category.pk if category else current_category_id,
+                supplier_id=supplier.pk if supplier else current_supplier_id,
+                **fields
+            ))
+        
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=['product_id'],
+            update_fields=['company', 'reference', 'ean', 'name', 'summary', 'type', 'price', 'unit_id',
+                           'has_stock', 'stock', 'category', 'supplier', 'updated_at'],
+        )
+        
+        stats["updated"] = len(existing)
+        stats["added"] = len(products) - len(existing)
+        return stats, list(rows)
+
+    @staticmethod
+    def record_inserted_products(company, inserted_products: List[Dict]) -> int:
+        """
+        Escreve no espelho local os produtos acabados de inserir no Moloni
+        (product_id devolvido por products/insert), sem voltar a descarregar o
+        catálogo. A reconciliação completa fica para o comando
+        reconcile_moloni_products.
+        """
+        products = []
+        for item in inserted_products:
+            product_id = ProductMoloniService.safe_int_conversion(item.get("product_id"))
+            if not product_id:
+                continue
+            products.append(Product(
+                product_id=product_id,
+                company=company,
+                reference=ProductMoloniService.clean_field_data(item.get("reference"), max_length=100, field_name="Reference"),
+                ean=ProductMoloniService.clean_field_data(item.get("ean"), max_length=30, field_name="EAN"),
+                name=ProductMoloniService.clean_field_data(item.get("name"), max_length=255, field_name="Name"),
+                price=ProductMoloniService.safe_decimal_conversion(item.get("price", 0)),
+                unit_id=ProductMoloniService.safe_int_conversion(item.get("unit_id")),
+                has_stock=bool(item.get("has_stock", False)),
+                category=item.get("category"),
+                supplier=item.get("supplier"),
+            ))
+
+        if not products:
+            return 0
+
+        Product.objects.bulk_create(
+            products,
+            update_conflicts=True,
+            unique_fields=['product_id'],
+            update_fields=['company', 'reference', 'ean', 'name', 'price', 'unit_id',
+                           'has_stock', 'category', 'supplier', 'updated_at'],
+        )
+
+        cache.delete('products_count')
+        cache.delete(f'products_count_{company.id}')
+
+        logger.info(f"Espelho local atualizado com {len(products)} produtos inseridos - Empresa: {company.name}")
+        return len(products)
+
     @staticmethod
     def associate_category(product, product_data, company):
         try:
@@ -498,48 +810,130 @@ class ProductMoloniService:
 
 class BackgroundSyncService:
     @staticmethod
-    def start_sync(company, force_delete: bool = False, user_id: Optional[int] = None) -> tuple[bool, str]:
+    def start_sync(company, force_delete: bool = False, user_id: Optional[int] = None,
+                   mode: str = 'full') -> tuple[bool, str]:
+        """
+        mode: 'full' descarrega o catálogo completo, 'delta' só os produtos alterados
+        desde a última sincronização e 'auto' escolhe entre os dois (get_sync_mode).
+        """
         sync_key = f'sync_progress_{company.id}'
+        dedupe_key = BackgroundSyncService.get_job_dedupe_key(company.id)
         
-        current_sync = cache.get(sync_key)
-        if current_sync and current_sync.get('status') in ['started', 'processing']:
+        if SyncProgressStore.get_status(sync_key) in ['started', 'processing']:
+            return False, "Sincronização já em andamento"
+        if JobService.get_active_job(dedupe_key):
             return False, "Sincronização já em andamento"
         
-        progress_data = {
+        if mode == 'auto':
+            mode = BackgroundSyncService.get_sync_mode(company)
+        
+        SyncProgressStore.start(sync_key, {
             'status': 'started',
             'progress': 0,
             'total_categories': 0,
-            'current_category': None,
-            'current_batch': 0,
-            'total_batches': 0,
-            'stats': {
-                'added': 0,
-                'updated': 0,
-                'deleted': 0,
-                'errors': 0,
-                'total_moloni': 0
-            },
             'start_time': timezone.now().isoformat(),
             'user_id': user_id,
             'force_delete': force_delete,
-            'messages': []
-        }
-        
-        cache.set(sync_key, progress_data, timeout=7200)
+            'mode': mode
+        }, stats={
+            'added': 0,
+            'updated': 0,
+            'deleted': 0,
+            'errors': 0,
+            'total_moloni': 0
+        })
         
-        thread = threading.Thread(
-            target=BackgroundSyncService._sync_products_background,
-            args=(company, force_delete, sync_key),
-            daemon=True
+        # Executada pelo worker de jobs (manage.py run_jobs), não pelo processo web
+        JobService.enqueue(
+            'product_moloni.catalog_sync',
+            {'company_id': company.id, 'force_delete': force_delete, 'mode': mode},
+            user_id=user_id,
+            concurrency_key=f"moloni:{company.id}",
+            dedupe_key=dedupe_key
         )
-        thread.start()
         
         return True, "Sincronização iniciada em background"
+
+    @staticmethod
+    def get_sync_mode(company) -> str:
+        """Delta enquanto houver marca de água e a última reconciliação completa for recente"""
+        state = CatalogSyncState.objects.filter(company=company).first()
+        if not state or not state.modified_since or not state.last_full_sync_at:
+            return 'full'
+        
+        full_interval = timedelta(hours=getattr(settings, 'MOLONI_FULL_RECONCILE_HOURS', 24))
+        if timezone.now() - state.last_full_sync_at >= full_interval:
+            return 'full'
+        return 'delta'
+
+    @staticmethod
+    def _sync_products_delta(company, sync_key: str):
+        """
+        Sincronização incremental: só os produtos alterados desde a marca de água.
+        Não remove produtos apagados no Moloni (o getModifiedSince não os devolve):
+        isso fica para a reconciliação completa, a cada MOLONI_FULL_RECONCILE_HOURS.
+        """
+        try:
+            started_at = timezone.now()
+            state = ProductMoloniService.get_sync_state(company)
+            if not state.modified_since:
+                return BackgroundSyncService._sync_products_background(company, False, sync_key)
+            
+            BackgroundSyncService._update_progress(sync_key, {
+                'status': 'processing',
+                'message': 'Obtendo produtos alterados (produtos removidos no Moloni só saem na reconciliação completa)...'
+            })
+            
+            success, products, error = ProductMoloniService.fetch_modified_products(company, state.modified_since)
+            if not success:
+                raise Exception(error or 'Erro ao obter produtos alterados')
+            
+            logger.info(f"Sincronização incremental - Empresa: {company.name}: {len(products)} produtos alterados")
+            BackgroundSyncService._update_stats(sync_key, {'total_moloni': len(products)})
+            
+            batch_size = ProductMoloniService.BULK_UPSERT_BATCH_SIZE
+            errors = 0
+            for start in range(0, len(products), batch_size):
+                if not BackgroundSyncService._should_continue(sync_key):
+                    logger.info("Sincronização cancelada pelo usuário")
+                    return
+                
+                batch_stats = BackgroundSyncService._process_product_batch(
+                    products[start:start + batch_size], company, set()
+                )
+                errors += batch_stats['errors']
+                BackgroundSyncService._update_stats(sync_key, batch_stats)
+                BackgroundSyncService._update_progress(sync_key, {
+                    'progress': int(min(start + batch_size, len(products)) / len(products) * 90)
+                })
+            
+            # Com lotes falhados a marca fica onde estava: a próxima sincronização volta a pedir estes produtos
+            if errors == 0:
+                ProductMoloniService.mark_catalog_synced(company, started_at, full=False)
+            else:
+                logger.warning(f"Sincronização incremental com {errors} erros: marca de sincronização mantida")
+                BackgroundSyncService._add_message(
+                    sync_key, f"{errors} produtos com erros: serão pedidos de novo na próxima sincronização", 'warning'
+                )
+            BackgroundSyncService._finalize_sync(sync_key)
+            
+        except Exception as e:
+            logger.exception(f"Erro na sincronização incremental: {str(e)}")
+            BackgroundSyncService._update_progress(sync_key, {
+                'status': 'error',
+                'message': f'Erro na sincronização: {str(e)}',
+                'progress': 0
+            })
+
+    @staticmethod
+    def get_job_dedupe_key(company_id: int) -> str:
+        return f"product_moloni.catalog_sync:{company_id}"
     
     @staticmethod
     def _sync_products_background(company, force_delete: bool, sync_key: str):
         """Executa a sincronização em background"""
         try:
+            started_at = timezone.now()
             logger.info(f"Iniciando sincronização em background - Empresa: {company.name}")
             
             # Atualizar status
@@ -562,42 +956,68 @@ class BackgroundSyncService:
                 'message': f'Processando {total_categories} categorias...'
             })
             
-            # Processar cada categoria
-            for category_index, category in enumerate(categories):
+            # Processar as categorias em paralelo; todos os workers partilham o limitador da empresa
+            rate_limiter = MoloniRateLimiter.for_company(company.id)
+            workers = min(getattr(settings, 'MOLONI_SYNC_CATEGORY_WORKERS', 4), total_categories)
+            done = [0]
+            failed = [0]
+            done_lock = threading.Lock()
+            
+            def process(category):
+                category_id = category.category_id if hasattr(category, 'category_id') else category['category_id']
+                category_name = category.name if hasattr(category, 'name') else category['name']
+                close_old_connections()
                 try:
-                    category_id = category.category_id if hasattr(category, 'category_id') else category['category_id']
-                    category_name = category.name if hasattr(category, 'name') else category['name']
-                    
                     # Verificar se deve continuar
                     if not BackgroundSyncService._should_continue(sync_key):
-                        logger.info("Sincronização cancelada pelo usuário")
                         return
                     
                     BackgroundSyncService._update_progress(sync_key, {
-                        'current_category': {
-                            'id': category_id,
-                            'name': category_name,
-                            'index': category_index + 1,
-                            'total': total_categories
-                        },
-                        'progress': int((category_index / total_categories) * 90),  # Deixar 10% para cleanup
                         'message': f'Processando categoria: {category_name}'
                     })
                     
-                    # Processar categoria
                     category_stats = BackgroundSyncService._process_category(
-                        company, category_id, category_name, sync_key, moloni_product_ids
+                        company, category_id, category_name, sync_key, moloni_product_ids, rate_limiter
                     )
                     
                     # Atualizar stats globais
                     BackgroundSyncService._update_stats(sync_key, category_stats)
+                    if category_stats['errors']:
+                        with done_lock:
+                            failed[0] += 1
                     
                 except Exception as e:
                     logger.exception(f"Erro ao processar categoria {category_id}: {str(e)}")
                     BackgroundSyncService._add_message(sync_key, f"Erro na categoria {category_id}: {str(e)}", 'error')
+                    with done_lock:
+                        failed[0] += 1
+                finally:
+                    with done_lock:
+                        done[0] += 1
+                        completed = done[0]
+                    BackgroundSyncService._update_progress(sync_key, {
+                        'progress': int((completed / total_categories) * 90)  # Deixar 10% para cleanup
+                    })
+                    close_old_connections()
+            
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='moloni-sync') as executor:
+                list(executor.map(process, categories))
+            
+            if not BackgroundSyncService._should_continue(sync_key):
+                logger.info("Sincronização cancelada pelo usuário")
+                return
+            
+            # Com categorias falhadas a lista de ids está incompleta:
+            # não remover produtos nem avançar a marca de sincronização
+            complete = failed[0] == 0
+            if not complete:
+                logger.warning(f"{failed[0]} categorias com erros: limpeza de obsoletos e marca de sincronização adiadas")
+                BackgroundSyncService._add_message(
+                    sync_key, f"{failed[0]} categorias com erros: produtos obsoletos não foram removidos", 'warning'
+                )
             
             # Cleanup de produtos obsoletos
-            if force_delete:
+            if force_delete and complete:
                 BackgroundSyncService._update_progress(sync_key, {
                     'progress': 90,
                     'message': 'Verificando produtos obsoletos...'
@@ -619,6 +1039,8 @@ class BackgroundSyncService:
                 
                 BackgroundSyncService._update_stats(sync_key, {'deleted': deleted_count})
             
+            if complete:
+                ProductMoloniService.mark_catalog_synced(company, started_at, full=True)
             BackgroundSyncService._finalize_sync(sync_key)
             
         except Exception as e:
@@ -630,7 +1052,8 @@ class BackgroundSyncService:
             })
 
     @staticmethod
-    def _process_category(company, category_id: int, category_name: str, sync_key: str, moloni_product_ids: set) -> Dict[str, int]:
+    def _process_category(company, category_id: int, category_name: str, sync_key: str, moloni_product_ids: set,
+                          rate_limiter=None) -> Dict[str, int]:
         """Processa uma categoria específica"""
         category_stats = {'added': 0, 'updated': 0, 'errors': 0, 'total_moloni': 0}
         
@@ -640,12 +1063,13 @@ class BackgroundSyncService:
             count_data = {"category_id": category_id}
             
             count_success, count_response, count_error = MoloniService._make_authenticated_request_encode(
-                count_url, company, 'POST', count_data
+                count_url, company, 'POST', count_data, rate_limiter=rate_limiter
             )
             
             if not count_success:
                 logger.warning(f"Erro ao obter contagem da categoria {category_id}: {count_error}")
                 BackgroundSyncService._add_message(sync_key, f"Erro ao obter contagem da categoria {category_name}: {count_error}", 'warning')
+                category_stats['errors'] += 1
                 return category_stats
             
             total_products = int(count_response.get("count", 0))
@@ -657,27 +1081,17 @@ class BackgroundSyncService:
             
             logger.info(f"Categoria {category_name}: {total_products} produtos para processar")
             
-            # Processar em lotes
-            batch_size = 20  # Lotes pequenos para evitar timeout
+            # Processar em lotes (máximo permitido pelo getAll)
+            batch_size = ProductMoloniService.GET_ALL_PAGE_SIZE
             total_batches = (total_products + batch_size - 1) // batch_size
             offset = 0
             
-            BackgroundSyncService._update_progress(sync_key, {
-                'total_batches': total_batches,
-                'current_batch': 0
-            })
-            
             for batch_num in range(total_batches):
                 try:
                     # Verificar se deve continuar
                     if not BackgroundSyncService._should_continue(sync_key):
                         break
                     
-                    BackgroundSyncService._update_progress(sync_key, {
-                        'current_batch': batch_num + 1,
-                        'message': f'Categoria {category_name}: lote {batch_num + 1}/{total_batches}'
-                    })
-                    
                     # Buscar produtos do lote
                     params = {
                         "category_id": category_id,
@@ -687,11 +1101,14 @@ class BackgroundSyncService:
                     
                     url = "https://api.moloni.pt/v1/products/getAll/"
                     success, products_data, error = MoloniService._make_authenticated_request_encode(
-                        url, company, 'POST', params
+                        url, company, 'POST', params, rate_limiter=rate_limiter
                     )
                     
-                    if not success or not products_data:
+                    if not success:
                         logger.warning(f"Erro ao buscar lote {batch_num + 1}: {error}")
+                        category_stats['errors'] += 1
+                        break
+                    if not products_data:
                         break
                     
                     # Processar produtos do lote
@@ -705,9 +1122,6 @@ class BackgroundSyncService:
                     
                     offset += len(products_data)
                     
-                    # Pausa entre lotes
-                    time.sleep(0.1)
-                    
                     # Se o lote retornou menos produtos que o esperado, terminar
                     if len(products_data) < batch_size:
                         break
@@ -735,24 +1149,9 @@ class BackgroundSyncService:
         
         try:
             with transaction.atomic():
-                for product_data in products_data:
-                    try:
-                        product, created = ProductMoloniService.create_or_update_product(
-                            product_data, company
-                        )
-                        
-                        if product:
-                            moloni_product_ids.add(product.product_id)
-                            if created:
-                                batch_stats['added'] += 1
-                            else:
-                                batch_stats['updated'] += 1
-                        else:
-                            batch_stats['errors'] += 1
-                            
-                    except Exception as e:
-                        logger.exception(f"Erro ao processar produto {product_data.get('product_id')}: {str(e)}")
-                        batch_stats['errors'] += 1
+                stats, product_ids = ProductMoloniService.bulk_upsert_products(products_data, company)
+            batch_stats.update(stats)
+            moloni_product_ids.update(product_ids)
                         
         except Exception as e:
             logger.exception(f"Erro no lote de produtos: {str(e)}")
@@ -797,10 +1196,7 @@ class BackgroundSyncService:
     def _update_progress(sync_key: str, updates: Dict[str, Any]):
         """Atualiza o progresso da sincronização"""
         try:
-            progress = cache.get(sync_key, {})
-            progress.update(updates)
-            progress['last_update'] = timezone.now().isoformat()
-            cache.set(sync_key, progress, timeout=7200)
+            SyncProgressStore.set_fields(sync_key, dict(updates, last_update=timezone.now().isoformat()))
         except Exception as e:
             logger.exception(f"Erro ao atualizar progresso: {str(e)}")
     
@@ -808,14 +1204,7 @@ class BackgroundSyncService:
     def _update_stats(sync_key: str, new_stats: Dict[str, int]):
         """Atualiza as estatísticas da sincronização"""
         try:
-            progress = cache.get(sync_key, {})
-            current_stats = progress.get('stats', {})
-            
-            for key, value in new_stats.items():
-                current_stats[key] = current_stats.get(key, 0) + value
-            
-            progress['stats'] = current_stats
-            cache.set(sync_key, progress, timeout=7200)
+            SyncProgressStore.incr_stats(sync_key, new_stats)
         except Exception as e:
             logger.exception(f"Erro ao atualizar stats: {str(e)}")
     
@@ -823,21 +1212,11 @@ class BackgroundSyncService:
     def _add_message(sync_key: str, message: str, level: str = 'info'):
         """Adiciona mensagem ao log da sincronização"""
         try:
-            progress = cache.get(sync_key, {})
-            messages = progress.get('messages', [])
-            
-            messages.append({
+            SyncProgressStore.add_message(sync_key, {
                 'timestamp': timezone.now().isoformat(),
                 'message': message,
                 'level': level
             })
-            
-            # Manter apenas as últimas 50 mensagens
-            if len(messages) > 50:
-                messages = messages[-50:]
-            
-            progress['messages'] = messages
-            cache.set(sync_key, progress, timeout=7200)
         except Exception as e:
             logger.exception(f"Erro ao adicionar mensagem: {str(e)}")
     
@@ -845,8 +1224,8 @@ class BackgroundSyncService:
     def _should_continue(sync_key: str) -> bool:
         """Verifica se a sincronização deve continuar"""
         try:
-            progress = cache.get(sync_key)
-            return progress and progress.get('status') not in ['cancelled', 'error']
+            status = SyncProgressStore.get_status(sync_key)
+            return status is not None and status not in ['cancelled', 'error']
         except Exception:
             return False
     
@@ -854,8 +1233,7 @@ class BackgroundSyncService:
     def _finalize_sync(sync_key: str):
         """Finaliza a sincronização"""
         try:
-            progress = cache.get(sync_key, {})
-            stats = progress.get('stats', {})
+            stats = (SyncProgressStore.get(sync_key) or {}).get('stats', {})
             
             # Limpar cache de contagem
             cache.delete('products_count')
@@ -863,15 +1241,13 @@ class BackgroundSyncService:
             # Fechar conexões do banco para liberar recursos
             connection.close()
             
-            # Atualizar status final
-            progress.update({
+            # Atualizar status final (manter por 5 minutos)
+            SyncProgressStore.set_fields(sync_key, {
                 'status': 'completed',
                 'progress': 100,
                 'message': f"Sincronização concluída: {stats.get('added', 0)} adicionados, {stats.get('updated', 0)} atualizados, {stats.get('deleted', 0)} removidos",
                 'end_time': timezone.now().isoformat()
-            })
-            
-            cache.set(sync_key, progress, timeout=300)  # Manter por 5 minutos
+            }, timeout=SyncProgressStore.FINISHED_TIMEOUT)
             
             logger.info(f"Sincronização finalizada: {stats}")
             
@@ -882,18 +1258,22 @@ class BackgroundSyncService:
     def get_sync_progress(company_id: int) -> Optional[Dict[str, Any]]:
         """Obtém o progresso atual da sincronização"""
         sync_key = f'sync_progress_{company_id}'
-        return cache.get(sync_key)
+        return SyncProgressStore.get(sync_key)
     
     @staticmethod
     def cancel_sync(company_id: int) -> bool:
         """Cancela a sincronização em andamento"""
         sync_key = f'sync_progress_{company_id}'
-        progress = cache.get(sync_key)
         
-        if progress and progress.get('status') in ['started', 'processing']:
-            progress['status'] = 'cancelled'
-            progress['message'] = 'Sincronização cancelada pelo usuário'
-            cache.set(sync_key, progress, timeout=300)
+        if SyncProgressStore.get_status(sync_key) in ['started', 'processing']:
+            SyncProgressStore.set_fields(sync_key, {
+                'status': 'cancelled',
+                'message': 'Sincronização cancelada pelo usuário'
+            }, timeout=SyncProgressStore.FINISHED_TIMEOUT)
+
+            active_job = JobService.get_active_job(BackgroundSyncService.get_job_dedupe_key(company_id))
+            if active_job:
+                JobService.cancel(active_job.id)
             return True
         
         return False
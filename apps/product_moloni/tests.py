@@ -1,3 +1,134 @@
-from django.test import TestCase
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.moloni.models import Moloni
+from apps.sechic.models import Category
+
+from .jobs import run_catalog_sync
+from .models import CatalogSyncState, Product
+from .progress import SyncProgressStore
+from .services import BackgroundSyncService, ProductMoloniService
+
+
+class FullCatalogSyncTests(TestCase):
+    """Uma categoria falhada não pode remover produtos nem avançar a marca de sincronização"""
+
+    def setUp(self):
+        self.company = Moloni.objects.create(company_id=1234, name='Empresa')
+        for category_id in (1, 2):
+            Category.objects.create(category_id=category_id, name=f'Categoria {category_id}', company=self.company)
+        for product_id in (10, 20, 30):
+            Product.objects.create(product_id=product_id, name=f'Produto {product_id}', company=self.company)
+
+        # Os produtos vêm já completos do getAll: sem pedidos de detalhe
+        details = mock.patch.object(
+            ProductMoloniService, '_fetch_product_details', side_effect=lambda company, products: products
+        )
+        details.start()
+        self.addCleanup(details.stop)
+
+    def _listing(self, failing_category=None):
+        catalog = {
+            1: [{'product_id': 10, 'reference': 'REF.10', 'name': 'Produto 10', 'price': 10}],
+            2: [{'product_id': 20, 'reference': 'REF.20', 'name': 'Produto 20', 'price': 20}],
+        }
+
+        def get_category_products_list(company, category_id):
+            if category_id == failing_category:
+                raise Exception(f"Erro ao obter contagem da categoria {category_id}: timeout")
+            return catalog[category_id]
+
+        return mock.patch.object(
+            ProductMoloniService, '_get_category_products_list', side_effect=get_category_products_list
+        )
+
+    def test_complete_sync_removes_obsolete_products_and_advances_mark(self):
+        with self._listing():
+            success, message, stats = ProductMoloniService.fetch_and_store_products(self.company, force_delete=True)
+
+        self.assertTrue(success, message)
+        self.assertEqual(stats['deleted'], 1)
+        self.assertEqual(set(Product.objects.values_list('product_id', flat=True)), {10, 20})
+        state = CatalogSyncState.objects.get(company=self.company)
+        self.assertIsNotNone(state.modified_since)
+        self.assertIsNotNone(state.last_full_sync_at)
+
+    def test_failed_category_keeps_products_and_mark(self):
+        with self._listing(failing_category=2), self.assertLogs('apps.product_moloni.services', 'WARNING'):
+            success, message, stats = ProductMoloniService.fetch_and_store_products(self.company, force_delete=True)
+
+        self.assertTrue(success, message)
+        self.assertEqual(stats['errors'], 1)
+        self.assertEqual(stats['deleted'], 0)
+        self.assertEqual(set(Product.objects.values_list('product_id', flat=True)), {10, 20, 30})
+        self.assertFalse(CatalogSyncState.objects.filter(company=self.company).exists())
+
+    def test_all_categories_failing_is_not_an_empty_catalog(self):
+        Category.objects.filter(category_id=2).delete()
+
+        with self._listing(failing_category=1), self.assertLogs('apps.product_moloni.services', 'WARNING'):
+            success, message, stats = ProductMoloniService.fetch_and_store_products(self.company, force_delete=True)
+
+        self.assertTrue(success, message)
+        self.assertEqual(Product.objects.count(), 3)
+        self.assertFalse(CatalogSyncState.objects.filter(company=self.company).exists())
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class DeltaCatalogSyncTests(TestCase):
+    """Um lote falhado na sincronização incremental não pode avançar a marca de água"""
+
+    def setUp(self):
+        cache.clear()
+        self.company = Moloni.objects.create(company_id=1234, name='Empresa')
+        self.modified_since = timezone.now() - timedelta(hours=1)
+        CatalogSyncState.objects.create(
+            company=self.company, modified_since=self.modified_since, last_full_sync_at=timezone.now()
+        )
+        self.sync_key = f'sync_progress_{self.company.id}'
+        SyncProgressStore.start(self.sync_key, {'status': 'started', 'mode': 'delta'}, stats={'errors': 0})
+
+        modified = mock.patch.object(ProductMoloniService, 'fetch_modified_products', return_value=(
+            True, [{'product_id': 10, 'reference': 'REF.10', 'name': 'Produto 10', 'price': 10}], None
+        ))
+        modified.start()
+        self.addCleanup(modified.stop)
+
+    def test_successful_delta_advances_mark(self):
+        BackgroundSyncService._sync_products_delta(self.company, self.sync_key)
+
+        state = CatalogSyncState.objects.get(company=self.company)
+        self.assertGreater(state.modified_since, self.modified_since)
+        self.assertEqual(SyncProgressStore.get_status(self.sync_key), 'completed')
+
+    def test_failed_batch_keeps_mark(self):
+        with mock.patch.object(ProductMoloniService, 'bulk_upsert_products', side_effect=Exception('deadlock')), \
+                self.assertLogs('apps.product_moloni.services', 'WARNING'):
+            BackgroundSyncService._sync_products_delta(self.company, self.sync_key)
+
+        state = CatalogSyncState.objects.get(company=self.company)
+        self.assertEqual(state.modified_since, self.modified_since)
+        self.assertEqual(SyncProgressStore.get(self.sync_key)['stats']['errors'], 1)
+
+    def _job(self, attempts=1):
+        return mock.Mock(payload={'company_id': self.company.id, 'mode': 'delta'}, attempts=attempts, max_attempts=2)
+
+    def test_failed_sync_fails_the_job(self):
+        with mock.patch.object(ProductMoloniService, 'fetch_modified_products', return_value=(False, [], 'timeout')), \
+                self.assertLogs('apps.product_moloni.services', 'ERROR'), \
+                self.assertRaisesMessage(Exception, 'timeout'):
+            run_catalog_sync(self._job(), mock.Mock())
+
+        self.assertEqual(SyncProgressStore.get_status(self.sync_key), 'error')
+
+    def test_retry_runs_again_after_error(self):
+        SyncProgressStore.set_fields(self.sync_key, {'status': 'error', 'message': 'Erro na sincronização: timeout'})
+
+        result = run_catalog_sync(self._job(attempts=2), mock.Mock())
+
+        self.assertEqual(result['status'], 'completed')
+        self.assertTrue(Product.objects.filter(company=self.company, product_id=10).exists())
@@ -13,6 +13,7 @@ urlpatterns = [
     # APIs para processamento em background
     path('api/start-background-sync/', views.start_background_sync, name='api_start_background_sync'),
     path('api/sync-progress/', views.get_sync_progress, name='api_sync_progress'),
+    path('api/sync-progress/stream/', views.stream_sync_progress, name='api_sync_progress_stream'),
     path('api/cancel-background-sync/', views.cancel_background_sync, name='api_cancel_background_sync'),
     
     # NOVA API para verificação de sync automático
@@ -16,6 +16,7 @@ from django.views.decorators.http import require_http_methods
 from .models import Product, ProductVariant
 from .services import ProductMoloniService, BackgroundSyncService
 from apps.moloni.models import Moloni
+from apps.jobs.streams import ProgressStream
 
 logger = logging.getLogger(__name__)
 
@@ -52,8 +53,7 @@ class ProductMoloniView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = TemplateLayout.init(self, super().get_context_data(**kwargs))
         
-        user_profile = self.request.user.profile
-        selected_company = user_profile.selected_moloni_company
+        selected_company = self.request.tenant.moloni_company
         
         if not selected_company:
             messages.error(self.request, "Você não tem uma empresa Moloni selecionada no seu perfil.")
@@ -82,7 +82,7 @@ class ProductMoloniView(LoginRequiredMixin, TemplateView):
             return redirect('/dashboard/') 
         
         if context.get('auto_sync', False):
-            selected_company = request.user.profile.selected_moloni_company
+            selected_company = request.tenant.moloni_company
             self.start_auto_background_sync(selected_company, request.user.id)
         
         return self.render_to_response(context)
@@ -136,7 +136,8 @@ class ProductMoloniView(LoginRequiredMixin, TemplateView):
             success, message = BackgroundSyncService.start_sync(
                 company, 
                 force_delete=True,
-                user_id=user_id
+                user_id=user_id,
+                mode='auto'
             )
             
             if success:
@@ -152,7 +153,7 @@ class ProductMoloniView(LoginRequiredMixin, TemplateView):
 @login_required
 def quick_sync_status(request):
     try:
-        selected_company = request.user.profile.selected_moloni_company
+        selected_company = request.tenant.moloni_company
         
         if not selected_company:
             return JsonResponse({
@@ -182,7 +183,7 @@ def quick_sync_status(request):
 @login_required
 def get_products(request):
     try:
-        selected_company = request.user.profile.selected_moloni_company
+        selected_company = request.tenant.moloni_company
         
         if not selected_company:
             return JsonResponse({
@@ -258,7 +259,7 @@ def get_products(request):
 @login_required
 def get_product_details(request, product_id):
     try:
-        selected_company = request.user.profile.selected_moloni_company
+        selected_company = request.tenant.moloni_company
         
         if not selected_company:
             return JsonResponse({
@@ -319,7 +320,7 @@ def get_product_details(request, product_id):
 @require_http_methods(["POST"])
 def start_background_sync(request):
     try:
-        selected_company = request.user.profile.selected_moloni_company
+        selected_company = request.tenant.moloni_company
         
         if not selected_company:
             return JsonResponse({
@@ -352,7 +353,7 @@ def start_background_sync(request):
 def get_sync_progress(request):
     """Retorna o progresso da sincronização em background"""
     try:
-        selected_company = request.user.profile.selected_moloni_company
+        selected_company = request.tenant.moloni_company
         
         if not selected_company:
             return JsonResponse({
@@ -381,12 +382,35 @@ def get_sync_progress(request):
             'message': f'Erro ao obter progresso: {str(e)}'
         })
 
+@login_required
+@require_http_methods(["GET"])
+def stream_sync_progress(request):
+    """Progresso da sincronização em background por server-sent events, em vez de polling"""
+    selected_company = request.tenant.moloni_company
+    
+    if not selected_company:
+        return JsonResponse({
+            'success': False, 
+            'message': 'Empresa não selecionada'
+        })
+    
+    company_id = selected_company.id
+    
+    def is_finished(progress):
+        return not progress or progress.get('status') not in ['started', 'processing']
+    
+    return ProgressStream.response(
+        f'sync_progress_{company_id}',
+        lambda: BackgroundSyncService.get_sync_progress(company_id),
+        is_finished
+    )
+
 @login_required
 @require_http_methods(["POST"])
 def cancel_background_sync(request):
     """Cancela a sincronização em background"""
     try:
-        selected_company = request.user.profile.selected_moloni_company
+        selected_company = request.tenant.moloni_company
         
         if not selected_company:
             return JsonResponse({
@@ -412,7 +436,7 @@ def cancel_background_sync(request):
 def sync_status_page(request):
     """Página para acompanhar o status da sincronização"""
     try:
-        selected_company = request.user.profile.selected_moloni_company
+        selected_company = request.tenant.moloni_company
         
         if not selected_company:
             messages.error(request, "Você não tem uma empresa Moloni selecionada no seu perfil.")
@@ -437,7 +461,7 @@ def sync_status_page(request):
 def sync_products(request):
     """Sincronização de produtos - agora com opção background"""
     try:
-        selected_company = request.user.profile.selected_moloni_company
+        selected_company = request.tenant.moloni_company
         
         if not selected_company:
             return JsonResponse({
@@ -491,7 +515,7 @@ def sync_products(request):
 def check_auto_sync_status(request):
     """Verifica se deve iniciar sync automático (para chamadas AJAX)"""
     try:
-        selected_company = request.user.profile.selected_moloni_company
+        selected_company = request.tenant.moloni_company
         
         if not selected_company:
             return JsonResponse({
@@ -536,7 +560,8 @@ def check_auto_sync_status(request):
             success, message = BackgroundSyncService.start_sync(
                 selected_company,
                 force_delete=True,
-                user_id=request.user.id
+                user_id=request.user.id,
+                mode='auto'
             )
             
             if success:
@@ -0,0 +1,282 @@
+# apps/product_shopify/bulk.py
+import json
+import logging
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+import requests
+from django.conf import settings
+
+from apps.shopify.client import ShopifyClient
+from apps.shopify.graphql import ShopifyGraphQLClient, ShopifyGraphQLError
+
+logger = logging.getLogger(__name__)
+
+
+class ShopifyBulkExportService:
+    """
+    Exportação do catálogo completo por bulk operation da Admin GraphQL API:
+    lança a query, espera que o Shopify gere o ficheiro JSONL e lê-o linha a
+    linha, entregando lotes no mesmo formato da REST API (ver
+    ShopifyService.bulk_upsert_products). Cada linha filha (variante/imagem)
+    vem a seguir ao produto com `__parentId`.
+    """
+    BATCH_SIZE = 250
+
+    PRODUCTS_QUERY = """
+    {
+      products {
+        edges {
+          node {
+            id
+            title
+            handle
+            descriptionHtml
+            vendor
+            productType
+            status
+            publishedAt
+            updatedAt
+            tags
+            variants {
+              edges {
+                node {
+                  id
+                  title
+                  price
+                  compareAtPrice
+                  sku
+                  barcode
+                  position
+                  inventoryQuantity
+                  inventoryItem { id }
+                  selectedOptions { name value }
+                }
+              }
+            }
+            images {
+              edges {
+                node {
+                  id
+                  url
+                  altText
+                  width
+                  height
+                }
+              }
+            }
+          }
+        }
+      }
+    }
+    """
+
+    RUN_MUTATION = """
+    mutation bulkOperationRunQuery($query: String!) {
+      bulkOperationRunQuery(query: $query) {
+        bulkOperation { id status }
+        userErrors { field message }
+      }
+    }
+    """
+
+    STATUS_QUERY = """
+    query bulkOperationStatus($id: ID!) {
+      node(id: $id) {
+        ... on BulkOperation {
+          id
+          status
+          errorCode
+          objectCount
+          url
+          partialDataUrl
+        }
+      }
+    }
+    """
+
+    FINISHED_STATUSES = ('COMPLETED', 'FAILED', 'CANCELED', 'EXPIRED')
+
+    @staticmethod
+    def legacy_id(gid: Optional[str]) -> Optional[int]:
+        """gid://shopify/Product/123 -> 123"""
+        if not gid:
+            return None
+        try:
+            return int(str(gid).rsplit('/', 1)[-1])
+        except ValueError:
+            return None
+
+    @staticmethod
+    def start(client: ShopifyGraphQLClient) -> str:
+        data = client.execute(
+            ShopifyBulkExportService.RUN_MUTATION,
+            {'query': ShopifyBulkExportService.PRODUCTS_QUERY}
+        )
+        result = data.get('bulkOperationRunQuery') or {}
+        user_errors = result.get('userErrors') or []
+        if user_errors or not result.get('bulkOperation'):
+            raise ShopifyGraphQLError(f"Não foi possível iniciar a bulk operation: {user_errors}", user_errors)
+
+        operation_id = result['bulkOperation']['id']
+        logger.info(f"Bulk operation {operation_id} iniciada")
+        return operation_id
+
+    @staticmethod
+    def wait(client: ShopifyGraphQLClient, operation_id: str) -> Optional[str]:
+        """Espera pelo fim da operação e devolve o URL do ficheiro JSONL (None se o catálogo estiver vazio)"""
+        poll_interval = getattr(settings, 'SHOPIFY_BULK_POLL_INTERVAL', 5)
+        deadline = time.monotonic() + getattr(settings, 'SHOPIFY_BULK_TIMEOUT', 3600)
+
+        while True:
+            operation = client.execute(
+                ShopifyBulkExportService.STATUS_QUERY, {'id': operation_id}, estimated_cost=1
+            ).get('node') or {}
+            status = operation.get('status')
+
+            if status in ShopifyBulkExportService.FINISHED_STATUSES:
+                if status != 'COMPLETED':
+                    raise ShopifyGraphQLError(
+                        f"Bulk operation {operation_id} terminou com {status} ({operation.get('errorCode')})"
+                    )
+                logger.info(f"Bulk operation {operation_id} concluída: {operation.get('objectCount')} objetos")
+                return operation.get('url')
+
+            if time.monotonic() >= deadline:
+                raise ShopifyGraphQLError(f"Bulk operation {operation_id} excedeu o tempo máximo de espera")
+
+            logger.debug(f"Bulk operation {operation_id}: {status}, objetos {operation.get('objectCount')}")
+            time.sleep(poll_interval)
+
+    @staticmethod
+    def iter_lines(url: str) -> Iterator[Dict[str, Any]]:
+        """Lê o ficheiro JSONL em streaming, sem o carregar inteiro em memória"""
+        timeout = getattr(settings, 'SHOPIFY_REQUEST_TIMEOUT', 60)
+        with requests.get(url, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                if line:
+                    yield json.loads(line)
+
+    @staticmethod
+    def to_product_data(node: Dict[str, Any]) -> Dict[str, Any]:
+        tags = node.get('tags') or []
+        return {
+            "id": ShopifyBulkExportService.legacy_id(node.get('id')),
+            "title": node.get('title'),
+            "handle": node.get('handle'),
+            "body_html": node.get('descriptionHtml'),
+            "vendor": node.get('vendor'),
+            "product_type": node.get('productType'),
+            "status": (node.get('status') or 'ACTIVE').lower(),
+            "published_at": node.get('publishedAt'),
+            "updated_at": node.get('updatedAt'),
+            "tags": ", ".join(tags) if isinstance(tags, list) else tags,
+            "variants": [],
+            "images": [],
+        }
+
+    @staticmethod
+    def to_variant_data(node: Dict[str, Any]) -> Dict[str, Any]:
+        options = [option.get('value') for option in node.get('selectedOptions') or []]
+        options += [None] * (3 - len(options))
+        return {
+            "id": ShopifyBulkExportService.legacy_id(node.get('id')),
+            "title": node.get('title'),
+            "price": node.get('price'),
+            "compare_at_price": node.get('compareAtPrice'),
+            "sku": node.get('sku'),
+            "barcode": node.get('barcode'),
+            "position": node.get('position'),
+            "inventory_quantity": node.get('inventoryQuantity'),
+            "inventory_item_id": ShopifyBulkExportService.legacy_id((node.get('inventoryItem') or {}).get('id')),
+            "option1": options[0],
+            "option2": options[1],
+            "option3": options[2],
+        }
+
+    @staticmethod
+    def to_image_data(node: Dict[str, Any], position: int) -> Dict[str, Any]:
+        return {
+            "id": ShopifyBulkExportService.legacy_id(node.get('id')),
+            "src": node.get('url'),
+            "alt": node.get('altText'),
+            "width": node.get('width'),
+            "height": node.get('height'),
+            "position": position,
+        }
+
+    @staticmethod
+    def iter_product_pages(shop_domain: str, access_token: str) -> Iterator[List[Dict[str, Any]]]:
+        """
+        Lotes de até BATCH_SIZE produtos (com variantes e imagens) lidos do
+        ficheiro da bulk operation. Um lote só é entregue quando chega o
+        produto seguinte, para que os filhos do último produto já estejam lá.
+
+        O Shopify garante apenas que cada filho vem depois do pai, não que vem
+        logo a seguir: filhos de um produto já entregue são guardados e, no fim
+        do ficheiro, entregues em lotes com `children_only` (ver
+        ShopifyService.bulk_upsert_products).
+        """
+        client = ShopifyClient.for_store(shop_domain, access_token).graphql
+        url = ShopifyBulkExportService.wait(client, ShopifyBulkExportService.start(client))
+        if not url:
+            return
+
+        yield from ShopifyBulkExportService.group_lines(ShopifyBulkExportService.iter_lines(url))
+
+    @staticmethod
+    def group_lines(lines) -> Iterator[List[Dict[str, Any]]]:
+        """Agrupa as linhas JSONL (pai seguido dos filhos com __parentId) em lotes de produtos"""
+        batch = {}
+        # Imagens e updatedAt por produto já entregue (para os filhos que chegam tarde)
+        image_counts = {}
+        updated_ats = {}
+        late_children = {}
+        orphans = 0
+
+        def add_child(product, node, image_offset=0):
+            if '/ProductVariant/' in node.get('id', ''):
+                product["variants"].append(ShopifyBulkExportService.to_variant_data(node))
+            else:
+                position = image_offset + len(product["images"]) + 1
+                product["images"].append(ShopifyBulkExportService.to_image_data(node, position))
+
+        for node in lines:
+            parent_id = node.get('__parentId')
+
+            if parent_id is None:
+                if len(batch) >= ShopifyBulkExportService.BATCH_SIZE:
+                    image_counts.update((gid, len(product["images"])) for gid, product in batch.items())
+                    updated_ats.update((gid, product["updated_at"]) for gid, product in batch.items())
+                    yield list(batch.values())
+                    batch = {}
+                batch[node.get('id')] = ShopifyBulkExportService.to_product_data(node)
+                continue
+
+            product = batch.get(parent_id)
+            if product is not None:
+                add_child(product, node)
+            elif parent_id in image_counts:
+                late = late_children.setdefault(parent_id, {
+                    "id": ShopifyBulkExportService.legacy_id(parent_id),
+                    "children_only": True,
+                    "updated_at": updated_ats.get(parent_id),
+                    "variants": [],
+                    "images": [],
+                })
+                add_child(late, node, image_counts[parent_id])
+            else:
+                orphans += 1
+
+        if batch:
+            yield list(batch.values())
+
+        if late_children:
+            logger.info(f"{len(late_children)} produtos com variantes/imagens fora do lote do produto")
+            late = list(late_children.values())
+            for start in range(0, len(late), ShopifyBulkExportService.BATCH_SIZE):
+                yield late[start:start + ShopifyBulkExportService.BATCH_SIZE]
+
+        if orphans:
+            logger.warning(f"{orphans} linhas da bulk operation ignoradas (produto inexistente no ficheiro)")
@@ -0,0 +1,28 @@
+# apps/product_shopify/jobs.py
+from apps.jobs.registry import register
+from apps.shopify.models import Shopify
+
+from .services import ShopifyCatalogRefreshService, ShopifyService
+from .webhooks import ShopifyWebhookService
+
+
+@register('product_shopify.webhook', max_attempts=5, lease_seconds=60)
+def run_webhook(job, context):
+    store = Shopify.objects.filter(pk=job.payload['store_id'], is_active=True).first()
+    if store is None:
+        return {'ignored': True, 'reason': 'Loja inativa ou removida'}
+    return ShopifyWebhookService.apply(store, job.payload['topic'], job.payload.get('data') or {})
+
+
+@register('product_shopify.catalog_sync', max_attempts=2, lease_seconds=600)
+def run_catalog_sync(job, context):
+    store = Shopify.objects.get(pk=job.payload['store_id'])
+    success, message, count = ShopifyService.fetch_and_store_products(
+        ShopifyCatalogRefreshService.get_shop_name(store),
+        store.access_token,
+        store_obj=store,
+        mode=job.payload.get('mode', 'auto')
+    )
+    if not success:
+        raise Exception(message)
+    return {'message': message, 'count': count}
@@ -0,0 +1,37 @@
+# apps/product_shopify/management/commands/register_shopify_webhooks.py
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.shopify.models import Shopify
+from apps.product_shopify.webhooks import ShopifyWebhookService
+
+
+class Command(BaseCommand):
+    help = (
+        "Subscreve os webhooks products/create|update|delete e inventory_levels/update "
+        "das lojas Shopify ativas, para que o espelho local seja atualizado sem sincronizações completas."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--address', required=True,
+                            help='URL público do endpoint (ex.: https://exemplo.pt/product-shopify/webhooks/)')
+        parser.add_argument('--store', action='append', dest='stores',
+                            help='Domínio da loja (pode repetir); por omissão todas as lojas ativas')
+
+    def handle(self, *args, **options):
+        if not options['address'].startswith('https://'):
+            raise CommandError("O Shopify só entrega webhooks para endereços https://")
+
+        stores = Shopify.objects.filter(is_active=True)
+        if options['stores']:
+            stores = stores.filter(shop_domain__in=options['stores'])
+
+        for store in stores:
+            try:
+                created, errors = ShopifyWebhookService.register(store, options['address'])
+            except Exception as e:
+                self.stderr.write(self.style.ERROR(f"{store.shop_domain}: {str(e)}"))
+                continue
+
+            self.stdout.write(self.style.SUCCESS(f"{store.shop_domain}: {created} subscrições criadas"))
+            for error in errors:
+                self.stderr.write(self.style.WARNING(f"{store.shop_domain}: {error['topic']} - {error['errors']}"))
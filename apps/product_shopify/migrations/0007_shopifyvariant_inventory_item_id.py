@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:53
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_shopify', '0006_alter_shopifyproduct_store'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopifyvariant',
+            name='inventory_item_id',
+            field=models.BigIntegerField(blank=True, db_index=True, null=True),
+        ),
+    ]
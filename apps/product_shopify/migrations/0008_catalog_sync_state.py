@@ -0,0 +1,29 @@
+# Generated by Django 5.0.6 on 2026-10-18 03:55
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_shopify', '0007_shopifyvariant_inventory_item_id'),
+        ('shopify', '0004_shopify_users'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopifyCatalogSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_synced_at', models.DateTimeField(blank=True, null=True)),
+                ('last_sync_mode', models.CharField(blank=True, default='', max_length=10)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('store', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='catalog_sync_state', to='shopify.shopify')),
+            ],
+            options={
+                'verbose_name': 'Shopify Catalog Sync State',
+                'verbose_name_plural': 'Shopify Catalog Sync States',
+            },
+        ),
+    ]
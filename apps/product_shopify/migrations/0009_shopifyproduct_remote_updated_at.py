@@ -0,0 +1,18 @@
+# Generated by Django 5.0.6 on 2026-10-18 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_shopify', '0008_catalog_sync_state'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopifyproduct',
+            name='remote_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.0.6 on 2026-10-18 04:32
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('product_shopify', '0009_shopifyproduct_remote_updated_at'),
+        ('shopify', '0004_shopify_users'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopifyDeletedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('shopify_id', models.BigIntegerField()),
+                ('deleted_at', models.DateTimeField()),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='deleted_products', to='shopify.shopify')),
+            ],
+            options={
+                'verbose_name': 'Shopify Deleted Product',
+                'verbose_name_plural': 'Shopify Deleted Products',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shopifydeletedproduct',
+            constraint=models.UniqueConstraint(fields=('store', 'shopify_id'), name='unique_shopify_deleted_product'),
+        ),
+    ]
@@ -14,6 +14,8 @@ class ShopifyProduct(models.Model):
     status = models.CharField(max_length=50, default='active')
     published_at = models.DateTimeField(blank=True, null=True)
     tags = models.TextField(blank=True, null=True)
+    # updated_at do produto no Shopify: webhooks com data anterior são ignorados
+    remote_updated_at = models.DateTimeField(blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     store = models.ForeignKey('shopify.Shopify', on_delete=models.CASCADE, related_name='products')
@@ -40,6 +42,7 @@ class ShopifyVariant(models.Model):
     option2 = models.CharField(max_length=255, blank=True, null=True)
     option3 = models.CharField(max_length=255, blank=True, null=True)
     inventory_quantity = models.IntegerField(default=0)
+    inventory_item_id = models.BigIntegerField(null=True, blank=True, db_index=True)
     
     def __str__(self):
         return f"{self.product.title} - {self.title}"
@@ -66,4 +69,38 @@ class ShopifyImage(models.Model):
     class Meta:
         verbose_name = "Shopify Image"
         verbose_name_plural = "Shopify Images"
-        ordering = ['product', 'position']
\ No newline at end of file
+        ordering = ['product', 'position']
+class ShopifyCatalogSyncState(models.Model):
+    """Última sincronização completa do espelho local de uma loja Shopify"""
+    store = models.OneToOneField('shopify.Shopify', on_delete=models.CASCADE, related_name='catalog_sync_state')
+    last_synced_at = models.DateTimeField(null=True, blank=True)
+    last_sync_mode = models.CharField(max_length=10, blank=True, default='')
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"{self.store} ({self.last_synced_at})"
+    
+    class Meta:
+        verbose_name = "Shopify Catalog Sync State"
+        verbose_name_plural = "Shopify Catalog Sync States"
+
+
+class ShopifyDeletedProduct(models.Model):
+    """
+    Produtos apagados no Shopify (webhook products/delete). Um products/update
+    entregue atrasado ou uma página de sincronização lida antes da remoção
+    não voltam a criar o produto.
+    """
+    store = models.ForeignKey('shopify.Shopify', on_delete=models.CASCADE, related_name='deleted_products')
+    shopify_id = models.BigIntegerField()
+    deleted_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.shopify_id} ({self.deleted_at})"
+
+    class Meta:
+        verbose_name = "Shopify Deleted Product"
+        verbose_name_plural = "Shopify Deleted Products"
+        constraints = [
+            models.UniqueConstraint(fields=['store', 'shopify_id'], name='unique_shopify_deleted_product'),
+        ]
@@ -1,20 +1,28 @@
 # apps/product_shopify/services.py
 import logging
-import requests
 import json
 import time
-import re
-from typing import Dict, List, Any, Tuple, Optional
+from datetime import timedelta
+from typing import Dict, Iterator, List, Any, Tuple, Optional
 from django.conf import settings
 from django.core.cache import cache
-from django.db.models import Q
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
-from apps.product_shopify.models import ShopifyProduct, ShopifyVariant, ShopifyImage
+from apps.product_shopify.models import (
+    ShopifyProduct, ShopifyVariant, ShopifyImage, ShopifyCatalogSyncState, ShopifyDeletedProduct
+)
+from apps.product_shopify.bulk import ShopifyBulkExportService
+from apps.shopify.client import ShopifyClient
 from apps.shopify.models import Shopify
+from apps.jobs.services import JobService
 
 logger = logging.getLogger(__name__)
 
 class ShopifyService:
+    PRODUCT_FIELDS = "id,title,handle,body_html,vendor,product_type,status,published_at,updated_at,tags,variants,images"
+
     @staticmethod
     def get_shop_url(shop_name: str) -> str:
         """
@@ -23,38 +31,270 @@ class ShopifyService:
         return f"https://{shop_name}.myshopify.com"
     
     @staticmethod
-    def get_api_url(shop_name: str, version: str = "2023-10") -> str:
+    def get_client(shop_name: str, access_token: str) -> ShopifyClient:
         """
-        Retorna a URL base da API do Shopify
+        Retorna o cliente partilhado da loja (sessão keep-alive, limite de
+        pedidos e versão da API em SHOPIFY_API_VERSION)
         """
-        return f"https://{shop_name}.myshopify.com/admin/api/{version}"
+        return ShopifyClient.for_store(shop_name, access_token)
     
     @staticmethod
-    def get_headers(access_token: str) -> Dict[str, str]:
+    def iter_product_pages(
+        shop_name: str,
+        access_token: str,
+        limit: int = 250
+    ) -> Iterator[List[Dict[str, Any]]]:
         """
-        Retorna os cabeçalhos para a API do Shopify
+        Percorre o catálogo página a página (cursor do cabeçalho Link) sem
+        recursão: cada página é entregue ao chamador e descartada antes de
+        pedir a seguinte. Limites de pedidos e novas tentativas ficam a cargo
+        do ShopifyClient; erros HTTP levantam exceção.
         """
+        client = ShopifyService.get_client(shop_name, access_token)
+        url = f"products.json?limit={limit}&fields={ShopifyService.PRODUCT_FIELDS}"
+        page_index = 0
+
+        while url:
+            page_index += 1
+            logger.info(f"Buscando página {page_index} de produtos: {client.get_url(url)}")
+
+            response = client.get(url)
+            if response.status_code != 200:
+                raise Exception(f"Erro ao buscar produtos: HTTP {response.status_code} - {response.text}")
+
+            yield response.json().get("products", [])
+
+            # requests já interpreta o cabeçalho Link (rel="next")
+            url = response.links.get("next", {}).get("url")
+
+    @staticmethod
+    def build_product_fields(product_data: Dict[str, Any]) -> Dict[str, Any]:
         return {
-            "Content-Type": "application/json",
-            "X-Shopify-Access-Token": access_token
+            "title": product_data.get("title") or "",
+            "handle": product_data.get("handle", ""),
+            "body_html": product_data.get("body_html", ""),
+            "vendor": product_data.get("vendor", ""),
+            "product_type": product_data.get("product_type", ""),
+            "status": product_data.get("status") or "active",
+            "published_at": product_data.get("published_at"),
+            "tags": product_data.get("tags", ""),
+            "remote_updated_at": parse_datetime(product_data.get("updated_at") or ""),
         }
-    
+
+    @staticmethod
+    def build_variant_fields(variant_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "title": variant_data.get("title") or "",
+            "price": variant_data.get("price") or 0,
+            "sku": variant_data.get("sku", ""),
+            "barcode": variant_data.get("barcode", ""),
+            "compare_at_price": variant_data.get("compare_at_price"),
+            "position": variant_data.get("position") or 1,
+            "option1": variant_data.get("option1", ""),
+            "option2": variant_data.get("option2", ""),
+            "option3": variant_data.get("option3", ""),
+            "inventory_quantity": variant_data.get("inventory_quantity") or 0,
+            "inventory_item_id": variant_data.get("inventory_item_id"),
+        }
+
+    @staticmethod
+    def build_image_fields(image_data: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            "position": image_data.get("position") or 1,
+            "src": image_data.get("src", ""),
+            "alt": image_data.get("alt", ""),
+            "width": image_data.get("width"),
+            "height": image_data.get("height"),
+        }
+
+    @staticmethod
+    def find_stale_products(store, products: Dict[int, ShopifyProduct]) -> set:
+        """
+        Ids dos produtos cuja versão recebida não é mais recente do que a já
+        gravada (remote_updated_at) ou do que a sua remoção no Shopify. Deve ser
+        chamado dentro de uma transação: as linhas existentes ficam bloqueadas
+        até à escrita. Produtos recebidos sem updated_at mantêm o valor gravado.
+        """
+        if not products:
+            return set()
+
+        stale = set()
+        stored = dict(ShopifyProduct.objects.select_for_update().filter(
+            store=store, shopify_id__in=list(products)
+        ).values_list('shopify_id', 'remote_updated_at'))
+        deleted = dict(ShopifyDeletedProduct.objects.filter(
+            store=store, shopify_id__in=list(products)
+        ).values_list('shopify_id', 'deleted_at'))
+
+        for shopify_id, product in products.items():
+            current = stored.get(shopify_id)
+            if product.remote_updated_at is None:
+                product.remote_updated_at = current
+                continue
+            newest = max((d for d in (current, deleted.get(shopify_id)) if d is not None), default=None)
+            if newest is not None and newest >= product.remote_updated_at:
+                stale.add(shopify_id)
+        return stale
+
+    @staticmethod
+    def bulk_upsert_products(products_data: List[Dict[str, Any]], store) -> Dict[str, int]:
+        """
+        Escreve uma página de produtos Shopify (com variantes e imagens) no
+        espelho local com um INSERT ... ON CONFLICT por tabela. Variantes e
+        imagens que deixaram de existir nos produtos da página são removidas.
+
+        Entradas com `children_only` trazem apenas variantes/imagens de um
+        produto já gravado nesta sincronização (bulk operation): são
+        acrescentadas sem alterar o produto nem remover os restantes filhos.
+
+        Produtos com versão mais antiga do que a gravada (ex.: um webhook
+        aplicado durante uma sincronização longa) não são escritos, tal como os
+        seus filhos (ver find_stale_products).
+        """
+        stats = {"products": 0, "variants": 0, "images": 0, "skipped": 0}
+
+        children_only = {
+            p["id"]: parse_datetime(p.get("updated_at") or "")
+            for p in products_data if p.get("children_only") and p.get("id")
+        }
+        children_only_ids = set()
+        if children_only:
+            # Filhos de uma versão do produto mais antiga do que a gravada são ignorados
+            for shopify_id, current in ShopifyProduct.objects.filter(
+                store=store, shopify_id__in=list(children_only)
+            ).values_list('shopify_id', 'remote_updated_at'):
+                incoming = children_only[shopify_id]
+                if current is None or incoming is None or current <= incoming:
+                    children_only_ids.add(shopify_id)
+
+        products = {}
+        variants = {}
+        images = {}
+        for product_data in products_data:
+            shopify_id = product_data.get("id")
+            if not shopify_id:
+                continue
+            if product_data.get("children_only"):
+                if shopify_id not in children_only_ids:
+                    continue
+            else:
+                products[shopify_id] = ShopifyProduct(
+                    shopify_id=shopify_id, store=store, **ShopifyService.build_product_fields(product_data)
+                )
+            for variant_data in product_data.get("variants") or []:
+                if variant_data.get("id"):
+                    variants[variant_data["id"]] = ShopifyVariant(
+                        variant_id=variant_data["id"], product_id=shopify_id,
+                        **ShopifyService.build_variant_fields(variant_data)
+                    )
+            for image_data in product_data.get("images") or []:
+                if image_data.get("id"):
+                    images[image_data["id"]] = ShopifyImage(
+                        image_id=image_data["id"], product_id=shopify_id,
+                        **ShopifyService.build_image_fields(image_data)
+                    )
+
+        if not products and not variants and not images:
+            return stats
+
+        existing_variant_ids = set(
+            ShopifyVariant.objects.filter(variant_id__in=list(variants)).values_list('variant_id', flat=True)
+        )
+        existing_image_ids = set(
+            ShopifyImage.objects.filter(image_id__in=list(images)).values_list('image_id', flat=True)
+        )
+
+        with transaction.atomic():
+            stale_ids = ShopifyService.find_stale_products(store, products)
+            if stale_ids:
+                # Contam como vistos nesta sincronização (ver remoção no fim de fetch_and_store_products)
+                ShopifyProduct.objects.filter(store=store, shopify_id__in=stale_ids).update(updated_at=timezone.now())
+                products = {k: v for k, v in products.items() if k not in stale_ids}
+                variants = {k: v for k, v in variants.items() if v.product_id not in stale_ids}
+                images = {k: v for k, v in images.items() if v.product_id not in stale_ids}
+                stats["skipped"] = len(stale_ids)
+                logger.info(f"{len(stale_ids)} produtos ignorados: versão já gravada é mais recente")
+
+            # A loja de um produto já existente não é alterada
+            ShopifyProduct.objects.bulk_create(
+                list(products.values()),
+                update_conflicts=True,
+                unique_fields=['shopify_id'],
+                update_fields=['title', 'handle', 'body_html', 'vendor', 'product_type', 'status',
+                               'published_at', 'tags', 'remote_updated_at', 'updated_at'],
+            )
+
+            # Variantes recriadas no Shopify com o mesmo SKU substituem a anterior (só na mesma loja)
+            new_skus = [v.sku for variant_id, v in variants.items() if variant_id not in existing_variant_ids and v.sku]
+            if new_skus:
+                ShopifyVariant.objects.filter(
+                    product__store=store, sku__in=new_skus
+                ).exclude(variant_id__in=list(variants)).delete()
+
+            ShopifyVariant.objects.filter(product_id__in=list(products)).exclude(variant_id__in=list(variants)).delete()
+            ShopifyImage.objects.filter(product_id__in=list(products)).exclude(image_id__in=list(images)).delete()
+
+            if variants:
+                ShopifyVariant.objects.bulk_create(
+                    list(variants.values()),
+                    update_conflicts=True,
+                    unique_fields=['variant_id'],
+                    update_fields=['product', 'title', 'price', 'sku', 'barcode', 'compare_at_price', 'position',
+                                   'option1', 'option2', 'option3', 'inventory_quantity', 'inventory_item_id'],
+                )
+            if images:
+                ShopifyImage.objects.bulk_create(
+                    list(images.values()),
+                    update_conflicts=True,
+                    unique_fields=['image_id'],
+                    update_fields=['product', 'position', 'src', 'alt', 'width', 'height', 'updated_at'],
+                )
+
+        stats["products"] = len(products)
+        stats["variants"] = len(variants) - len(existing_variant_ids & set(variants))
+        stats["images"] = len(images) - len(existing_image_ids & set(images))
+        return stats
+
+    @staticmethod
+    def mark_catalog_synced(store, mode: str) -> None:
+        ShopifyCatalogSyncState.objects.update_or_create(
+            store=store, defaults={'last_synced_at': timezone.now(), 'last_sync_mode': mode}
+        )
+
+    @staticmethod
+    def get_sync_mode(store, mode: str = 'auto') -> str:
+        """Em 'auto', lojas grandes (pelo espelho local) usam a bulk operation"""
+        if mode in ('rest', 'bulk'):
+            return mode
+        threshold = getattr(settings, 'SHOPIFY_BULK_SYNC_VARIANT_THRESHOLD', 20000)
+        variants_count = ShopifyVariant.objects.filter(product__store=store).count()
+        return 'bulk' if variants_count >= threshold else 'rest'
+
     @staticmethod
     def fetch_and_store_products(
-        shop_name: str, 
+        shop_name: str,
         access_token: str,
         limit: int = 250,
         force_update: bool = False,
-        store_obj = None
+        store_obj = None,
+        mode: str = 'auto'
     ) -> Tuple[bool, str, int]:
+        """
+        Sincroniza o catálogo da loja com o espelho local. Cada página é gravada
+        em bulk assim que chega, por isso a memória não cresce com o tamanho da
+        loja; no fim são removidos os produtos da loja que não foram vistos
+        (updated_at anterior ao início da sincronização). `force_update` é
+        mantido por compatibilidade: variantes e imagens são sempre atualizadas.
 
+        `mode`: 'rest' (páginas de /products.json), 'bulk' (exportação por bulk
+        operation, ver ShopifyBulkExportService) ou 'auto' (ver get_sync_mode).
+        """
         logger.info(f"Iniciando sincronização de produtos do Shopify - Loja: {shop_name}")
         start_time = time.time()
-        
+
         store = store_obj
         if not store:
             try:
-                from apps.shopify.models import Shopify
                 store = Shopify.objects.filter(
                     shop_domain__icontains=shop_name,
                     access_token=access_token
@@ -62,313 +302,68 @@ class ShopifyService:
             except Exception as e:
                 logger.warning(f"Não foi possível encontrar o objeto da loja: {str(e)}")
 
+        if not store:
+            return (False, "Loja Shopify não encontrada", 0)
+
         try:
-            api_url = ShopifyService.get_api_url(shop_name)
-            headers = ShopifyService.get_headers(access_token)
-            
+            sync_started_at = timezone.now()
+
             total_products_count = 0
             total_saved_count = 0
             total_variants_count = 0
             total_images_count = 0
             total_deleted_count = 0
-            page_index = 0
-            
-            all_synced_product_ids = set()
-            all_synced_product_refs = set()
-            
-            url = f"{api_url}/products.json?limit={limit}&fields=id,title,handle,body_html,vendor,product_type,status,published_at,tags,variants,images"
-            
-            def get_products_page(page_url):
-                nonlocal total_products_count, total_saved_count, total_variants_count, total_images_count, page_index
-                
-                page_index += 1
-                logger.info(f"Buscando página {page_index} de produtos: {page_url}")
-                
-                time.sleep(0.5)
-                
-                try:
-                    response = requests.get(page_url, headers=headers, timeout=10)
-                    
-                    if response.status_code != 200:
-                        logger.error(f"Erro ao buscar produtos: HTTP {response.status_code} - {response.text}")
-                        return False
-                    
-                    data = response.json()
-                    products_data = data.get("products", [])
-                    
-                    current_batch_size = len(products_data)
-                    total_products_count += current_batch_size
-                    
-                    logger.info(f"Processando lote de {current_batch_size} produtos")
-                    
-                    for product_data in products_data:
-                        try:
-                            shopify_id = product_data.get("id")
-                            
-                            if shopify_id:
-                                all_synced_product_ids.add(shopify_id)
-                            
-                            variants_data = product_data.get("variants", [])
-                            for variant in variants_data:
-                                if variant.get("sku"):
-                                    all_synced_product_refs.add(variant.get("sku"))
-                            
-                            try:
-                                product = ShopifyProduct.objects.get(shopify_id=shopify_id)
-    
-                                product.title = product_data.get("title", "")
-                                product.handle = product_data.get("handle", "")
-                                product.body_html = product_data.get("body_html", "")
-                                product.vendor = product_data.get("vendor", "")
-                                product.product_type = product_data.get("product_type", "")
-                                product.status = product_data.get("status", "active")
-                                product.published_at = product_data.get("published_at")
-                                product.tags = product_data.get("tags", "")
-                                
-                                if store:
-                                    try:
-                                        current_store = product.store
-                                        if not current_store:
-                                            product.store = store
-                                    except ShopifyProduct.store.RelatedObjectDoesNotExist:
-                                        product.store = store
-                                
-                                product.save()
-                                
-                                if not force_update:
-                                    logger.debug(f"Produto atualizado: {product.title} (ID: {shopify_id})")
-                                    total_saved_count += 1
-                                    continue
-                                    
-                            except ShopifyProduct.DoesNotExist:
-                                product = ShopifyProduct(
-                                    shopify_id=shopify_id,
-                                    title=product_data.get("title", ""),
-                                    handle=product_data.get("handle", ""),
-                                    body_html=product_data.get("body_html", ""),
-                                    vendor=product_data.get("vendor", ""),
-                                    product_type=product_data.get("product_type", ""),
-                                    status=product_data.get("status", "active"),
-                                    published_at=product_data.get("published_at"),
-                                    tags=product_data.get("tags", ""),
-                                    store=store
-                                )
-                                
-                                product.save()
-                                logger.debug(f"Produto criado: {product.title} (ID: {shopify_id})")
-                            
-                            variants_data = product_data.get("variants", [])
-                            
-                            if force_update:
-                                product.variants.all().delete()
-                            
-                            for variant_data in variants_data:
-                                variant_id = variant_data.get("id")
-                                
-                                if variant_id:
-                                    try:
-                                        variant = ShopifyVariant.objects.get(variant_id=variant_id)
-                                        
-                                        variant.title = variant_data.get("title", "")
-                                        variant.price = variant_data.get("price", 0)
-                                        variant.sku = variant_data.get("sku", "")
-                                        variant.barcode = variant_data.get("barcode", "")
-                                        variant.compare_at_price = variant_data.get("compare_at_price")
-                                        variant.position = variant_data.get("position", 1)
-                                        variant.option1 = variant_data.get("option1", "")
-                                        variant.option2 = variant_data.get("option2", "")
-                                        variant.option3 = variant_data.get("option3", "")
-                                        variant.inventory_quantity = variant_data.get("inventory_quantity", 0)
-                                        
-                                        variant.save()
-                                        
-                                    except ShopifyVariant.DoesNotExist:
-                                        # Verificar se a variante existe por SKU
-                                        sku = variant_data.get("sku")
-                                        existing_variant = None
-                                        
-                                        if sku:
-                                            try:
-                                                existing_variant = ShopifyVariant.objects.get(sku=sku)
-                                                # Se encontrou variante por SKU mas com ID diferente, atualizar o ID
-                                                existing_variant.variant_id = variant_id
-                                                existing_variant.title = variant_data.get("title", "")
-                                                existing_variant.price = variant_data.get("price", 0)
-                                                existing_variant.barcode = variant_data.get("barcode", "")
-                                                existing_variant.compare_at_price = variant_data.get("compare_at_price")
-                                                existing_variant.position = variant_data.get("position", 1)
-                                                existing_variant.option1 = variant_data.get("option1", "")
-                                                existing_variant.option2 = variant_data.get("option2", "")
-                                                existing_variant.option3 = variant_data.get("option3", "")
-                                                existing_variant.inventory_quantity = variant_data.get("inventory_quantity", 0)
-                                                existing_variant.product = product  # Associar ao produto correto
-                                                
-                                                existing_variant.save()
-                                                logger.debug(f"Variante encontrada por SKU e atualizada: {sku}")
-                                            except ShopifyVariant.DoesNotExist:
-                                                existing_variant = None
-                                        
-                                        # Se não encontrou variante por SKU, criar nova
-                                        if not existing_variant:
-                                            # Criar nova variante
-                                            variant = ShopifyVariant(
-                                                variant_id=variant_id,
-                                                product=product,
-                                                title=variant_data.get("title", ""),
-                                                price=variant_data.get("price", 0),
-                                                sku=variant_data.get("sku", ""),
-                                                barcode=variant_data.get("barcode", ""),
-                                                compare_at_price=variant_data.get("compare_at_price"),
-                                                position=variant_data.get("position", 1),
-                                                option1=variant_data.get("option1", ""),
-                                                option2=variant_data.get("option2", ""),
-                                                option3=variant_data.get("option3", ""),
-                                                inventory_quantity=variant_data.get("inventory_quantity", 0)
-                                            )
-                                            
-                                            variant.save()
-                                            total_variants_count += 1
-                            
-                            # Processar imagens
-                            if force_update:
-                                product.images.all().delete()
-                                
-                            images_data = product_data.get("images", [])
-                            for image_data in images_data:
-                                image_id = image_data.get("id")
-                                
-                                if image_id:
-                                    try:
-                                        # Verificar se a imagem já existe
-                                        image = ShopifyImage.objects.get(image_id=image_id)
-                                        
-                                        # Atualizar imagem
-                                        image.position = image_data.get("position", 1)
-                                        image.src = image_data.get("src", "")
-                                        image.alt = image_data.get("alt", "")
-                                        image.width = image_data.get("width")
-                                        image.height = image_data.get("height")
-                                        
-                                        image.save()
-                                        
-                                    except ShopifyImage.DoesNotExist:
-                                        # Criar nova imagem
-                                        image = ShopifyImage(
-                                            image_id=image_id,
-                                            product=product,
-                                            position=image_data.get("position", 1),
-                                            src=image_data.get("src", ""),
-                                            alt=image_data.get("alt", ""),
-                                            width=image_data.get("width"),
-                                            height=image_data.get("height")
-                                        )
-                                        
-                                        image.save()
-                                        total_images_count += 1
-                            
-                            total_saved_count += 1
-                            
-                        except Exception as e:
-                            logger.exception(f"Erro ao salvar produto ID {product_data.get('id')}: {str(e)}")
-                    
-                    next_page_url = None
-                    link_header = response.headers.get('Link')
-                    
-                    if link_header and "rel=\"next\"" in link_header:
-                        urls = ShopifyService._find_urls_in_string(link_header)
-                        for url_text in urls:
-                            if "rel=\"next\"" in link_header.split(url_text)[1]:
-                                next_page_url = url_text
-                                break
-                    
-                    if next_page_url:
-                        get_products_page(next_page_url)
-                    
-                    return True
-                    
-                except requests.exceptions.Timeout:
-                    logger.warning(f"Timeout ao buscar página {page_index}. Tentando novamente...")
-                    time.sleep(2)
-                    return get_products_page(page_url)
-                    
-                except Exception as e:
-                    logger.exception(f"Erro ao processar página {page_index}: {str(e)}")
-                    return False
-            
-            success = get_products_page(url)
-            
-            if not success:
-                return (False, "Erro ao buscar produtos do Shopify", 0)
-            
-            if total_products_count == 0:
-                logger.info("Nenhum produto encontrado no Shopify. Verificando se devemos excluir todos os produtos locais.")
-                
-                local_products_count = ShopifyProduct.objects.count()
-                
-                if local_products_count > 0:
-                    logger.info(f"Removendo {local_products_count} produtos locais, pois não existem produtos no Shopify.")
-                    ShopifyProduct.objects.all().delete()
-                    total_deleted_count = local_products_count
-                    
-                    logger.info(f"Excluídos {total_deleted_count} produtos que não existem mais no Shopify")
-                else:
-                    logger.info("Nenhum produto local para excluir.")
-            elif all_synced_product_ids:
-                products_to_delete = ShopifyProduct.objects.exclude(shopify_id__in=all_synced_product_ids)
-                deleted_count = products_to_delete.count()
-                
-                if deleted_count > 0:
-                    logger.info(f"Excluindo {deleted_count} produtos que foram removidos do Shopify")
-                    
-                    deleted_ids = list(products_to_delete.values_list('shopify_id', flat=True))
-                    logger.debug(f"IDs dos produtos excluídos: {deleted_ids}")
-                    
-                    products_to_delete.delete()
-                    total_deleted_count = deleted_count
-            
-            if all_synced_product_refs:
-                orphan_variants = ShopifyVariant.objects.filter(
-                    Q(sku='') & ~Q(sku__isnull=True) & ~Q(sku__in=all_synced_product_refs)
-                )
-                
-                orphan_count = orphan_variants.count()
-                if orphan_count > 0:
-                    logger.info(f"Excluindo {orphan_count} variantes órfãs que não existem mais no Shopify")
-                    orphan_variants.delete()
-                    total_deleted_count += orphan_count
-            
+
+            sync_mode = ShopifyService.get_sync_mode(store, mode)
+            logger.info(f"Modo de sincronização do catálogo Shopify: {sync_mode}")
+            if sync_mode == 'bulk':
+                pages = ShopifyBulkExportService.iter_product_pages(store.shop_domain, access_token)
+            else:
+                pages = ShopifyService.iter_product_pages(shop_name, access_token, limit)
+
+            for products_data in pages:
+                total_products_count += sum(1 for p in products_data if not p.get("children_only"))
+                logger.info(f"Processando lote de {len(products_data)} produtos")
+
+                page_stats = ShopifyService.bulk_upsert_products(products_data, store)
+                total_saved_count += page_stats["products"]
+                total_variants_count += page_stats["variants"]
+                total_images_count += page_stats["images"]
+
+            # Produtos da loja que não vieram em nenhuma página foram removidos no Shopify
+            products_to_delete = ShopifyProduct.objects.filter(store=store, updated_at__lt=sync_started_at)
+            total_deleted_count = products_to_delete.count()
+            if total_deleted_count > 0:
+                logger.info(f"Excluindo {total_deleted_count} produtos que foram removidos do Shopify")
+                products_to_delete.delete()
+
             elapsed_time = time.time() - start_time
             logger.info(f"Sincronização concluída em {elapsed_time:.2f}s")
             logger.info(f"Total de produtos no Shopify: {total_products_count}")
             logger.info(f"Total de produtos salvos/atualizados: {total_saved_count}")
-            logger.info(f"Total de variantes: {total_variants_count}")
-            logger.info(f"Total de imagens: {total_images_count}")
-            logger.info(f"Total de produtos/variantes excluídos: {total_deleted_count}")
-            
+            logger.info(f"Total de variantes novas: {total_variants_count}")
+            logger.info(f"Total de imagens novas: {total_images_count}")
+            logger.info(f"Total de produtos excluídos: {total_deleted_count}")
+
+            ShopifyService.mark_catalog_synced(store, sync_mode)
+
             message = f"Produtos sincronizados com sucesso: {total_saved_count} atualizados"
             if total_deleted_count > 0:
                 message += f", {total_deleted_count} excluídos"
-            
+
             # Limpar cache
             try:
                 cache.delete('shopify_products_count')
             except:
                 pass
-            
+
             return (True, message, total_saved_count)
-            
+
         except Exception as e:
             elapsed_time = time.time() - start_time
             logger.exception(f"Erro na sincronização de produtos após {elapsed_time:.2f}s: {str(e)}")
             return (False, f"Erro na sincronização: {str(e)}", 0)
 
-    @staticmethod
-    def _find_urls_in_string(string):
-        """Helper para extrair URLs de uma string (usado para paginação)"""
-        regex = r"(?i)\b((?:https?://|www\d{0,3}[.]|[a-z0-9.\-]+[.][a-z]{2,4}/)(?:[^\s()<>]+|\(([^\s()<>]+|(\([^\s()<>]+\)))*\))+(?:\(([^\s()<>]+|(\([^\s()<>]+\)))*\)|[^\s`!()\[\]{};:'\".,<>?«»""'']))"
-        url = re.findall(regex, string)
-        return [x[0] for x in url]
-    
     @staticmethod
     def create_or_update_product(
         shop_name: str,
@@ -377,17 +372,16 @@ class ShopifyService:
         shopify_id: Optional[int] = None
     ) -> Tuple[bool, str, Optional[int]]:
 
-        api_url = ShopifyService.get_api_url(shop_name)
-        headers = ShopifyService.get_headers(access_token)
+        client = ShopifyService.get_client(shop_name, access_token)
         
         # Se tiver um ID, é atualização; caso contrário, é criação
         if shopify_id:
-            url = f"{api_url}/products/{shopify_id}.json"
-            method = requests.put
+            url = f"products/{shopify_id}.json"
+            method = client.put
             log_message = f"Atualizando produto ID {shopify_id} no Shopify"
         else:
-            url = f"{api_url}/products.json"
-            method = requests.post
+            url = "products.json"
+            method = client.post
             log_message = "Criando novo produto no Shopify"
         
         logger.info(log_message)
@@ -395,7 +389,7 @@ class ShopifyService:
         payload = {"product": product_data}
         
         try:
-            response = method(url, headers=headers, json=payload)
+            response = method(url, json=payload)
             
             if response.status_code not in [200, 201]:
                 logger.error(f"Erro na API do Shopify: HTTP {response.status_code} - {response.text}")
@@ -408,124 +402,14 @@ class ShopifyService:
             # Salvar no banco de dados local
             if new_product_id:
                 try:
-                    # Verificar se já existe
-                    try:
-                        product = ShopifyProduct.objects.get(shopify_id=new_product_id)
-                        
-                        # Atualizar campos
-                        product.title = new_product.get("title", "")
-                        product.handle = new_product.get("handle", "")
-                        product.body_html = new_product.get("body_html", "")
-                        product.vendor = new_product.get("vendor", "")
-                        product.product_type = new_product.get("product_type", "")
-                        product.status = new_product.get("status", "active")
-                        product.published_at = new_product.get("published_at")
-                        product.tags = new_product.get("tags", "")
-                        
-                        product.save()
-                        
-                    except ShopifyProduct.DoesNotExist:
-                        try:
-                            if not store:
-                                store = Shopify.objects.filter(
-                                    shop_domain__icontains=shop_name,
-                                    access_token=access_token
-                                ).first()
-                        except Exception as e:
-                            logger.warning(f"Não foi possível encontrar o objeto da loja: {str(e)}")
-                       
-                        product.store = store
-
-                        product = ShopifyProduct(
-                            shopify_id=new_product_id,
-                            store=store,
-                            title=new_product.get("title", ""),
-                            handle=new_product.get("handle", ""),
-                            body_html=new_product.get("body_html", ""),
-                            vendor=new_product.get("vendor", ""),
-                            product_type=new_product.get("product_type", ""),
-                            status=new_product.get("status", "active"),
-                            published_at=new_product.get("published_at"),
-                            tags=new_product.get("tags", "")
-                        )
-                        
-                        product.save()
-                    
-                    # Processar variantes
-                    variants_data = new_product.get("variants", [])
-                    for variant_data in variants_data:
-                        variant_id = variant_data.get("id")
-                        
-                        if variant_id:
-                            try:
-                                # Verificar se a variante já existe
-                                variant = ShopifyVariant.objects.get(variant_id=variant_id)
-                                
-                                # Atualizar variante
-                                variant.title = variant_data.get("title", "")
-                                variant.price = variant_data.get("price", 0)
-                                variant.sku = variant_data.get("sku", "")
-                                variant.barcode = variant_data.get("barcode", "")
-                                variant.compare_at_price = variant_data.get("compare_at_price")
-                                variant.position = variant_data.get("position", 1)
-                                variant.option1 = variant_data.get("option1", "")
-                                variant.option2 = variant_data.get("option2", "")
-                                variant.option3 = variant_data.get("option3", "")
-                                variant.inventory_quantity = variant_data.get("inventory_quantity", 0)
-                                
-                                variant.save()
-                                
-                            except ShopifyVariant.DoesNotExist:
-                                # Criar nova variante
-                                variant = ShopifyVariant(
-                                    variant_id=variant_id,
-                                    product=product,
-                                    title=variant_data.get("title", ""),
-                                    price=variant_data.get("price", 0),
-                                    sku=variant_data.get("sku", ""),
-                                    barcode=variant_data.get("barcode", ""),
-                                    compare_at_price=variant_data.get("compare_at_price"),
-                                    position=variant_data.get("position", 1),
-                                    option1=variant_data.get("option1", ""),
-                                    option2=variant_data.get("option2", ""),
-                                    option3=variant_data.get("option3", ""),
-                                    inventory_quantity=variant_data.get("inventory_quantity", 0)
-                                )
-                                
-                                variant.save()
-                    
-                    # Processar imagens
-                    images_data = new_product.get("images", [])
-                    for image_data in images_data:
-                        image_id = image_data.get("id")
-                        
-                        if image_id:
-                            try:
-                                # Verificar se a imagem já existe
-                                image = ShopifyImage.objects.get(image_id=image_id)
-                                
-                                # Atualizar imagem
-                                image.position = image_data.get("position", 1)
-                                image.src = image_data.get("src", "")
-                                image.alt = image_data.get("alt", "")
-                                image.width = image_data.get("width")
-                                image.height = image_data.get("height")
-                                
-                                image.save()
-                                
-                            except ShopifyImage.DoesNotExist:
-                                # Criar nova imagem
-                                image = ShopifyImage(
-                                    image_id=image_id,
-                                    product=product,
-                                    position=image_data.get("position", 1),
-                                    src=image_data.get("src", ""),
-                                    alt=image_data.get("alt", ""),
-                                    width=image_data.get("width"),
-                                    height=image_data.get("height")
-                                )
-                                
-                                image.save()
+                    store = Shopify.objects.filter(
+                        shop_domain__icontains=shop_name,
+                        access_token=access_token
+                    ).first()
+                    if store:
+                        ShopifyService.bulk_upsert_products([new_product], store)
+                    else:
+                        logger.warning(f"Loja {shop_name} não encontrada; produto {new_product_id} não gravado localmente")
                     
                     return (True, f"Produto {'atualizado' if shopify_id else 'criado'} com sucesso", new_product_id)
                     
@@ -537,4 +421,61 @@ class ShopifyService:
             
         except Exception as e:
             logger.exception(f"Erro ao {'atualizar' if shopify_id else 'criar'} produto: {str(e)}")
-            return (False, f"Erro ao {'atualizar' if shopify_id else 'criar'} produto: {str(e)}", None)
\ No newline at end of file
+            return (False, f"Erro ao {'atualizar' if shopify_id else 'criar'} produto: {str(e)}", None)
+
+
+class ShopifyCatalogRefreshService:
+    """
+    Atualização do espelho local em background: as páginas mostram sempre o
+    espelho e só pedem uma sincronização completa quando este é mais antigo do
+    que SHOPIFY_MIRROR_MAX_AGE_MINUTES (entre sincronizações, os webhooks
+    mantêm-no atualizado). Há no máximo um job ativo por loja.
+    """
+
+    @staticmethod
+    def get_job_dedupe_key(store_id: int) -> str:
+        return f"shopify:catalog_sync:{store_id}"
+
+    @staticmethod
+    def get_mirror_status(store) -> Dict[str, Any]:
+        last_synced_at = ShopifyCatalogSyncState.objects.filter(store=store).values_list(
+            'last_synced_at', flat=True
+        ).first()
+        max_age = timedelta(minutes=getattr(settings, 'SHOPIFY_MIRROR_MAX_AGE_MINUTES', 60))
+        age_seconds = int((timezone.now() - last_synced_at).total_seconds()) if last_synced_at else None
+        active_job = JobService.get_active_job(ShopifyCatalogRefreshService.get_job_dedupe_key(store.id))
+
+        return {
+            'last_synced_at': last_synced_at,
+            'age_seconds': age_seconds,
+            'is_stale': last_synced_at is None or age_seconds > max_age.total_seconds(),
+            'refreshing': active_job is not None,
+            'refresh_job_id': str(active_job.id) if active_job else None,
+        }
+
+    @staticmethod
+    def start_refresh(store, user_id: Optional[int] = None, mode: str = 'auto'):
+        """Põe em fila a sincronização da loja, ou devolve a que já está em curso"""
+        return JobService.enqueue(
+            'product_shopify.catalog_sync',
+            payload={'store_id': store.id, 'mode': mode},
+            user_id=user_id,
+            concurrency_key=f"shopify:{store.id}",
+            dedupe_key=ShopifyCatalogRefreshService.get_job_dedupe_key(store.id),
+        )
+
+    @staticmethod
+    def refresh_if_stale(store, user_id: Optional[int] = None) -> Dict[str, Any]:
+        status = ShopifyCatalogRefreshService.get_mirror_status(store)
+        if status['is_stale'] and not status['refreshing'] and store.access_token:
+            job = ShopifyCatalogRefreshService.start_refresh(store, user_id)
+            logger.info(f"Espelho Shopify de {store.shop_domain} desatualizado, sincronização em fila (job {job.id})")
+            status.update({'refreshing': True, 'refresh_job_id': str(job.id)})
+        return status
+
+    @staticmethod
+    def get_shop_name(store) -> str:
+        shop_domain = store.shop_domain
+        if '.myshopify.com' in shop_domain:
+            return shop_domain.split('.myshopify.com')[0]
+        return shop_domain.split('.')[0]
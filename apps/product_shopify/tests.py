@@ -1,3 +1,277 @@
-from django.test import TestCase
+import base64
+import hashlib
+import hmac
+import json
+import threading
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+
+from apps.shopify.client import ShopifyClient
+from apps.shopify.fake_server import make_fake_shopify_server
+from apps.shopify.models import Shopify
+
+from . import views
+from .bulk import ShopifyBulkExportService
+from .models import ShopifyImage, ShopifyProduct, ShopifyVariant
+from .services import ShopifyService
+from .webhooks import ShopifyWebhookService
+
+
+class FakeShopifyCatalogTestCase(TestCase):
+    """Loja com um catálogo de 5 produtos no Shopify falso, lido por bulk operation em lotes de 2"""
+
+    def setUp(self):
+        self.server = make_fake_shopify_server()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.server.state.seed_catalog(5, variants_per_product=3, images_per_product=2)
+
+        settings = self.settings(SHOPIFY_API_BASE_URL=f"http://127.0.0.1:{self.server.server_port}",
+                                 SHOPIFY_BULK_POLL_INTERVAL=0)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        # O cliente partilhado guarda o URL base da primeira utilização
+        self.addCleanup(ShopifyClient._clients.clear)
+        ShopifyClient._clients.clear()
+
+        batch_size = mock.patch.object(ShopifyBulkExportService, 'BATCH_SIZE', 2)
+        batch_size.start()
+        self.addCleanup(batch_size.stop)
+
+        self.store = Shopify.objects.create(shop_domain='loja.myshopify.com', access_token='token')
+
+    def _sync(self):
+        return ShopifyService.fetch_and_store_products(
+            'loja', 'token', store_obj=self.store, mode='bulk')
+
+    def _pages(self):
+        return list(ShopifyBulkExportService.iter_product_pages('loja', 'token'))
+
+
+class BulkCatalogSyncTests(FakeShopifyCatalogTestCase):
+    """Sincronização do catálogo por bulk operation contra o Shopify falso"""
+
+    def test_pages_group_children_under_their_product(self):
+        pages = self._pages()
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1])
+        for page in pages:
+            for product in page:
+                self.assertEqual([v['position'] for v in product['variants']], [1, 2, 3])
+                self.assertEqual([i['position'] for i in product['images']], [1, 2])
+
+    def test_late_children_are_delivered_after_the_products(self):
+        self.server.state.late_children = 1
+        first_id = ShopifyBulkExportService.legacy_id(self.server.state.catalog[0]['id'])
+
+        pages = self._pages()
+
+        self.assertEqual([len(page) for page in pages], [2, 2, 1, 1])
+        late = pages[-1][0]
+        self.assertEqual(late['id'], first_id)
+        self.assertTrue(late['children_only'])
+        self.assertEqual(len(late['variants']), 3)
+        self.assertEqual([i['position'] for i in late['images']], [1, 2])
+        self.assertEqual(pages[0][0]['variants'], [])
+
+    def test_sync_keeps_late_children_and_sweeps_removed_products(self):
+        self.server.state.late_children = 3
+        removed = ShopifyProduct.objects.create(shopify_id=1, title='Removido', store=self.store)
+
+        success, message, saved = self._sync()
+
+        self.assertTrue(success, message)
+        self.assertEqual(saved, 5)
+        self.assertFalse(ShopifyProduct.objects.filter(pk=removed.pk).exists())
+        self.assertEqual(ShopifyProduct.objects.filter(store=self.store).count(), 5)
+        self.assertEqual(ShopifyVariant.objects.filter(product__store=self.store).count(), 15)
+        self.assertEqual(ShopifyImage.objects.filter(product__store=self.store).count(), 10)
+
+        # Nova sincronização do mesmo catálogo não perde nem duplica filhos
+        success, message, _ = self._sync()
+        self.assertTrue(success, message)
+        self.assertEqual(ShopifyVariant.objects.filter(product__store=self.store).count(), 15)
+        self.assertEqual(ShopifyImage.objects.filter(product__store=self.store).count(), 10)
+
+
+@override_settings(SHOPIFY_WEBHOOK_SECRET='segredo')
+class WebhookHmacTests(SimpleTestCase):
+    """Assinatura X-Shopify-Hmac-Sha256 dos webhooks"""
+
+    body = b'{"id": 1}'
+
+    def _sign(self, body, secret='segredo'):
+        return base64.b64encode(hmac.new(secret.encode(), body, hashlib.sha256).digest()).decode()
+
+    def test_valid_signature(self):
+        self.assertTrue(ShopifyWebhookService.verify_hmac(self.body, self._sign(self.body)))
+
+    def test_invalid_signature(self):
+        self.assertFalse(ShopifyWebhookService.verify_hmac(self.body, self._sign(self.body, 'outro')))
+        self.assertFalse(ShopifyWebhookService.verify_hmac(b'{"id": 2}', self._sign(self.body)))
+        self.assertFalse(ShopifyWebhookService.verify_hmac(self.body, ''))
+
+    def test_missing_secret_rejects_everything(self):
+        with self.settings(SHOPIFY_WEBHOOK_SECRET=''):
+            self.assertFalse(ShopifyWebhookService.verify_hmac(self.body, self._sign(self.body, '')))
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class WebhookApplyTests(TestCase):
+    """Entregas repetidas e fora de ordem de products/*"""
+
+    def setUp(self):
+        cache.clear()
+        self.store = Shopify.objects.create(shop_domain='loja.myshopify.com', access_token='token')
+
+    def _product(self, updated_at, title, variant_price='10.00'):
+        return {
+            'id': 500, 'title': title, 'handle': 'camisola', 'status': 'active', 'updated_at': updated_at,
+            'variants': [{'id': 600, 'title': 'M', 'price': variant_price, 'sku': 'CAM.M', 'position': 1}],
+            'images': [],
+        }
+
+    def test_duplicate_delivery_is_queued_once(self):
+        with mock.patch('apps.product_shopify.webhooks.JobService.enqueue') as enqueue:
+            first = ShopifyWebhookService.enqueue('products/update', self.store, {'id': 500}, 'entrega-1')
+            second = ShopifyWebhookService.enqueue('products/update', self.store, {'id': 500}, 'entrega-1')
+            other = ShopifyWebhookService.enqueue('products/update', self.store, {'id': 500}, 'entrega-2')
+
+        self.assertEqual((first, second, other), (True, False, True))
+        self.assertEqual(enqueue.call_count, 2)
+
+    def test_failed_enqueue_allows_redelivery(self):
+        with mock.patch('apps.product_shopify.webhooks.JobService.enqueue', side_effect=[Exception('fila'), None]):
+            with self.assertRaises(Exception):
+                ShopifyWebhookService.enqueue('products/update', self.store, {'id': 500}, 'entrega-1')
+            self.assertTrue(ShopifyWebhookService.enqueue('products/update', self.store, {'id': 500}, 'entrega-1'))
+
+    def test_update_is_applied(self):
+        ShopifyWebhookService.apply(self.store, 'products/create', self._product('2026-03-01T10:00:00Z', 'Camisola'))
+        result = ShopifyWebhookService.apply(
+            self.store, 'products/update', self._product('2026-03-01T11:00:00Z', 'Camisola azul', '12.00'))
+
+        self.assertNotIn('stale', result)
+        product = ShopifyProduct.objects.get(pk=500)
+        self.assertEqual(product.title, 'Camisola azul')
+        self.assertEqual(str(product.variants.get().price), '12.00')
+
+    def test_out_of_order_update_is_ignored(self):
+        ShopifyWebhookService.apply(
+            self.store, 'products/update', self._product('2026-03-01T11:00:00+00:00', 'Camisola azul', '12.00'))
+        result = ShopifyWebhookService.apply(
+            self.store, 'products/update', self._product('2026-03-01T10:00:00+00:00', 'Camisola', '10.00'))
+
+        self.assertTrue(result['stale'])
+        product = ShopifyProduct.objects.get(pk=500)
+        self.assertEqual(product.title, 'Camisola azul')
+        self.assertEqual(str(product.variants.get().price), '12.00')
+
+    def test_delete_removes_product(self):
+        ShopifyWebhookService.apply(self.store, 'products/create', self._product('2026-03-01T10:00:00Z', 'Camisola'))
+
+        result = ShopifyWebhookService.apply(self.store, 'products/delete', {'id': 500})
+
+        self.assertEqual(result['deleted'], 2)
+        self.assertFalse(ShopifyProduct.objects.filter(pk=500).exists())
+
+
+class CatalogSyncVersionTests(FakeShopifyCatalogTestCase):
+    """Sincronizações longas não sobrepõem versões mais recentes gravadas por webhooks"""
+
+    def setUp(self):
+        super().setUp()
+        first = self.server.state.catalog[0]
+        self.product_id = ShopifyBulkExportService.legacy_id(first['id'])
+        self.variant_id = ShopifyBulkExportService.legacy_id(first['variants'][0]['id'])
+
+    def _webhook_product(self, updated_at, title):
+        return {
+            'id': self.product_id, 'title': title, 'handle': 'produto', 'status': 'active', 'updated_at': updated_at,
+            'variants': [{'id': self.variant_id, 'title': 'Único', 'price': '99.00', 'sku': 'NOVO', 'position': 1}],
+            'images': [],
+        }
+
+    def test_sync_stores_remote_version(self):
+        self.assertIn('updated_at', ShopifyService.PRODUCT_FIELDS.split(','))
+        success, message, _ = self._sync()
+
+        self.assertTrue(success, message)
+        self.assertEqual(
+            ShopifyProduct.objects.get(pk=self.product_id).remote_updated_at.isoformat(), '2026-01-01T00:00:00+00:00'
+        )
+
+    def test_sync_does_not_overwrite_newer_webhook_update(self):
+        ShopifyWebhookService.apply(self.store, 'products/update', self._webhook_product('2026-02-01T00:00:00Z', 'Novo'))
+        ShopifyProduct.objects.filter(pk=self.product_id).update(updated_at=self.store.created_at)
+
+        success, message, _ = self._sync()
+
+        self.assertTrue(success, message)
+        product = ShopifyProduct.objects.get(pk=self.product_id)
+        self.assertEqual(product.title, 'Novo')
+        self.assertEqual(list(product.variants.values_list('sku', flat=True)), ['NOVO'])
+        self.assertEqual(ShopifyProduct.objects.filter(store=self.store).count(), 5)
+
+    def test_payload_without_version_keeps_stored_one(self):
+        ShopifyWebhookService.apply(self.store, 'products/update', self._webhook_product('2026-02-01T00:00:00Z', 'Novo'))
+        data = dict(self._webhook_product(None, 'Sem versão'))
+        del data['updated_at']
+
+        ShopifyService.bulk_upsert_products([data], self.store)
+
+        product = ShopifyProduct.objects.get(pk=self.product_id)
+        self.assertEqual(product.title, 'Sem versão')
+        self.assertEqual(product.remote_updated_at.isoformat(), '2026-02-01T00:00:00+00:00')
+
+    def test_late_update_does_not_restore_deleted_product(self):
+        ShopifyWebhookService.apply(self.store, 'products/create', self._webhook_product('2026-02-01T00:00:00Z', 'Novo'))
+        ShopifyWebhookService.apply(self.store, 'products/delete', {'id': self.product_id})
+
+        result = ShopifyWebhookService.apply(
+            self.store, 'products/update', self._webhook_product('2026-02-01T00:05:00Z', 'Atrasado'))
+        success, message, _ = self._sync()
+
+        self.assertTrue(result['stale'])
+        self.assertTrue(success, message)
+        self.assertFalse(ShopifyProduct.objects.filter(pk=self.product_id).exists())
+        self.assertEqual(ShopifyProduct.objects.filter(store=self.store).count(), 4)
+
+
+class SyncProductsViewTests(TestCase):
+    """A sincronização pedida na página não prende o worker web durante a bulk operation"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('loja', email='loja@example.com', password='x')
+        self.store = Shopify.objects.create(shop_domain='loja.myshopify.com', access_token='token')
+
+    def _post(self, body):
+        request = RequestFactory().post('/product-shopify/api/sync/', data=json.dumps(body),
+                                        content_type='application/json')
+        request.user = self.user
+        request.tenant = mock.Mock(shopify_store=self.store)
+        return views.sync_products(request)
+
+    def test_bulk_and_auto_are_queued(self):
+        for mode in ('bulk', 'auto'):
+            with self.subTest(mode=mode), \
+                    mock.patch.object(ShopifyService, 'fetch_and_store_products') as fetch, \
+                    mock.patch('apps.product_shopify.services.JobService.enqueue',
+                               return_value=mock.Mock(id=42)) as enqueue:
+                response = self._post({'mode': mode})
+
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(json.loads(response.content)['job_id'], '42')
+            self.assertEqual(enqueue.call_args.kwargs['payload'], {'store_id': self.store.id, 'mode': mode})
+            fetch.assert_not_called()
+
+    def test_rest_runs_in_the_request(self):
+        with mock.patch.object(ShopifyService, 'fetch_and_store_products', return_value=(True, 'ok', 3)) as fetch:
+            response = self._post({'mode': 'rest'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(fetch.call_args.kwargs['mode'], 'rest')
@@ -9,5 +9,9 @@ urlpatterns = [
     path('api/products/', views.get_products, name='api_products'),
     path('api/products/<int:product_id>/', views.get_product_details, name='api_product_details'),
     path('api/sync/', views.sync_products, name='api_sync'),
+    path('api/mirror-status/', views.get_mirror_status, name='api_mirror_status'),
     path('api/products/<int:product_id>/delete/', views.delete_product, name='api_delete_product'),
+    
+    # Webhooks do Shopify (atualização incremental do espelho local)
+    path('webhooks/', views.ShopifyWebhookView.as_view(), name='product_shopify_webhooks'),
 ]
\ No newline at end of file
@@ -1,8 +1,6 @@
 # apps/product_shopify/views.py
 import json
 import logging
-import requests
-import threading
 
 from django.shortcuts import render, redirect
 from django.contrib.auth.mixins import LoginRequiredMixin
@@ -12,9 +10,13 @@ from django.http import JsonResponse
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.messages import get_messages
+from django.utils.decorators import method_decorator
+from django.views.decorators.csrf import csrf_exempt
 
 from .models import ShopifyProduct, ShopifyVariant, ShopifyImage
-from .services import ShopifyService
+from .services import ShopifyService, ShopifyCatalogRefreshService
+from .webhooks import ShopifyWebhookService
+from apps.shopify.client import ShopifyClient
 from apps.shopify.models import Shopify
 
 logger = logging.getLogger(__name__)
@@ -25,17 +27,9 @@ class ProductShopifyView(LoginRequiredMixin, TemplateView):
     def get_context_data(self, **kwargs):
         context = TemplateLayout.init(self, super().get_context_data(**kwargs))
 
-        selected_store = None
-        if hasattr(self.request.user, 'profile'):
-            selected_store = self.request.user.profile.selected_shopify_store
+        selected_store = self.request.tenant.shopify_store
         
         if not selected_store:
-            thread = threading.Thread(
-                target=self._sync_and_update_cache,
-                args=(selected_store,)
-            )
-            thread.daemon = True
-            thread.start()
             store = Shopify.objects.filter(users=self.request.user, is_active=True).first()
             if store:
                 try:
@@ -50,17 +44,18 @@ class ProductShopifyView(LoginRequiredMixin, TemplateView):
         context['has_shopify'] = selected_store is not None
         
         if selected_store:
-            # Sincronizar produtos imediatamente a cada carregamento de página
-            success, message, count = self.sync_products_immediately(selected_store)
+            # A página mostra o espelho local; a sincronização corre em background só se estiver desatualizado
+            try:
+                context['mirror_status'] = ShopifyCatalogRefreshService.refresh_if_stale(
+                    selected_store, self.request.user.id
+                )
+            except Exception as e:
+                logger.exception(f"Erro ao verificar o estado do espelho Shopify: {str(e)}")
+                context['mirror_status'] = None
             
-            # Atualizar contadores após a sincronização
             context['products_count'] = ShopifyProduct.objects.filter(store=selected_store).count()
             context['variants_count'] = ShopifyVariant.objects.filter(product__store=selected_store).count()
             context['selected_store'] = selected_store
-            
-            # Informar que os produtos foram sincronizados
-            context['sync_message'] = message if success else f"Erro na sincronização: {message}"
-            context['sync_success'] = success
         else:
             context['products_count'] = 0
             context['variants_count'] = 0
@@ -80,54 +75,36 @@ class ProductShopifyView(LoginRequiredMixin, TemplateView):
             return redirect('/dashboard/')
         
         return self.render_to_response(context)
-    
-    def sync_products_immediately(self, shop):
-        try:
-            shop_domain = shop.shop_domain
-            if '.myshopify.com' in shop_domain:
-                shop_name = shop_domain.split('.myshopify.com')[0]
-            else:
-                shop_name = shop_domain.split('.')[0]
-            
-            if not shop.access_token:
-                logger.warning(f"Loja Shopify {shop_name} não tem token de acesso válido")
-                return False, "Token de acesso inválido", 0
-            
-            success, message, count = ShopifyService.fetch_and_store_products(
-                shop_name=shop_name,
-                access_token=shop.access_token,
-                force_update=False,
-                store_obj=shop
-            )
-            
-            if success:
-                logger.info(f"Sincronização automática concluída para {shop_name}: {message}")
-            else:
-                logger.error(f"Erro na sincronização automática para {shop_name}: {message}")
-            
-            return success, message, count
-                
-        except Exception as e:
-            logger.exception(f"Erro ao sincronizar produtos: {str(e)}")
-            return False, str(e), 0
 
-    def _sync_and_update_cache(self, shop):
-        try:
-            cache.set(f'shopify_sync_status_{shop.id}', {
-                'success': success,
-                'message': message,
-                'timestamp': datetime.now().isoformat()
-            }, timeout=3600)
-        except Exception as e:
-            logger.exception(f"Erro na sincronização em background: {str(e)}")
+@login_required
+def get_mirror_status(request):
+    """Estado do espelho local da loja selecionada (última sincronização e atualização em curso)"""
+    try:
+        selected_store = request.tenant.shopify_store
+        
+        if not selected_store:
+            return JsonResponse({
+                'success': False,
+                'message': 'Você não tem loja Shopify selecionada no seu perfil'
+            })
+        
+        status = ShopifyCatalogRefreshService.get_mirror_status(selected_store)
+        status['products_count'] = ShopifyProduct.objects.filter(store=selected_store).count()
+        status['variants_count'] = ShopifyVariant.objects.filter(product__store=selected_store).count()
+        
+        return JsonResponse({'success': True, 'status': status})
+    except Exception as e:
+        logger.exception(f"Erro ao obter estado do espelho Shopify: {str(e)}")
+        return JsonResponse({
+            'success': False,
+            'message': f"Erro ao obter estado: {str(e)}"
+        }, status=500)
 
 @login_required
 def get_products(request):
     """API para obter produtos da loja selecionada no perfil"""
     try:
-        selected_store = None
-        if hasattr(request.user, 'profile'):
-            selected_store = request.user.profile.selected_shopify_store
+        selected_store = request.tenant.shopify_store
         
         if not selected_store:
             return JsonResponse({
@@ -182,9 +159,7 @@ def get_product_details(request, product_id):
     """API endpoint para obter detalhes de um produto específico"""
     try:
         # Obter loja selecionada no perfil
-        selected_store = None
-        if hasattr(request.user, 'profile'):
-            selected_store = request.user.profile.selected_shopify_store
+        selected_store = request.tenant.shopify_store
         
         if not selected_store:
             return JsonResponse({
@@ -245,15 +220,17 @@ def get_product_details(request, product_id):
 
 @login_required
 def sync_products(request):
-    """API endpoint para sincronizar produtos com o Shopify"""
+    """
+    API endpoint para sincronizar produtos com o Shopify. Os modos 'auto' e
+    'bulk' são postos em fila (resposta 202 com o job e o estado do espelho);
+    só 'rest' sincroniza durante o pedido.
+    """
     if request.method != 'POST':
         return JsonResponse({'error': 'Método não permitido'}, status=405)
     
     try:
         # Obter loja selecionada no perfil
-        selected_store = None
-        if hasattr(request.user, 'profile'):
-            selected_store = request.user.profile.selected_shopify_store
+        selected_store = request.tenant.shopify_store
         
         if not selected_store:
             return JsonResponse({
@@ -270,12 +247,33 @@ def sync_products(request):
         
         access_token = selected_store.access_token
         
-        force_update = json.loads(request.body).get('force_update', False) if request.body else False
+        data = json.loads(request.body) if request.body else {}
+        force_update = data.get('force_update', False)
+        mode = data.get('mode', 'auto')
+        if mode not in ('auto', 'rest', 'bulk'):
+            return JsonResponse({
+                'success': False, 
+                'message': f"Modo de sincronização inválido: {mode}"
+            }, status=400)
+        
+        # A bulk operation pode demorar até SHOPIFY_BULK_TIMEOUT: corre no worker de jobs, não no gunicorn
+        if mode in ('auto', 'bulk'):
+            job = ShopifyCatalogRefreshService.start_refresh(selected_store, request.user.id, mode)
+            status = ShopifyCatalogRefreshService.get_mirror_status(selected_store)
+            return JsonResponse({
+                'success': True,
+                'background': True,
+                'message': 'Sincronização iniciada em segundo plano',
+                'job_id': str(job.id),
+                'status': status
+            }, status=202)
         
         success, message, count = ShopifyService.fetch_and_store_products(
             shop_name,
             access_token,
-            force_update=force_update
+            force_update=force_update,
+            store_obj=selected_store,
+            mode=mode
         )
         
         if success:
@@ -304,9 +302,7 @@ def delete_product(request, product_id):
     
     try:
         # Obter loja selecionada no perfil
-        selected_store = None
-        if hasattr(request.user, 'profile'):
-            selected_store = request.user.profile.selected_shopify_store
+        selected_store = request.tenant.shopify_store
         
         if not selected_store:
             return JsonResponse({
@@ -314,20 +310,8 @@ def delete_product(request, product_id):
                 'message': 'Você não tem loja Shopify selecionada no seu perfil'
             }, status=400)
         
-        shop_domain = selected_store.shop_domain
-        if '.myshopify.com' in shop_domain:
-            shop_name = shop_domain.split('.myshopify.com')[0]
-        else:
-            shop_name = shop_domain.split('.')[0]
-        
-        access_token = selected_store.access_token
-        
-        api_url = ShopifyService.get_api_url(shop_name)
-        headers = ShopifyService.get_headers(access_token)
-        
-        url = f"{api_url}/products/{product_id}.json"
-        
-        response = requests.delete(url, headers=headers)
+        client = ShopifyClient.for_store(selected_store.shop_domain, selected_store.access_token)
+        response = client.delete(f"products/{product_id}.json")
         
         if response.status_code not in [200, 204]:
             logger.error(f"Erro ao excluir produto: HTTP {response.status_code} - {response.text}")
@@ -354,4 +338,43 @@ def delete_product(request, product_id):
         return JsonResponse({
             'success': False, 
             'message': f"Erro ao excluir produto: {str(e)}"
-        }, status=500)
\ No newline at end of file
+        }, status=500)
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ShopifyWebhookView(View):
+    """
+    Recebe os webhooks do Shopify (products/create|update|delete,
+    inventory_levels/update). Responde logo depois de validar o HMAC e pôr o
+    webhook em fila; o Shopify repete a entrega se não receber 200 em 5s.
+    """
+    def post(self, request, *args, **kwargs):
+        topic = request.headers.get('X-Shopify-Topic', '')
+        shop_domain = request.headers.get('X-Shopify-Shop-Domain', '')
+        
+        if not ShopifyWebhookService.verify_hmac(request.body, request.headers.get('X-Shopify-Hmac-Sha256', '')):
+            logger.warning(f"Webhook Shopify com HMAC inválido ({topic}, {shop_domain})")
+            return JsonResponse({'success': False, 'message': 'HMAC inválido'}, status=401)
+        
+        if topic not in ShopifyWebhookService.TOPICS:
+            return JsonResponse({'success': True, 'message': 'Tópico ignorado'})
+        
+        store = ShopifyWebhookService.get_store(shop_domain)
+        if store is None:
+            # Responder 200 para o Shopify não repetir entregas de lojas desconhecidas
+            logger.warning(f"Webhook {topic} de loja desconhecida: {shop_domain}")
+            return JsonResponse({'success': True, 'message': 'Loja desconhecida'})
+        
+        try:
+            payload = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'success': False, 'message': 'JSON inválido'}, status=400)
+        
+        try:
+            queued = ShopifyWebhookService.enqueue(
+                topic, store, payload, request.headers.get('X-Shopify-Webhook-Id', '')
+            )
+        except Exception as e:
+            logger.exception(f"Erro ao pôr webhook {topic} em fila: {str(e)}")
+            return JsonResponse({'success': False, 'message': 'Erro ao processar webhook'}, status=500)
+        
+        return JsonResponse({'success': True, 'queued': queued})
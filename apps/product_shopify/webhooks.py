@@ -0,0 +1,183 @@
+# apps/product_shopify/webhooks.py
+import base64
+import hashlib
+import hmac
+import logging
+from datetime import timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from apps.jobs.services import JobService
+from apps.shopify.client import ShopifyClient
+from apps.shopify.models import Shopify
+
+from .models import ShopifyDeletedProduct, ShopifyProduct, ShopifyVariant
+from .services import ShopifyService
+
+logger = logging.getLogger(__name__)
+
+
+class ShopifyWebhookService:
+    """
+    Atualização incremental do espelho local a partir dos webhooks do Shopify.
+    O endpoint só valida o HMAC e põe o webhook em fila; o job aplica-o
+    (upsert de um produto, remoção ou atualização de stock).
+    """
+    TOPICS = {
+        'products/create': 'PRODUCTS_CREATE',
+        'products/update': 'PRODUCTS_UPDATE',
+        'products/delete': 'PRODUCTS_DELETE',
+        'inventory_levels/update': 'INVENTORY_LEVELS_UPDATE',
+    }
+    # O Shopify repete entregas falhadas durante 48h
+    DELIVERY_DEDUPE_TIMEOUT = 48 * 3600
+    # Marcas de remoção mais antigas do que isto já não protegem de entregas atrasadas
+    DELETED_RETENTION = timedelta(days=7)
+
+    SUBSCRIPTION_MUTATION = """
+    mutation webhookSubscriptionCreate($topic: WebhookSubscriptionTopic!, $callbackUrl: URL!) {
+      webhookSubscriptionCreate(topic: $topic, webhookSubscription: {callbackUrl: $callbackUrl, format: JSON}) {
+        webhookSubscription { id }
+        userErrors { field message }
+      }
+    }
+    """
+
+    # ===== RECEÇÃO =====
+    @staticmethod
+    def verify_hmac(body: bytes, signature: str) -> bool:
+        secret = getattr(settings, 'SHOPIFY_WEBHOOK_SECRET', '')
+        if not secret or not signature:
+            return False
+        digest = hmac.new(secret.encode('utf-8'), body, hashlib.sha256).digest()
+        return hmac.compare_digest(base64.b64encode(digest).decode(), signature)
+
+    @staticmethod
+    def get_store(shop_domain: str) -> Optional[Shopify]:
+        shop_domain = (shop_domain or '').lower()
+        if not shop_domain:
+            return None
+        shop_name = shop_domain.split('.myshopify.com')[0]
+        return Shopify.objects.filter(
+            Q(shop_domain__iexact=shop_domain) | Q(shop_domain__iexact=f"https://{shop_domain}") |
+            Q(shop_domain__iexact=shop_name),
+            is_active=True
+        ).first()
+
+    @staticmethod
+    def enqueue(topic: str, store: Shopify, payload: Dict[str, Any], webhook_id: str = '') -> bool:
+        """Põe o webhook em fila; devolve False para entregas repetidas (mesmo X-Shopify-Webhook-Id)"""
+        dedupe_key = f"shopify:webhook:{webhook_id}"
+        if webhook_id and not cache.add(dedupe_key, 1, ShopifyWebhookService.DELIVERY_DEDUPE_TIMEOUT):
+            logger.info(f"Webhook {webhook_id} ({topic}) já recebido, ignorado")
+            return False
+
+        try:
+            JobService.enqueue(
+                'product_shopify.webhook',
+                payload={'store_id': store.id, 'topic': topic, 'data': payload},
+                concurrency_key=f"shopify:{store.id}",
+            )
+        except Exception:
+            # Sem job em fila a entrega tem de poder ser repetida pelo Shopify
+            if webhook_id:
+                cache.delete(dedupe_key)
+            raise
+        return True
+
+    # ===== APLICAÇÃO =====
+    @staticmethod
+    def is_stale(store: Shopify, data: Dict[str, Any]) -> bool:
+        """
+        O Shopify não garante a ordem das entregas: um products/update mais
+        antigo do que a versão já gravada (remote_updated_at) ou do que a
+        remoção do produto é ignorado. Chamado dentro de uma transação, com a
+        linha do produto bloqueada.
+        """
+        remote_updated_at = parse_datetime(data.get('updated_at') or '')
+        if remote_updated_at is None:
+            return False
+        current = ShopifyProduct.objects.select_for_update().filter(
+            store=store, shopify_id=data.get('id')
+        ).values_list('remote_updated_at', flat=True).first()
+        if current is not None and current >= remote_updated_at:
+            return True
+        deleted_at = ShopifyDeletedProduct.objects.filter(
+            store=store, shopify_id=data.get('id')
+        ).values_list('deleted_at', flat=True).first()
+        return deleted_at is not None and deleted_at >= remote_updated_at
+
+    @staticmethod
+    def apply(store: Shopify, topic: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        if topic in ('products/create', 'products/update'):
+            with transaction.atomic():
+                if ShopifyWebhookService.is_stale(store, data):
+                    logger.info(f"Webhook {topic} do produto {data.get('id')} desatualizado ({data.get('updated_at')}), ignorado")
+                    return {'topic': topic, 'product_id': data.get('id'), 'stale': True}
+                stats = ShopifyService.bulk_upsert_products([data], store)
+            cache.delete('shopify_products_count')
+            return {'topic': topic, 'product_id': data.get('id'), **stats}
+
+        if topic == 'products/delete':
+            now = timezone.now()
+            with transaction.atomic():
+                # O payload não traz data: a remoção conta a partir de agora
+                ShopifyDeletedProduct.objects.update_or_create(
+                    store=store, shopify_id=data.get('id'), defaults={'deleted_at': now}
+                )
+                deleted, _ = ShopifyProduct.objects.filter(store=store, shopify_id=data.get('id')).delete()
+            ShopifyDeletedProduct.objects.filter(deleted_at__lt=now - ShopifyWebhookService.DELETED_RETENTION).delete()
+            cache.delete('shopify_products_count')
+            return {'topic': topic, 'product_id': data.get('id'), 'deleted': deleted}
+
+        if topic == 'inventory_levels/update':
+            updated = ShopifyWebhookService.update_inventory(store, data.get('inventory_item_id'))
+            return {'topic': topic, 'inventory_item_id': data.get('inventory_item_id'), 'updated': updated}
+
+        logger.warning(f"Tópico de webhook não suportado: {topic}")
+        return {'topic': topic, 'ignored': True}
+
+    @staticmethod
+    def update_inventory(store: Shopify, inventory_item_id: Optional[int]) -> int:
+        """
+        O webhook traz o stock de uma só localização; o espelho guarda o total
+        da variante, por isso somam-se os níveis de todas as localizações.
+        """
+        if not inventory_item_id:
+            return 0
+        variants = ShopifyVariant.objects.filter(product__store=store, inventory_item_id=inventory_item_id)
+        if not variants.exists():
+            return 0
+
+        response = ShopifyClient.for_store(store.shop_domain, store.access_token).get(
+            'inventory_levels.json', params={'inventory_item_ids': inventory_item_id}
+        )
+        response.raise_for_status()
+        total = sum(level.get('available') or 0 for level in response.json().get('inventory_levels', []))
+        return variants.update(inventory_quantity=total)
+
+    # ===== SUBSCRIÇÃO =====
+    @staticmethod
+    def register(store: Shopify, callback_url: str) -> Tuple[int, List[Any]]:
+        """Subscreve os tópicos do espelho para a loja; devolve (subscrições criadas, erros)"""
+        client = ShopifyClient.for_store(store.shop_domain, store.access_token).graphql
+        created = 0
+        errors = []
+        for topic in ShopifyWebhookService.TOPICS.values():
+            result = client.execute(
+                ShopifyWebhookService.SUBSCRIPTION_MUTATION, {'topic': topic, 'callbackUrl': callback_url}
+            ).get('webhookSubscriptionCreate') or {}
+            user_errors = result.get('userErrors') or []
+            # Subscrições já existentes para o mesmo endereço devolvem erro "taken"
+            if user_errors:
+                errors.append({'topic': topic, 'errors': user_errors})
+            elif result.get('webhookSubscription'):
+                created += 1
+        logger.info(f"Webhooks da loja {store.shop_domain}: {created} criados, {len(errors)} com erro")
+        return created, errors
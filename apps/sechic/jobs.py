@@ -0,0 +1,25 @@
+# apps/sechic/jobs.py
+import logging
+
+from apps.jobs.registry import register
+from apps.moloni.models import Moloni
+
+from .cache_manager import SechicCacheManager
+from .services import MoloniService
+
+logger = logging.getLogger(__name__)
+
+
+@register('sechic.category_sync', max_attempts=3, lease_seconds=120)
+def run_category_sync(job, context):
+    company = Moloni.objects.get(pk=job.payload['company_id'])
+    logger.info(f"🤖 Verificando sincronização para {company.name}")
+
+    success, message, count = MoloniService.sync_categories_with_moloni(company, force_sync=False)
+
+    if success and count > 0:
+        SechicCacheManager.invalidate_after_data_change(company.id, 'categories')
+    else:
+        logger.info(f"Verificação background: {message}")
+
+    return {'success': success, 'message': message, 'count': count}
@@ -1,5 +1,4 @@
 # apps/sechic/services.py
-import requests
 import logging
 from django.db import transaction
 from dotenv import load_dotenv
@@ -13,9 +12,14 @@ from pathlib import Path
 from urllib.parse import urlencode
 from django.core.cache import cache
 
+import requests
+from urllib3.exceptions import NewConnectionError
+
 from .models import Category, Supplier, Tax, Unit, SupplierMarkup
 from apps.sechic.extra_data.supplier_cost import suppliers_data
+from apps.moloni.client import MoloniHttpClient
 from apps.moloni.models import Moloni, MoloniCredentials
+from apps.moloni.tokens import MoloniTokenManager
 from django.conf import settings
 
 logger = logging.getLogger(__name__)
@@ -87,7 +91,7 @@ class MoloniService:
             }
             
             logger.info(f"🔄 Fazendo refresh do token para empresa {company.name}")
-            response = requests.get(refresh_url, params=params)
+            response = MoloniHttpClient.get(refresh_url, params=params)
             
             if response.status_code != 200:
                 error_msg = f"Erro no refresh: {response.status_code} - {response.text}"
@@ -129,22 +133,9 @@ class MoloniService:
 
     @staticmethod
     def ensure_valid_token(company):
+        """Token da empresa via MoloniTokenManager (cache + renovação single-flight)"""
         try:
-            if not company.moloni_access_token:
-                return False, None, "Sem token - autenticação necessária"
-            
-            if not company.needs_access_token_refresh():
-                return True, company.moloni_access_token, "Token válido"
-            
-            if company.needs_reauth():
-                return False, None, "Refresh token expirado - re-autenticação necessária"
-            
-            success, new_token, error = MoloniService.refresh_access_token(company)
-            
-            if success:
-                return True, new_token, "Token renovado"
-            else:
-                return False, None, error
+            return MoloniTokenManager.get_token(company)
             
         except Exception as e:
             error_msg = f"Erro ao verificar token: {str(e)}"
@@ -167,7 +158,7 @@ class MoloniService:
                     full_url = f"{url}{separator}{params_str}"
                     
                     logger.debug(f"GET URL: {full_url.replace(current_token, '***TOKEN***')}")
-                    response = requests.get(full_url)
+                    response = MoloniHttpClient.get(full_url)
                 
                 else:
                     if data is None:
@@ -181,19 +172,20 @@ class MoloniService:
                     logger.debug(f"POST URL: {full_url.replace(current_token, '***TOKEN***')}")
                     logger.debug(f"POST Data: {data}")
                     
-                    response = requests.post(full_url, data=data)
+                    response = MoloniHttpClient.post(full_url, data=data)
                     
                     if response.status_code != 200:
                         logger.debug("Tentando POST com JSON...")
-                        response = requests.post(full_url, json=data)
+                        response = MoloniHttpClient.post(full_url, json=data)
                 
                 logger.debug(f"Response status: {response.status_code}")
                 
                 if response.status_code == 401 and attempt < max_retries:
                     logger.info(f"Token expirado (tentativa {attempt + 1}), forçando refresh...")
                     
-                    company.token_expires_at = timezone.now() - timedelta(minutes=1)
-                    company.save()
+                    success, _, error = MoloniTokenManager.refresh(company, stale_token=current_token)
+                    if not success:
+                        return False, None, error
                     
                     continue
                 
@@ -219,8 +211,44 @@ class MoloniService:
         return False, None, "Máximo de tentativas excedido"
 
     @staticmethod
-    def _make_authenticated_request_encode(url, company, method='POST', form_data=None, max_retries=1):
-        for attempt in range(max_retries + 1):
+    def _get_retry_delay(response, attempt):
+        """Respeita o Retry-After devolvido pela API; caso contrário, backoff exponencial"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return max(float(retry_after), 0.0)
+            except ValueError:
+                pass
+        return float(min(2 ** attempt, 30))
+
+    @staticmethod
+    def _is_unsent_request_error(error) -> bool:
+        """True quando a ligação nem chegou a ser estabelecida (o pedido não foi enviado)"""
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+            return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+        return False
+
+    @staticmethod
+    def _make_authenticated_request_encode(url, company, method='POST', form_data=None, max_retries=1,
+                                           rate_limiter=None, idempotent=True, find_existing=None):
+        """
+        POST form-urlencoded autenticado. Pedidos idempotentes são repetidos após
+        429, 5xx e erros de rede. Com idempotent=False (ex.: products/insert) só
+        429 e falhas de ligação são repetidos sem mais; após 5xx ou timeout de
+        leitura o pedido pode ter sido aplicado, por isso `find_existing()` —
+        que devolve (sucesso, registo ou None, erro) — é consultado antes de
+        repetir, e sem ele o erro é devolvido.
+        """
+        auth_retries = 0
+        transient_retries = 0
+        max_transient_retries = getattr(settings, 'MOLONI_MAX_RETRIES', 4)
+
+        if method.upper() != 'POST':
+            return False, None, f"Método {method} não suportado para form-urlencoded"
+
+        while True:
             try:
                 success, current_token, error = MoloniService.ensure_valid_token(company)
                 
@@ -245,20 +273,68 @@ class MoloniService:
                 logger.debug(f"FORM POST URL: {full_url.replace(current_token, '***TOKEN***')}")
                 logger.debug(f"FORM Data keys: {list(form_data.keys())}")
                 
-                if method.upper() == 'POST':
-                    response = requests.post(full_url, data=data_string, headers=headers)
-                else:
-                    raise ValueError(f"Método {method} não suportado para form-urlencoded")
-                
-                logger.debug(f"Response status: {response.status_code}")
-                
-                if response.status_code == 401 and attempt < max_retries:
-                    logger.info(f"Token expirado (tentativa {attempt + 1}), forçando refresh...")
+                if rate_limiter is not None:
+                    rate_limiter.acquire()
+
+                try:
+                    response = MoloniHttpClient.post(full_url, data=data_string, headers=headers)
+                except requests.RequestException as e:
+                    if idempotent or MoloniService._is_unsent_request_error(e):
+                        raise
+                    response = None
+                    error_msg = f"Erro na requisição form-urlencoded: {str(e)}"
+                    logger.warning(f"{error_msg} - resultado desconhecido")
+                
+                if response is not None:
+                    logger.debug(f"Response status: {response.status_code}")
+                
+                if response is not None and response.status_code == 401 and auth_retries < max_retries:
+                    auth_retries += 1
+                    logger.info(f"Token expirado (tentativa {auth_retries}), forçando refresh...")
                     
-                    company.token_expires_at = timezone.now() - timedelta(minutes=1)
-                    company.save()
+                    success, _, error = MoloniTokenManager.refresh(company, stale_token=current_token)
+                    if not success:
+                        return False, None, error
                     
                     continue
+
+                if response is None or (not idempotent and response.status_code >= 500):
+                    # Pedido não idempotente com resultado desconhecido: confirmar antes de repetir
+                    if response is not None:
+                        error_msg = f"Erro da API: {response.status_code} - {response.text}"
+                    if find_existing is None or transient_retries >= max_transient_retries:
+                        logger.error(error_msg)
+                        return False, None, error_msg
+
+                    found, existing, lookup_error = find_existing()
+                    if not found:
+                        logger.error(f"{error_msg} - não foi possível confirmar o resultado: {lookup_error}")
+                        return False, None, f"{error_msg} (resultado por confirmar: {lookup_error})"
+                    if existing is not None:
+                        logger.info("Pedido aplicado apesar da falha na resposta; registo existente reutilizado")
+                        return True, existing, None
+
+                    delay = MoloniService._get_retry_delay(response, transient_retries)
+                    transient_retries += 1
+                    logger.warning(
+                        f"Pedido não aplicado, nova tentativa {transient_retries}/{max_transient_retries} em {delay:.1f}s"
+                    )
+                    time.sleep(delay)
+                    continue
+
+                if (response.status_code == 429 or response.status_code >= 500) and transient_retries < max_transient_retries:
+                    delay = MoloniService._get_retry_delay(response, transient_retries)
+                    transient_retries += 1
+                    logger.warning(
+                        f"Moloni respondeu {response.status_code}, nova tentativa "
+                        f"{transient_retries}/{max_transient_retries} em {delay:.1f}s"
+                    )
+                    if response.status_code == 429 and rate_limiter is not None:
+                        # Abranda todas as threads que partilham o limitador da empresa
+                        rate_limiter.pause(delay)
+                    else:
+                        time.sleep(delay)
+                    continue
                 
                 if response.status_code == 200:
                     try:
@@ -274,12 +350,38 @@ class MoloniService:
                 error_msg = f"Erro na requisição form-urlencoded: {str(e)}"
                 logger.exception(error_msg)
                 
-                if attempt >= max_retries:
+                if transient_retries >= max_transient_retries:
                     return False, None, error_msg
                 
-                time.sleep(1)
-        
-        return False, None, "Máximo de tentativas excedido"
+                time.sleep(MoloniService._get_retry_delay(None, transient_retries))
+                transient_retries += 1
+
+    @staticmethod
+    def find_product(company, reference=None, ean=None, rate_limiter=None):
+        """
+        Procura um produto pela referência exata ou, sem referência, pelo EAN.
+        Devolve (sucesso, produto ou None, erro); sucesso=False quando a
+        pesquisa falhou e não se sabe se o produto existe.
+        """
+        if reference:
+            url, data = "https://api.moloni.pt/v1/products/getByReference/", {'reference': reference, 'exact': 1}
+        elif ean:
+            url, data = "https://api.moloni.pt/v1/products/getByEAN/", {'ean': ean}
+        else:
+            return False, None, "Sem referência nem EAN para pesquisar"
+
+        success, products, error = MoloniService._make_authenticated_request_encode(
+            url, company, 'POST', data, rate_limiter=rate_limiter
+        )
+        if not success:
+            return False, None, error
+        if not isinstance(products, list):
+            return False, None, "Formato de resposta inesperado"
+
+        for product in products:
+            if not reference or product.get('reference') == reference:
+                return True, product, None
+        return True, None, None
 
     @staticmethod
     def fetch_and_store_categories(company):
@@ -593,7 +695,7 @@ class MoloniService:
     def check_moloni_session(access_token, company_id=None):
         """Verifica se a sessão do Moloni está ativa"""
         try:
-            response = requests.get(
+            response = MoloniHttpClient.get(
                 f"https://api.moloni.pt/v1/companies/getAll/?access_token={access_token}"
             )
             
@@ -1,3 +1,95 @@
-from django.test import TestCase
+from unittest import mock
 
-# Create your tests here.
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from apps.moloni.models import Moloni
+
+from .services import MoloniService
+
+INSERT_URL = 'https://api.moloni.pt/v1/products/insert/'
+
+
+def _response(status, payload=None):
+    response = mock.Mock(status_code=status, headers={}, text=str(payload))
+    response.json.return_value = payload
+    return response
+
+
+@override_settings(MOLONI_MAX_RETRIES=2)
+class ProductInsertRetryTests(SimpleTestCase):
+    """products/insert não é idempotente: uma resposta perdida não pode gerar um duplicado"""
+
+    def setUp(self):
+        self.company = Moloni(company_id=1234, name='Empresa')
+        mock.patch.object(MoloniService, 'ensure_valid_token', return_value=(True, 'token', 'Token válido')).start()
+        mock.patch('apps.sechic.services.time.sleep').start()
+        self.post = mock.patch('apps.sechic.services.MoloniHttpClient.post').start()
+        self.addCleanup(mock.patch.stopall)
+
+    def _insert(self, **kwargs):
+        def find_existing():
+            found, product, error = MoloniService.find_product(self.company, reference='REF.1')
+            return found, ({'valid': 1, 'product_id': product['product_id']} if product else None), error
+
+        return MoloniService._make_authenticated_request_encode(
+            INSERT_URL, self.company, 'POST', {'reference': 'REF.1', 'name': 'Camisola'},
+            idempotent=False, find_existing=find_existing, **kwargs
+        )
+
+    def _endpoints(self):
+        return [call.args[0].split('/v1/')[1].split('/?')[0] for call in self.post.call_args_list]
+
+    def test_lost_response_reuses_created_product(self):
+        self.post.side_effect = [
+            requests.exceptions.ReadTimeout('read timed out'),
+            _response(200, [{'product_id': 99, 'reference': 'REF.1'}]),
+        ]
+
+        with self.assertLogs('apps.sechic.services', 'WARNING'):
+            success, data, error = self._insert()
+
+        self.assertTrue(success, error)
+        self.assertEqual(data, {'valid': 1, 'product_id': 99})
+        self.assertEqual(self._endpoints(), ['products/insert', 'products/getByReference'])
+
+    def test_server_error_retries_only_when_product_is_missing(self):
+        self.post.side_effect = [
+            _response(502, 'Bad Gateway'),
+            _response(200, []),
+            _response(200, {'valid': 1, 'product_id': 100}),
+        ]
+
+        with self.assertLogs('apps.sechic.services', 'WARNING'):
+            success, data, error = self._insert()
+
+        self.assertTrue(success, error)
+        self.assertEqual(data['product_id'], 100)
+        self.assertEqual(self._endpoints(), ['products/insert', 'products/getByReference', 'products/insert'])
+
+    def test_failed_lookup_does_not_retry(self):
+        self.post.side_effect = [
+            requests.exceptions.ReadTimeout('read timed out'),
+            _response(500, 'erro'),
+            _response(500, 'erro'),
+            _response(500, 'erro'),
+        ]
+
+        with self.assertLogs('apps.sechic.services', 'ERROR'):
+            success, data, error = self._insert()
+
+        self.assertFalse(success)
+        # A pesquisa (idempotente) pode ser repetida; o insert nunca
+        self.assertEqual(self._endpoints().count('products/insert'), 1)
+
+    def test_rate_limited_insert_is_retried(self):
+        self.post.side_effect = [
+            _response(429, 'Too Many Requests'),
+            _response(200, {'valid': 1, 'product_id': 101}),
+        ]
+
+        with self.assertLogs('apps.sechic.services', 'WARNING'):
+            success, data, error = self._insert()
+
+        self.assertTrue(success, error)
+        self.assertEqual(self._endpoints(), ['products/insert', 'products/insert'])
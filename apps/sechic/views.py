@@ -13,21 +13,18 @@ from django.conf import settings
 
 import json
 import logging
-import threading
 
 from .models import Color, Size, Category, Brand, Supplier, SupplierMarkup
 from auth.models import Profile
+from auth.tenant import TenantContext
 from .services import MoloniService
+from apps.jobs.services import JobService
 from .cache_manager import SechicCacheManager
 
 logger = logging.getLogger(__name__)
 
 def get_user_company(user):
-    try:
-        profile = user.profile
-        return profile.selected_moloni_company
-    except Profile.DoesNotExist:
-        return None
+    return TenantContext.for_user(user).moloni_company
 
 class SechicView(LoginRequiredMixin, TemplateView):
     template_name = "sechic.html"
@@ -36,8 +33,7 @@ class SechicView(LoginRequiredMixin, TemplateView):
         context = TemplateLayout.init(self, super().get_context_data(**kwargs))
         
         try:
-            profile = self.request.user.profile
-            selected_company = profile.selected_moloni_company
+            selected_company = self.request.tenant.moloni_company
 
             if selected_company:
                 cached_counts = SechicCacheManager.get_cached_counts(selected_company.id)
@@ -76,24 +72,20 @@ class SechicView(LoginRequiredMixin, TemplateView):
         return context
 
     def trigger_smart_background_sync(self, company):
-        def background_sync():
-            try:
-                logger.info(f"🤖 Verificando sincronização para {company.name}")
-                
-                success, message, count = MoloniService.sync_categories_with_moloni(
-                    company, force_sync=False
-                )
-                
-                if success and count > 0:
-                    SechicCacheManager.invalidate_after_data_change(company.id, 'categories')
-                else:
-                    logger.info(f"Verificação background: {message}")
-                    
-            except Exception as e:
-                logger.error(f"Erro na sincronização background: {str(e)}")
-        
-        sync_thread = threading.Thread(target=background_sync, daemon=True)
-        sync_thread.start()
+        # Evita encher a fila a cada visita: o cooldown é verificado antes de enfileirar
+        if not MoloniService.should_sync(company.id, 'categories', 10):
+            return
+
+        try:
+            JobService.enqueue(
+                'sechic.category_sync',
+                {'company_id': company.id},
+                user_id=self.request.user.id,
+                concurrency_key=f"moloni:{company.id}",
+                dedupe_key=f"sechic.category_sync:{company.id}"
+            )
+        except Exception as e:
+            logger.error(f"Erro ao agendar sincronização background: {str(e)}")
 
 @login_required
 @never_cache
@@ -0,0 +1,191 @@
+# apps/shopify/client.py
+import logging
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+from .graphql import ShopifyGraphQLClient
+
+logger = logging.getLogger(__name__)
+
+
+class ShopifyClient:
+    """
+    Cliente da Admin API de uma loja, partilhado por todas as threads do
+    processo (um por loja/token, ver `for_store`): sessão keep-alive, versão da
+    API única (SHOPIFY_API_VERSION) e leaky bucket REST alimentado pelo
+    cabeçalho X-Shopify-Shop-Api-Call-Limit, para esperar apenas o necessário
+    em vez de pausas fixas. HTTP 429 respeita o Retry-After; 5xx e erros de
+    ligação são repetidos até SHOPIFY_MAX_RETRIES vezes, mas só em métodos
+    idempotentes: um POST que falhou sem resposta pode ter sido aplicado e
+    repeti-lo criaria um duplicado, por isso só é repetido após 429.
+
+    O cliente GraphQL (`graphql`) usa a mesma sessão e mantém o seu próprio
+    bucket de custo entre pedidos.
+    """
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE')
+
+    _clients = {}
+    _lock = threading.Lock()
+
+    def __init__(self, shop_domain: str, access_token: str):
+        self.shop_domain = ShopifyClient.normalize_domain(shop_domain)
+        base_url = getattr(settings, 'SHOPIFY_API_BASE_URL', '') or f"https://{self.shop_domain}"
+        self.api_version = getattr(settings, 'SHOPIFY_API_VERSION', '2024-07')
+        self.api_url = f"{base_url.rstrip('/')}/admin/api/{self.api_version}"
+        self.timeout = getattr(settings, 'SHOPIFY_REQUEST_TIMEOUT', 60)
+        self.max_retries = getattr(settings, 'SHOPIFY_MAX_RETRIES', 4)
+
+        adapter = HTTPAdapter(pool_maxsize=getattr(settings, 'SHOPIFY_HTTP_POOL_MAXSIZE', 10), max_retries=0)
+        self.session = requests.Session()
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            "X-Shopify-Access-Token": access_token,
+            "Content-Type": "application/json"
+        })
+
+        self._bucket_lock = threading.Lock()
+        self._bucket_size = 40.0
+        self._leak_rate = float(getattr(settings, 'SHOPIFY_REST_LEAK_RATE', 2))
+        self._used = 0.0
+        self._updated_at = time.monotonic()
+
+        self._graphql = None
+
+    @staticmethod
+    def normalize_domain(shop_domain: str) -> str:
+        """'https://loja.myshopify.com/', 'loja.myshopify.com' ou 'loja' -> 'loja.myshopify.com'"""
+        domain = (shop_domain or '').strip().lower()
+        domain = domain.replace('https://', '').replace('http://', '').strip('/')
+        if '.' not in domain:
+            domain = f"{domain}.myshopify.com"
+        return domain
+
+    @staticmethod
+    def for_store(shop_domain: str, access_token: str) -> 'ShopifyClient':
+        key = (ShopifyClient.normalize_domain(shop_domain), access_token)
+        with ShopifyClient._lock:
+            client = ShopifyClient._clients.get(key)
+            if client is None:
+                client = ShopifyClient(shop_domain, access_token)
+                ShopifyClient._clients[key] = client
+            return client
+
+    @property
+    def graphql(self) -> ShopifyGraphQLClient:
+        if self._graphql is None:
+            self._graphql = ShopifyGraphQLClient(
+                self.shop_domain, self.session.headers["X-Shopify-Access-Token"],
+                api_version=self.api_version, session=self.session
+            )
+        return self._graphql
+
+    # ===== LEAKY BUCKET REST =====
+    def _leak(self, now: float) -> None:
+        self._used = max(0.0, self._used - (now - self._updated_at) * self._leak_rate)
+        self._updated_at = now
+
+    def _acquire(self) -> None:
+        """Reserva um lugar no bucket; os pedidos em curso de outras threads também contam"""
+        while True:
+            with self._bucket_lock:
+                self._leak(time.monotonic())
+                if self._used + 1 <= self._bucket_size:
+                    self._used += 1
+                    return
+                wait = (self._used + 1 - self._bucket_size) / self._leak_rate
+
+            logger.debug(f"Shopify {self.shop_domain}: a aguardar {wait:.2f}s pelo limite REST")
+            time.sleep(wait)
+
+    def _update_bucket(self, response) -> None:
+        call_limit = response.headers.get('X-Shopify-Shop-Api-Call-Limit', '')
+        try:
+            used, maximum = (float(part) for part in call_limit.split('/'))
+        except ValueError:
+            return
+        with self._bucket_lock:
+            # Lojas Plus têm bucket maior; a taxa de escoamento acompanha (40 -> 2/s)
+            if maximum != self._bucket_size:
+                self._leak_rate = self._leak_rate * maximum / self._bucket_size
+                self._bucket_size = maximum
+            self._used = used
+            self._updated_at = time.monotonic()
+
+    def _fill_bucket(self) -> None:
+        with self._bucket_lock:
+            self._used = self._bucket_size
+            self._updated_at = time.monotonic()
+
+    @staticmethod
+    def _get_retry_delay(response, attempt: int) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return max(float(retry_after), 0.0)
+            except ValueError:
+                pass
+        return float(min(2 ** attempt, 30))
+
+    # ===== PEDIDOS REST =====
+    def get_url(self, path: str) -> str:
+        """Caminho relativo à versão da API ('products.json') ou URL completo (ex.: Link rel=next)"""
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f"{self.api_url}/{path.lstrip('/')}"
+
+    def request(self, method: str, path: str, **kwargs) -> requests.Response:
+        """
+        Faz o pedido e devolve a resposta tal como veio depois de esgotadas as
+        novas tentativas; a interpretação do status fica com o chamador.
+        """
+        url = self.get_url(path)
+        kwargs.setdefault('timeout', self.timeout)
+        idempotent = method.upper() in ShopifyClient.IDEMPOTENT_METHODS
+
+        attempt = 0
+        while True:
+            self._acquire()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                if not idempotent or attempt >= self.max_retries:
+                    raise
+                delay = self._get_retry_delay(None, attempt)
+                attempt += 1
+                logger.warning(f"Shopify {self.shop_domain}: {type(e).__name__}, nova tentativa em {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            self._update_bucket(response)
+
+            retryable = response.status_code == 429 or (idempotent and response.status_code >= 500)
+            if retryable and attempt < self.max_retries:
+                delay = self._get_retry_delay(response, attempt)
+                attempt += 1
+                if response.status_code == 429:
+                    self._fill_bucket()
+                logger.warning(
+                    f"Shopify {self.shop_domain} respondeu {response.status_code}, "
+                    f"nova tentativa {attempt}/{self.max_retries} em {delay:.1f}s"
+                )
+                time.sleep(delay)
+                continue
+
+            return response
+
+    def get(self, path: str, **kwargs) -> requests.Response:
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path: str, **kwargs) -> requests.Response:
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path: str, **kwargs) -> requests.Response:
+        return self.request('PUT', path, **kwargs)
+
+    def delete(self, path: str, **kwargs) -> requests.Response:
+        return self.request('DELETE', path, **kwargs)
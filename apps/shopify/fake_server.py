@@ -0,0 +1,272 @@
+# apps/shopify/fake_server.py
+"""
+Servidor Shopify falso para desenvolvimento e testes locais dos envios.
+
+Implementa o subconjunto da Admin GraphQL API usado pelo aitigos (locations,
+publications, productSet, publishablePublish) e simula o leaky bucket de custo,
+devolvendo THROTTLED quando a capacidade se esgota. Também simula a exportação
+do catálogo por bulk operation (bulkOperationRunQuery, consulta do estado com
+node(id:) e download do ficheiro JSONL) a partir de `state.catalog`.
+`state.lost_responses` simula respostas perdidas: o pedido é executado mas o
+cliente recebe 502.
+Para o usar, arrancar com `manage.py run_fake_shopify` e definir
+SHOPIFY_API_BASE_URL=http://127.0.0.1:<porta>.
+"""
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import count
+
+PRODUCT_SET_PATTERN = re.compile(r'(\w+)\s*:\s*productSet\(\s*input:\s*\$(\w+)')
+PUBLISH_PATTERN = re.compile(r'(\w+)\s*:\s*publishablePublish\(\s*id:\s*\$(\w+)')
+BULK_FILE_PATTERN = re.compile(r'^/bulk/(\d+)\.jsonl$')
+
+
+class FakeShopifyState:
+    def __init__(self, maximum_available=1000, restore_rate=50, mutation_cost=10, bulk_running_polls=1):
+        self.maximum_available = float(maximum_available)
+        self.restore_rate = float(restore_rate)
+        self.mutation_cost = mutation_cost
+        self.bulk_running_polls = bulk_running_polls
+        self.products = {}
+        self.published = set()
+        self.catalog = []
+        # updatedAt dos produtos gerados por seed_catalog
+        self.catalog_updated_at = '2026-01-01T00:00:00Z'
+        self.bulk_operations = {}
+        self.lost_responses = 0
+        self.late_children = 0
+        self.requests = 0
+        self.throttled = 0
+        self._available = float(maximum_available)
+        self._updated_at = time.monotonic()
+        self._ids = count(1000)
+        self._lock = threading.Lock()
+
+    def next_id(self):
+        return next(self._ids)
+
+    def seed_catalog(self, products, variants_per_product=3, images_per_product=1):
+        """Gera um catálogo para exportar por bulk operation"""
+        for _ in range(products):
+            product_id = self.next_id()
+            self.catalog.append({
+                'id': f"gid://shopify/Product/{product_id}",
+                'title': f"Produto {product_id}",
+                'handle': f"produto-{product_id}",
+                'descriptionHtml': '',
+                'vendor': 'Fake',
+                'productType': 'Teste',
+                'status': 'ACTIVE',
+                'publishedAt': None,
+                'updatedAt': self.catalog_updated_at,
+                'tags': ['fake'],
+                'variants': [{
+                    'id': f"gid://shopify/ProductVariant/{self.next_id()}",
+                    'title': f"Tamanho {position}",
+                    'price': '10.00',
+                    'compareAtPrice': None,
+                    'sku': f"{product_id}.{position}",
+                    'barcode': None,
+                    'position': position,
+                    'inventoryQuantity': 5,
+                    'inventoryItem': {'id': f"gid://shopify/InventoryItem/{self.next_id()}"},
+                    'selectedOptions': [{'name': 'Tamanho', 'value': str(position)}],
+                } for position in range(1, variants_per_product + 1)],
+                'images': [{
+                    'id': f"gid://shopify/ProductImage/{self.next_id()}",
+                    'url': f"https://cdn.example.com/{product_id}-{position}.jpg",
+                    'altText': None,
+                    'width': 800,
+                    'height': 800,
+                } for position in range(1, images_per_product + 1)],
+            })
+
+    def bulk_lines(self):
+        """
+        Linhas JSONL como o Shopify as devolve: cada filho depois do pai, com
+        __parentId. Os filhos dos primeiros `late_children` produtos só vêm no
+        fim do ficheiro (o Shopify não garante que venham logo a seguir ao pai).
+        """
+        late = []
+        for index, product in enumerate(self.catalog):
+            yield {k: v for k, v in product.items() if k not in ('variants', 'images')}
+            children = [dict(child, __parentId=product['id']) for child in product['variants'] + product['images']]
+            if index < self.late_children:
+                late.extend(children)
+            else:
+                yield from children
+        yield from late
+
+    def start_bulk_operation(self):
+        with self._lock:
+            if any(op['status'] == 'RUNNING' for op in self.bulk_operations.values()):
+                return None
+            operation_id = self.next_id()
+            self.bulk_operations[operation_id] = {'status': 'RUNNING', 'polls': 0}
+            return operation_id
+
+    def poll_bulk_operation(self, operation_id):
+        with self._lock:
+            operation = self.bulk_operations.get(operation_id)
+            if operation is None:
+                return None
+            operation['polls'] += 1
+            if operation['status'] == 'RUNNING' and operation['polls'] > self.bulk_running_polls:
+                operation['status'] = 'COMPLETED'
+            return operation
+
+    def lose_response(self):
+        """Consome uma das respostas a perder; devolve True se esta deve ser perdida"""
+        with self._lock:
+            if self.lost_responses <= 0:
+                return False
+            self.lost_responses -= 1
+            return True
+
+    def spend(self, cost):
+        """Desconta o custo do bucket; devolve (aceite, disponível)"""
+        with self._lock:
+            now = time.monotonic()
+            self._available = min(self.maximum_available,
+                                  self._available + (now - self._updated_at) * self.restore_rate)
+            self._updated_at = now
+            self.requests += 1
+            if self._available < cost:
+                self.throttled += 1
+                return False, self._available
+            self._available -= cost
+            return True, self._available
+
+
+class FakeShopifyHandler(BaseHTTPRequestHandler):
+    state: FakeShopifyState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _cost_extensions(self, requested, available):
+        return {'cost': {
+            'requestedQueryCost': requested,
+            'actualQueryCost': requested,
+            'throttleStatus': {
+                'maximumAvailable': self.state.maximum_available,
+                'currentlyAvailable': available,
+                'restoreRate': self.state.restore_rate,
+            },
+        }}
+
+    def do_GET(self):
+        match = BULK_FILE_PATTERN.match(self.path)
+        if not match or int(match.group(1)) not in self.state.bulk_operations:
+            self._send_json({'errors': 'Not Found'}, status=404)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/jsonl')
+        self.end_headers()
+        for line in self.state.bulk_lines():
+            self.wfile.write(json.dumps(line).encode('utf-8') + b'\n')
+
+    def do_POST(self):
+        if not self.path.endswith('/graphql.json'):
+            self._send_json({'errors': 'Not Found'}, status=404)
+            return
+        if not self.headers.get('X-Shopify-Access-Token'):
+            self._send_json({'errors': '[API] Invalid API key or access token'}, status=401)
+            return
+
+        length = int(self.headers.get('Content-Length') or 0)
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        query = payload.get('query', '')
+        variables = payload.get('variables') or {}
+
+        product_sets = PRODUCT_SET_PATTERN.findall(query)
+        publishes = PUBLISH_PATTERN.findall(query)
+        bulk_run = 'bulkOperationRunQuery' in query
+        requested = max(1, self.state.mutation_cost * (len(product_sets) + len(publishes) + int(bulk_run)))
+
+        accepted, available = self.state.spend(requested)
+        extensions = self._cost_extensions(requested, available)
+        if not accepted:
+            self._send_json({
+                'errors': [{'message': 'Throttled', 'extensions': {'code': 'THROTTLED'}}],
+                'extensions': extensions,
+            })
+            return
+
+        data = {}
+        if 'locations(' in query:
+            data['locations'] = {'nodes': [{'id': 'gid://shopify/Location/1', 'name': 'Armazém'}]}
+        if 'publications(' in query:
+            data['publications'] = {'nodes': [{'id': 'gid://shopify/Publication/1', 'name': 'Online Store'}]}
+        for alias, variable in product_sets:
+            data[alias] = self._product_set(variables.get(variable) or {})
+        for alias, variable in publishes:
+            self.state.published.add(variables.get(variable))
+            data[alias] = {'userErrors': []}
+        if bulk_run:
+            data['bulkOperationRunQuery'] = self._bulk_run()
+        if 'BulkOperation' in query and 'node(' in query:
+            data['node'] = self._bulk_node(variables.get('id') or '')
+
+        if self.state.lose_response():
+            self._send_json({'errors': 'Bad Gateway'}, status=502)
+            return
+        self._send_json({'data': data, 'extensions': extensions})
+
+    def _bulk_run(self):
+        operation_id = self.state.start_bulk_operation()
+        if operation_id is None:
+            return {'bulkOperation': None, 'userErrors': [{
+                'field': None,
+                'message': 'A bulk query operation for this app and shop is already in progress',
+            }]}
+        return {'bulkOperation': {'id': f"gid://shopify/BulkOperation/{operation_id}", 'status': 'CREATED'},
+                'userErrors': []}
+
+    def _bulk_node(self, gid):
+        operation_id = int(gid.rsplit('/', 1)[-1]) if gid.rsplit('/', 1)[-1].isdigit() else None
+        operation = self.state.poll_bulk_operation(operation_id)
+        if operation is None:
+            return None
+        completed = operation['status'] == 'COMPLETED'
+        return {
+            'id': gid,
+            'status': operation['status'],
+            'errorCode': None,
+            'objectCount': str(sum(1 for _ in self.state.bulk_lines())) if completed else '0',
+            'url': f"http://{self.headers.get('Host')}/bulk/{operation_id}.jsonl" if completed else None,
+            'partialDataUrl': None,
+        }
+
+    def _product_set(self, product_input):
+        if not product_input.get('title'):
+            return {'product': None, 'userErrors': [{'field': ['title'], 'message': "Title can't be blank"}]}
+
+        product_id = f"gid://shopify/Product/{self.state.next_id()}"
+        variants = [{
+            'id': f"gid://shopify/ProductVariant/{self.state.next_id()}",
+            'inventoryItem': {'id': f"gid://shopify/InventoryItem/{self.state.next_id()}"},
+        } for _ in product_input.get('variants', [])]
+        self.state.products[product_id] = product_input
+        return {'product': {'id': product_id, 'variants': {'nodes': variants}}, 'userErrors': []}
+
+
+def make_fake_shopify_server(host='127.0.0.1', port=0, **state_options):
+    """Cria o servidor (porta 0 = porta livre); o estado fica em server.state"""
+    state = FakeShopifyState(**state_options)
+    handler = type('BoundFakeShopifyHandler', (FakeShopifyHandler,), {'state': state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.state = state
+    return server
@@ -0,0 +1,150 @@
+# apps/shopify/graphql.py
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+class ShopifyGraphQLError(Exception):
+    def __init__(self, message: str, errors: Any = None):
+        super().__init__(message)
+        self.errors = errors
+
+
+class ShopifyGraphQLClient:
+    """
+    Cliente da Admin GraphQL API. Em vez de pausas fixas, usa os dados de custo
+    devolvidos em `extensions.cost.throttleStatus` (leaky bucket) para esperar
+    apenas o necessário antes do pedido seguinte.
+
+    Queries são repetidas após erros de ligação, 429, 5xx e THROTTLED. Uma
+    mutation (ex.: productSet de criação) pode ter sido aplicada mesmo quando a
+    resposta se perde, por isso só é repetida quando o Shopify a recusou sem a
+    executar: THROTTLED, 429 ou falha a estabelecer a ligação.
+    """
+
+    def __init__(self, shop_domain: str, access_token: str, api_version: Optional[str] = None,
+                 session: Optional[requests.Session] = None):
+        base_url = getattr(settings, 'SHOPIFY_API_BASE_URL', '') or f"https://{shop_domain}"
+        version = api_version or getattr(settings, 'SHOPIFY_API_VERSION', '2024-07')
+        self.endpoint = f"{base_url.rstrip('/')}/admin/api/{version}/graphql.json"
+        self.timeout = getattr(settings, 'SHOPIFY_REQUEST_TIMEOUT', 60)
+        self.max_retries = getattr(settings, 'SHOPIFY_MAX_RETRIES', 4)
+
+        self.session = session or requests.Session()
+        self.session.headers.update({
+            "X-Shopify-Access-Token": access_token,
+            "Content-Type": "application/json"
+        })
+
+        self._lock = threading.Lock()
+        self._maximum_available = None
+        self._currently_available = None
+        self._restore_rate = None
+        self._status_at = None
+
+    # ===== LEAKY BUCKET =====
+    def _available_now(self) -> Optional[float]:
+        if self._currently_available is None:
+            return None
+        elapsed = time.monotonic() - self._status_at
+        return min(self._maximum_available, self._currently_available + elapsed * self._restore_rate)
+
+    def _wait_for_capacity(self, cost: float) -> None:
+        with self._lock:
+            available = self._available_now()
+            if available is None or available >= cost or not self._restore_rate:
+                return
+            wait = (min(cost, self._maximum_available) - available) / self._restore_rate
+
+        logger.debug(f"Shopify: a aguardar {wait:.2f}s por capacidade ({cost} pontos)")
+        time.sleep(wait)
+
+    def _update_throttle_status(self, cost_data: Optional[Dict]) -> None:
+        throttle_status = (cost_data or {}).get('throttleStatus')
+        if not throttle_status:
+            return
+        with self._lock:
+            self._maximum_available = float(throttle_status.get('maximumAvailable', 1000))
+            self._currently_available = float(throttle_status.get('currentlyAvailable', 0))
+            self._restore_rate = float(throttle_status.get('restoreRate', 50))
+            self._status_at = time.monotonic()
+
+    @staticmethod
+    def _is_throttled(errors) -> bool:
+        return any(
+            (error.get('extensions') or {}).get('code') == 'THROTTLED'
+            for error in errors if isinstance(error, dict)
+        )
+
+    @staticmethod
+    def _get_retry_delay(response, attempt: int) -> float:
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                return max(float(retry_after), 0.0)
+            except ValueError:
+                pass
+        return float(min(2 ** attempt, 30))
+
+    @staticmethod
+    def _is_mutation(query: str) -> bool:
+        return query.lstrip().startswith('mutation')
+
+    # ===== PEDIDOS =====
+    def execute(self, query: str, variables: Optional[Dict] = None, estimated_cost: float = 10) -> Dict:
+        """Executa uma query/mutation e devolve `data`; lança ShopifyGraphQLError em caso de erro"""
+        cost = estimated_cost
+        mutation = self._is_mutation(query)
+
+        for attempt in range(self.max_retries + 1):
+            self._wait_for_capacity(cost)
+
+            try:
+                response = self.session.post(
+                    self.endpoint, json={'query': query, 'variables': variables or {}}, timeout=self.timeout
+                )
+            except requests.RequestException as e:
+                # Sem ligação estabelecida o pedido nunca chegou ao Shopify
+                unsent = isinstance(e, requests.exceptions.ConnectTimeout)
+                if attempt >= self.max_retries or (mutation and not unsent):
+                    raise ShopifyGraphQLError(f"Erro de ligação ao Shopify: {str(e)}")
+                time.sleep(self._get_retry_delay(None, attempt))
+                continue
+
+            if response.status_code == 429 or (response.status_code >= 500 and not mutation):
+                if attempt >= self.max_retries:
+                    raise ShopifyGraphQLError(f"Shopify indisponível: {response.status_code}")
+                delay = self._get_retry_delay(response, attempt)
+                logger.warning(f"Shopify respondeu {response.status_code}, nova tentativa em {delay:.1f}s")
+                time.sleep(delay)
+                continue
+
+            if response.status_code >= 500:
+                raise ShopifyGraphQLError(f"Shopify indisponível: {response.status_code} (mutation não repetida)")
+
+            if response.status_code != 200:
+                raise ShopifyGraphQLError(f"Erro da API Shopify: {response.status_code} - {response.text[:500]}")
+
+            payload = response.json()
+            cost_data = (payload.get('extensions') or {}).get('cost') or {}
+            self._update_throttle_status(cost_data)
+
+            errors = payload.get('errors')
+            if errors:
+                if self._is_throttled(errors) and attempt < self.max_retries:
+                    cost = cost_data.get('requestedQueryCost') or cost
+                    logger.info(f"Shopify: pedido limitado (THROTTLED), nova tentativa {attempt + 1}")
+                    if self._currently_available is None:
+                        time.sleep(self._get_retry_delay(None, attempt))
+                    continue
+                raise ShopifyGraphQLError(f"Erro GraphQL: {errors}", errors)
+
+            return payload.get('data') or {}
+
+        raise ShopifyGraphQLError("Máximo de tentativas excedido")
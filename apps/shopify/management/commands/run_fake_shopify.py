@@ -0,0 +1,38 @@
+# apps/shopify/management/commands/run_fake_shopify.py
+from django.core.management.base import BaseCommand
+
+from apps.shopify.fake_server import make_fake_shopify_server
+
+
+class Command(BaseCommand):
+    help = "Arranca um servidor Shopify falso (GraphQL) para testar envios localmente"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8777)
+        parser.add_argument('--restore-rate', type=float, default=50, help='Pontos recuperados por segundo')
+        parser.add_argument('--bucket-size', type=float, default=1000, help='Capacidade máxima do bucket')
+        parser.add_argument('--catalog-products', type=int, default=0,
+                            help='Produtos no catálogo exportado pela bulk operation')
+        parser.add_argument('--catalog-variants', type=int, default=3, help='Variantes por produto do catálogo')
+
+    def handle(self, *args, **options):
+        server = make_fake_shopify_server(
+            options['host'], options['port'],
+            maximum_available=options['bucket_size'],
+            restore_rate=options['restore_rate'],
+        )
+        if options['catalog_products']:
+            server.state.seed_catalog(options['catalog_products'], options['catalog_variants'])
+        host, port = server.server_address[:2]
+        self.stdout.write(f"Shopify falso em http://{host}:{port} (SHOPIFY_API_BASE_URL=http://{host}:{port})")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(
+                f"{len(server.state.products)} produtos criados, {server.state.requests} pedidos, "
+                f"{server.state.throttled} limitados"
+            )
@@ -8,8 +8,8 @@ class ShopifyMiddleware:
     def __call__(self, request):
         if request.user.is_authenticated and 'selected_shopify_domain' not in request.session:
             try:
-                # Usar relacionamento many-to-many
-                shopify_store = request.user.shopify_stores.latest('created_at')
+                # Loja selecionada no perfil (request.tenant); senão a mais recente do utilizador
+                shopify_store = request.tenant.shopify_store or request.user.shopify_stores.latest('created_at')
                 if shopify_store:
                     request.session['selected_shopify_domain'] = shopify_store.shop_domain
                     request.session['selected_shopify_name'] = getattr(shopify_store, 'name', shopify_store.shop_domain)
@@ -1,3 +1,113 @@
-from django.test import TestCase
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from django.test import SimpleTestCase
+
+from .client import ShopifyClient
+from .fake_server import make_fake_shopify_server
+from .graphql import ShopifyGraphQLClient, ShopifyGraphQLError
+
+PRODUCT_SET = """
+mutation CreateProduct($p0: ProductSetInput!) {
+  p0: productSet(input: $p0) { product { id } userErrors { field message } }
+}
+"""
+
+LOCATIONS = "query { locations(first: 1) { nodes { id name } } }"
+
+
+class _ServerErrorHandler(BaseHTTPRequestHandler):
+    """Responde 500 a todos os pedidos e conta-os por método"""
+    protocol_version = 'HTTP/1.1'
+    calls = {}
+
+    def _reply(self):
+        _ServerErrorHandler.calls[self.command] = _ServerErrorHandler.calls.get(self.command, 0) + 1
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        body = json.dumps({'errors': 'boom'}).encode()
+        self.send_response(500)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _reply
+
+    def log_message(self, *args):
+        pass
+
+
+class ShopifyClientRetryTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(('127.0.0.1', 0), _ServerErrorHandler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+    def setUp(self):
+        _ServerErrorHandler.calls = {}
+        with self.settings(SHOPIFY_API_BASE_URL=f"http://127.0.0.1:{self.server.server_port}",
+                           SHOPIFY_MAX_RETRIES=2):
+            self.client = ShopifyClient('loja', 'token')
+
+    def test_post_is_not_retried_after_server_error(self):
+        # O produto pode ter sido criado antes do 500: repetir criaria um duplicado
+        response = self.client.post('products.json', json={'product': {'title': 'A'}})
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(_ServerErrorHandler.calls, {'POST': 1})
+
+    def test_get_is_retried_after_server_error(self):
+        with mock.patch('apps.shopify.client.time.sleep'), self.assertLogs('apps.shopify.client', 'WARNING'):
+            response = self.client.get('products.json')
+
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(_ServerErrorHandler.calls, {'GET': 3})
+
+
+class ShopifyGraphQLRetryTests(SimpleTestCase):
+    def setUp(self):
+        self.server = make_fake_shopify_server(mutation_cost=10)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        with self.settings(SHOPIFY_API_BASE_URL=f"http://127.0.0.1:{self.server.server_port}",
+                           SHOPIFY_MAX_RETRIES=2):
+            self.client = ShopifyGraphQLClient('loja', 'token')
+
+    def test_mutation_is_not_retried_after_lost_response(self):
+        self.server.state.lost_responses = 1
+
+        with self.assertRaises(ShopifyGraphQLError):
+            self.client.execute(PRODUCT_SET, {'p0': {'title': 'Camisola'}})
+
+        # O produto foi criado uma única vez; repetir tê-lo-ia duplicado
+        self.assertEqual(len(self.server.state.products), 1)
+        self.assertEqual(self.server.state.requests, 1)
+
+    def test_query_is_retried_after_lost_response(self):
+        self.server.state.lost_responses = 1
+
+        with mock.patch('apps.shopify.graphql.time.sleep'), self.assertLogs('apps.shopify.graphql', 'WARNING'):
+            data = self.client.execute(LOCATIONS)
+
+        self.assertEqual(data['locations']['nodes'][0]['name'], 'Armazém')
+        self.assertEqual(self.server.state.requests, 2)
+
+    def test_throttled_mutation_is_retried(self):
+        # Bucket vazio: a primeira tentativa é recusada e a capacidade volta em ~10ms
+        self.server.state.restore_rate = 1000.0
+        self.server.state._available = 0.0
+
+        data = self.client.execute(PRODUCT_SET, {'p0': {'title': 'Camisola'}}, estimated_cost=1)
+
+        self.assertEqual(data['p0']['userErrors'], [])
+        self.assertEqual(self.server.state.throttled, 1)
+        self.assertEqual(len(self.server.state.products), 1)
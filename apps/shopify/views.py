@@ -1,6 +1,7 @@
 # apps/shopify/views.py
 import shopify
 import os
+import logging
 from django.http import HttpResponseRedirect
 from django.urls import reverse
 from django.shortcuts import render, redirect
@@ -19,6 +20,8 @@ from auth.models import Profile
 from .forms import ShopifyCredentialsForm
 from .models import Shopify
 
+logger = logging.getLogger(__name__)
+
 SCOPES = [
     'read_products',      
     'write_products',   
@@ -50,8 +53,8 @@ class ShopifyConnectionView(FormView):
                     shop_url = f"{shop_url}.myshopify.com"
                 shop_url = f"https://{shop_url}"
             
-            # Criar sessão com a versão mais recente da API
-            api_session = shopify.Session(shop_url, '2023-10', token)
+            # Criar sessão com a versão da API configurada (SHOPIFY_API_VERSION)
+            api_session = shopify.Session(shop_url, settings.SHOPIFY_API_VERSION, token)
             shopify.ShopifyResource.activate_session(api_session)
             
             # Verificar se o token tem acesso aos escopos necessários
@@ -116,7 +119,7 @@ class ShopifyAuthenticateView(View):
         scopes = ','.join(SCOPES)
         
         # Criar nova sessão para obter URL de autorização
-        shop_session = shopify.Session(shop_domain, '2023-10')
+        shop_session = shopify.Session(shop_domain, settings.SHOPIFY_API_VERSION)
         auth_url = shop_session.create_permission_url(scopes, redirect_uri)
         
         # Salvar dados da sessão para uso posterior
@@ -143,7 +146,7 @@ class ShopifyCallbackView(View):
         shopify.Session.setup(api_key=api_key, secret=api_secret)
         
         # Criar sessão e obter token permanente
-        shop_session = shopify.Session(shop_domain, '2023-10')
+        shop_session = shopify.Session(shop_domain, settings.SHOPIFY_API_VERSION)
         
         try:
             # Validar e obter token permanente
@@ -200,6 +203,15 @@ class ShopifyCallbackView(View):
                     "Você pode sincronizar manualmente na página de produtos."
                 )
             
+            # Alterações feitas no Shopify passam a chegar por webhook
+            webhook_url = request.build_absolute_uri(reverse('product_shopify_webhooks'))
+            if webhook_url.startswith('https://'):
+                try:
+                    from apps.product_shopify.webhooks import ShopifyWebhookService
+                    ShopifyWebhookService.register(shopify_store, webhook_url)
+                except Exception as webhook_error:
+                    logger.exception(f"Erro ao subscrever webhooks da loja {shop_domain}: {str(webhook_error)}")
+            
         except Exception as e:
             messages.error(request, f"Erro no processo de autenticação: {str(e)}")
         finally:
@@ -0,0 +1,15 @@
+# auth/middleware.py
+from django.utils.functional import SimpleLazyObject
+
+from .tenant import TenantContext
+
+
+class TenantContextMiddleware:
+    """Disponibiliza request.tenant (empresa Moloni e loja Shopify selecionadas), resolvido só quando usado"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request.tenant = SimpleLazyObject(lambda: TenantContext.for_user(request.user))
+        return self.get_response(request)
@@ -34,6 +34,11 @@ class Profile(models.Model):
         if created:
             Profile.objects.create(user=instance, email=instance.email)
 
+    @receiver(post_save, sender='accounts.Profile')
+    def invalidate_tenant_context(sender, instance, **kwargs):
+        from .tenant import TenantContext
+        TenantContext.invalidate(instance.user_id)
+
     class Meta:
         verbose_name = "User Profile"
         verbose_name_plural = "User Profiles"
@@ -0,0 +1,75 @@
+# auth/tenant.py
+import logging
+from typing import Optional
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Profile
+
+logger = logging.getLogger(__name__)
+
+
+class TenantContext:
+    """
+    Empresa Moloni e loja Shopify selecionadas pelo utilizador, resolvidas uma
+    só vez por pedido (request.tenant, ver TenantContextMiddleware): o perfil é
+    lido com as duas seleções num único SELECT e guardado na cache durante
+    TENANT_CONTEXT_CACHE_SECONDS. A cache é invalidada quando o perfil é
+    gravado; alterações à empresa ou à loja aparecem ao fim do TTL.
+
+    Serve apenas para leitura; para alterar seleções use request.user.profile.
+    """
+
+    def __init__(self, user):
+        self.user = user
+        self._profile = None
+        self._loaded = False
+
+    @staticmethod
+    def get_cache_key(user_id) -> str:
+        return f"tenant:profile:user:{user_id}"
+
+    @staticmethod
+    def for_user(user) -> 'TenantContext':
+        """Contexto memorizado no próprio objeto user, partilhado por middleware e views do mesmo pedido"""
+        context = getattr(user, '_tenant_context', None)
+        if context is None:
+            context = TenantContext(user)
+            user._tenant_context = context
+        return context
+
+    @staticmethod
+    def invalidate(user_id) -> None:
+        cache.delete(TenantContext.get_cache_key(user_id))
+
+    @property
+    def profile(self) -> Optional[Profile]:
+        if not self._loaded:
+            self._profile = self._load()
+            self._loaded = True
+        return self._profile
+
+    @property
+    def moloni_company(self):
+        return self.profile.selected_moloni_company if self.profile else None
+
+    @property
+    def shopify_store(self):
+        return self.profile.selected_shopify_store if self.profile else None
+
+    def _load(self) -> Optional[Profile]:
+        if not self.user.is_authenticated:
+            return None
+
+        cache_key = TenantContext.get_cache_key(self.user.pk)
+        profile = cache.get(cache_key)
+        if profile is not None:
+            return profile
+
+        profile = Profile.objects.select_related(
+            'selected_moloni_company', 'selected_shopify_store'
+        ).filter(user_id=self.user.pk).first()
+        if profile is not None:
+            cache.set(cache_key, profile, getattr(settings, 'TENANT_CONTEXT_CACHE_SECONDS', 30))
+        return profile
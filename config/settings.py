@@ -57,6 +57,50 @@ MOLONI_REDIRECT_URI = 'https://aitigos.com/moloni/callback-moloni/'
 MOLONI_CLIENT_ID = '24850283'
 MOLONI_CLIENT_SECRET = '21e0b5e4374a815882b82dfcaf264ec3fb5aaba5'
 
+# Limites da API Moloni (por empresa, por processo) e envio concorrente de produtos
+MOLONI_RATE_LIMIT_PER_SECOND = float(os.getenv("MOLONI_RATE_LIMIT_PER_SECOND", "5"))
+MOLONI_RATE_LIMIT_BURST = int(os.getenv("MOLONI_RATE_LIMIT_BURST", "10"))
+MOLONI_MAX_RETRIES = int(os.getenv("MOLONI_MAX_RETRIES", "4"))
+MOLONI_PUSH_WORKERS = int(os.getenv("MOLONI_PUSH_WORKERS", "4"))
+MOLONI_SYNC_DETAIL_WORKERS = int(os.getenv("MOLONI_SYNC_DETAIL_WORKERS", "4"))
+MOLONI_SYNC_CATEGORY_WORKERS = int(os.getenv("MOLONI_SYNC_CATEGORY_WORKERS", "4"))
+
+# Cliente HTTP Moloni: pool keep-alive por processo (cobre workers de envio/sincronização e threads do gunicorn)
+MOLONI_HTTP_POOL_CONNECTIONS = int(os.getenv("MOLONI_HTTP_POOL_CONNECTIONS", "4"))
+MOLONI_HTTP_POOL_MAXSIZE = int(os.getenv("MOLONI_HTTP_POOL_MAXSIZE", "20"))
+MOLONI_CONNECT_TIMEOUT = float(os.getenv("MOLONI_CONNECT_TIMEOUT", "5"))
+MOLONI_READ_TIMEOUT = float(os.getenv("MOLONI_READ_TIMEOUT", "60"))
+MOLONI_SLOW_REQUEST_SECONDS = float(os.getenv("MOLONI_SLOW_REQUEST_SECONDS", "5"))
+
+# Tokens Moloni: renovação proativa em background e lock distribuído (uma renovação por empresa).
+# O lock nunca dura menos do que ligação + leitura + 15s (ver MoloniTokenManager.get_lock_timeout)
+MOLONI_TOKEN_PROACTIVE_MINUTES = int(os.getenv("MOLONI_TOKEN_PROACTIVE_MINUTES", "25"))
+MOLONI_TOKEN_LOCK_TIMEOUT = int(os.getenv("MOLONI_TOKEN_LOCK_TIMEOUT", "80"))
+MOLONI_TOKEN_WAIT_SECONDS = int(os.getenv("MOLONI_TOKEN_WAIT_SECONDS", "20"))
+
+# Sincronização do catálogo: incremental (getModifiedSince) com reconciliação completa periódica
+MOLONI_FULL_RECONCILE_HOURS = int(os.getenv("MOLONI_FULL_RECONCILE_HOURS", "24"))
+MOLONI_DELTA_SYNC_OVERLAP_SECONDS = int(os.getenv("MOLONI_DELTA_SYNC_OVERLAP_SECONDS", "300"))
+
+# Shopify Admin API
+SHOPIFY_API_VERSION = os.getenv("SHOPIFY_API_VERSION", "2024-07")
+SHOPIFY_API_BASE_URL = os.getenv("SHOPIFY_API_BASE_URL", "")  # ex.: servidor falso local (run_fake_shopify)
+SHOPIFY_REQUEST_TIMEOUT = int(os.getenv("SHOPIFY_REQUEST_TIMEOUT", "60"))
+SHOPIFY_MAX_RETRIES = int(os.getenv("SHOPIFY_MAX_RETRIES", "4"))
+SHOPIFY_HTTP_POOL_MAXSIZE = int(os.getenv("SHOPIFY_HTTP_POOL_MAXSIZE", "10"))
+SHOPIFY_REST_LEAK_RATE = float(os.getenv("SHOPIFY_REST_LEAK_RATE", "2"))  # pedidos/s do bucket REST de 40 (ajustado pelo cabeçalho)
+SHOPIFY_PRODUCT_SET_BATCH_SIZE = int(os.getenv("SHOPIFY_PRODUCT_SET_BATCH_SIZE", "10"))
+
+# Sincronização do catálogo: lojas com mais variantes do que o limite usam bulk operation (JSONL)
+SHOPIFY_BULK_SYNC_VARIANT_THRESHOLD = int(os.getenv("SHOPIFY_BULK_SYNC_VARIANT_THRESHOLD", "20000"))
+SHOPIFY_BULK_POLL_INTERVAL = float(os.getenv("SHOPIFY_BULK_POLL_INTERVAL", "5"))
+SHOPIFY_BULK_TIMEOUT = int(os.getenv("SHOPIFY_BULK_TIMEOUT", "3600"))
+# Idade máxima do espelho local antes de a página de produtos pedir uma sincronização em background
+SHOPIFY_MIRROR_MAX_AGE_MINUTES = int(os.getenv("SHOPIFY_MIRROR_MAX_AGE_MINUTES", "60"))
+
+# Webhooks (HMAC assinado com o segredo da app Shopify)
+SHOPIFY_WEBHOOK_SECRET = os.getenv("SHOPIFY_WEBHOOK_SECRET", os.getenv("SHOPIFY_API_SECRET", ""))
+
 
 # Current DJANGO_ENVIRONMENT
 ENVIRONMENT = os.environ.get("DJANGO_ENVIRONMENT", default="local")
@@ -84,6 +128,7 @@ INSTALLED_APPS = [
     "apps.shopify",
     "apps.product_shopify",
     "apps.product_moloni",
+    "apps.jobs",
 
 ]
 
@@ -95,6 +140,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "auth.middleware.TenantContextMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     'apps.moloni.middleware.MoloniTokenRefreshMiddleware',
@@ -243,6 +289,37 @@ LOGIN_REDIRECT_URL = "/dashboard/"
 DATA_UPLOAD_MAX_MEMORY_SIZE = 52428800  # 50 MB
 FILE_UPLOAD_MAX_MEMORY_SIZE = 52428800  # 50 MB
 
+# Serviço de extração (IA)
+# ------------------------------------------------------------------------------
+AITIGOS_EXTRACTION_API_URL = os.getenv("API_BASE_URL", "http://172.20.141.28:8011")
+AITIGOS_EXTRACTION_POLL_INTERVAL = float(os.getenv("AITIGOS_EXTRACTION_POLL_INTERVAL", "2"))
+AITIGOS_EXTRACTION_MAX_ATTEMPTS = int(os.getenv("AITIGOS_EXTRACTION_MAX_ATTEMPTS", "30"))
+AITIGOS_EXTRACTION_REQUEST_TIMEOUT = int(os.getenv("AITIGOS_EXTRACTION_REQUEST_TIMEOUT", "60"))
+
+# Cache de resultados por conteúdo (SHA-256 do PDF + versão do extrator)
+AITIGOS_EXTRACTOR_VERSION = os.getenv("AITIGOS_EXTRACTOR_VERSION", "1")
+AITIGOS_EXTRACTION_CACHE_TTL = int(os.getenv("AITIGOS_EXTRACTION_CACHE_TTL", str(30 * 24 * 3600)))
+AITIGOS_EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("AITIGOS_EXTRACTION_CACHE_MAX_ENTRIES", "500"))
+AITIGOS_EXTRACTION_CACHE_MAX_BYTES = int(os.getenv("AITIGOS_EXTRACTION_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+AITIGOS_EXTRACTION_CACHE_MAX_ENTRY_BYTES = int(os.getenv("AITIGOS_EXTRACTION_CACHE_MAX_ENTRY_BYTES", str(5 * 1024 * 1024)))
+
+# Jobs em background (manage.py run_jobs)
+# ------------------------------------------------------------------------------
+JOBS_POLL_INTERVAL = float(os.getenv("JOBS_POLL_INTERVAL", "2"))
+JOBS_MAX_CONCURRENT_PER_KEY = int(os.getenv("JOBS_MAX_CONCURRENT_PER_KEY", "2"))
+JOBS_RETENTION_DAYS = int(os.getenv("JOBS_RETENTION_DAYS", "14"))
+
+# Progresso por server-sent events: cada ligação ocupa uma thread do gunicorn,
+# por isso fecha ao fim de SSE_MAX_DURATION segundos e o browser volta a ligar-se
+SSE_MAX_DURATION = int(os.getenv("SSE_MAX_DURATION", "60"))
+SSE_HEARTBEAT = int(os.getenv("SSE_HEARTBEAT", "15"))
+# Ligações SSE em simultâneo por processo. Com gunicorn-cfg.py (9 workers x 4
+# threads) o valor 2 permite 18 streams e deixa sempre 2 threads por worker para
+# os restantes pedidos; acima do limite a view responde 503 e o browser faz
+# polling a cada 2s. Subir o valor dá mais streams à custa de pedidos normais
+# em fila; para muitas ligações longas usar um worker ASGI/async dedicado.
+SSE_MAX_STREAMS_PER_PROCESS = int(os.getenv("SSE_MAX_STREAMS_PER_PROCESS", "2"))
+
 
 # Configuração de sessões
 SESSION_ENGINE = os.getenv("SESSION_ENGINE", "django.contrib.sessions.backends.db")
@@ -251,6 +328,9 @@ SESSION_COOKIE_HTTPONLY = os.getenv("SESSION_COOKIE_HTTPONLY", "True").lower() i
 SESSION_COOKIE_SAMESITE = os.getenv("SESSION_COOKIE_SAMESITE", "Lax")
 SESSION_COOKIE_AGE = int(os.getenv("SESSION_COOKIE_AGE", "3600"))
 
+# Seleções do utilizador (empresa Moloni / loja Shopify) em cache por pedido, ver auth.tenant
+TENANT_CONTEXT_CACHE_SECONDS = int(os.getenv("TENANT_CONTEXT_CACHE_SECONDS", "30"))
+
 LOGGING = {
     'version': 1,
     'disable_existing_loggers': False,
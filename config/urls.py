@@ -37,6 +37,8 @@ urlpatterns = [
     path('product-shopify/', include('apps.product_shopify.urls')),
 
     path('shopify/', include('apps.shopify.urls', namespace='shopify')),
+
+    path('jobs/', include('apps.jobs.urls')),
 ]
 
 handler404 = SystemView.as_view(template_name="pages_misc_error.html", status=404)